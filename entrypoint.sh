@@ -11,4 +11,21 @@ dicomsrtssdir="/home/gaelo_pathology_processing/storage/wsi"
 ### Check for rtss dir, if not found create it using the mkdir ##
 [ ! -d "$dicomsrtssdir" ] && mkdir -p "$dicomsrtssdir"
 
-exec "$@"
\ No newline at end of file
+python manage.py migrate --noinput
+
+### Stage metrics of the previous run are dropped, each process writes its own file ##
+rm -rf "${METRICS_DIR:-/tmp/gaelo_pathology_metrics}"
+
+### Background worker running the conversion jobs queued by /tools/conversion/jobs, next to the server ##
+python manage.py run_conversion_worker &
+worker_pid=$!
+"$@" &
+server_pid=$!
+
+### The container stops (to be restarted) as soon as the worker or the server exits ##
+trap 'kill -TERM "$worker_pid" "$server_pid" 2>/dev/null' TERM INT
+status=0
+wait -n || status=$?
+kill -TERM "$worker_pid" "$server_pid" 2>/dev/null || true
+wait || true
+exit "$status"
\ No newline at end of file
@@ -0,0 +1,6 @@
+"""
+Benchmarks for GaelO Pathology Processing.
+
+They are not part of the test suite, run them from the src folder, ex :
+python -m benchmarks.upload_memory --size-gb 4
+"""
@@ -0,0 +1,83 @@
+"""
+Compares the bytes read and written (/proc/self/io rchar and wchar) to build the study zip in the dicoms
+storage with the previous chain (zip in a temporary file copied in the storage) and the streaming one
+(DicomArchiveWriter in open_storage_writer).
+
+Linux only.
+"""
+import argparse
+import json
+import os
+import tempfile
+import uuid
+import zipfile
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                      'gaelo_pathology_processing.settings')
+django.setup()
+
+from gaelo_pathology_processing.services.archive_writer import DicomArchiveWriter  # noqa: E402
+from gaelo_pathology_processing.services.conversion import add_files_to_zip  # noqa: E402
+from gaelo_pathology_processing.services.file_helper import (  # noqa: E402
+    delete_file, move_to_storage, open_storage_writer)
+from gaelo_pathology_processing.tests.synthetic import write_wsi_instance  # noqa: E402
+
+
+def read_io() -> tuple[int, int]:
+    with open('/proc/self/io') as io_file:
+        counters = dict(line.split(': ') for line in io_file.read().splitlines())
+    return int(counters['rchar']), int(counters['wchar'])
+
+
+def legacy_chain(folder: str, filename: str) -> None:
+    with tempfile.NamedTemporaryFile(suffix='.zip') as zip_temp_file:
+        with zipfile.ZipFile(zip_temp_file.name, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for root, dirs, files in os.walk(folder):
+                for file in sorted(files):
+                    zip_file.write(os.path.join(root, file), str(uuid.uuid4()))
+        move_to_storage('dicoms', zip_temp_file.name, filename)
+
+
+def streaming_chain(folder: str, filename: str) -> None:
+    with open_storage_writer('dicoms', filename) as zip_storage_file:
+        with DicomArchiveWriter(zip_storage_file) as archive:
+            add_files_to_zip(folder, archive)
+
+
+def measure(chain, folder: str) -> dict:
+    filename = f'benchmark-{uuid.uuid4()}.zip'
+    read_before, written_before = read_io()
+    chain(folder, filename)
+    read_after, written_after = read_io()
+    delete_file('dicoms', filename)
+    return {'read_bytes': read_after - read_before,
+            'written_bytes': written_after - written_before}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--folder', help='Folder of DICOM instances, synthetic instances if not set')
+    parser.add_argument('--instances', type=int, default=8)
+    parser.add_argument('--frames', type=int, default=64,
+                        help='Number of tiles per synthetic instance')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as synthetic_folder:
+        folder = args.folder
+        if folder is None:
+            folder = synthetic_folder
+            for index in range(args.instances):
+                write_wsi_instance(os.path.join(folder, f'{index}.dcm'),
+                                   frames=args.frames, seed=index)
+        input_size = sum(os.path.getsize(os.path.join(root, file))
+                         for root, dirs, files in os.walk(folder) for file in files)
+        results = {'input_bytes': input_size,
+                   'legacy': measure(legacy_chain, folder),
+                   'streaming': measure(streaming_chain, folder)}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
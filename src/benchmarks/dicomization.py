@@ -0,0 +1,185 @@
+"""
+Benchmarks the dicomization backends (OrthancWSIDicomizer, its in-process replacement, wsidicomizer) with
+each output profile on synthetic slides, from the slide to the DICOM zip of the study.
+
+Each run is done in a fresh process so its peak RSS is its own. Reports wall time, CPU time (with the
+dicomizer and transcoding subprocesses), peak RSS, zip size and tiles/s as JSON. With --baseline, the
+results are compared with a previous output and the exit status is 1 if the tiles/s of a run regressed
+more than --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                      'gaelo_pathology_processing.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from pydicom import dcmread  # noqa: E402
+from pydicom.uid import generate_uid  # noqa: E402
+
+from gaelo_pathology_processing.services.abstractDicomizer import (  # noqa: E402
+    BigPictureDicomizer, NativeDicomizer, OrthancDicomizer)
+from gaelo_pathology_processing.services.archive_writer import DicomArchiveWriter  # noqa: E402
+from gaelo_pathology_processing.services.conversion import add_files_to_zip  # noqa: E402
+from gaelo_pathology_processing.services.output_profile import OUTPUT_PROFILES  # noqa: E402
+from gaelo_pathology_processing.services.probe import probe_wsi  # noqa: E402
+from gaelo_pathology_processing.services.utils import create_process_pool  # noqa: E402
+from gaelo_pathology_processing.tests.synthetic import write_svs_slide, write_tiff_slide  # noqa: E402
+
+BACKENDS = {'orthanc': OrthancDicomizer, 'native': NativeDicomizer, 'bigpicture': BigPictureDicomizer}
+SLIDE_WRITERS = {'svs': write_svs_slide, 'tiff': write_tiff_slide}
+DICOM_TAGS = {'PatientID': 'Benchmark', 'PatientName': 'Benchmark'}
+
+
+def get_cpu_time() -> float:
+    """CPU time of this process and of its terminated subprocesses"""
+    cpu_time = 0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        cpu_time += usage.ru_utime + usage.ru_stime
+    return cpu_time
+
+
+def get_peak_rss() -> int:
+    """Highest peak RSS in bytes of this process and of its largest terminated subprocess"""
+    return max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)) * 1024
+
+
+def convert(backend: str, profile_name: str, slide_path: str, sparse_tiling: bool) -> dict:
+    """Converts the slide to a DICOM zip like a conversion request, run in its own process"""
+    profile = OUTPUT_PROFILES[profile_name]
+    probe = probe_wsi(slide_path)
+    with tempfile.TemporaryDirectory() as folder, tempfile.TemporaryFile() as zip_file:
+        start_time, start_cpu_time = time.perf_counter(), get_cpu_time()
+        BACKENDS[backend](profile, probe, sparse_tiling=sparse_tiling).convert(generate_uid(), DICOM_TAGS, slide_path, folder)
+        tiles = sum(int(dcmread(path, stop_before_pixels=True).get('NumberOfFrames', 1))
+                    for path in Path(folder).rglob('*') if path.is_file())
+        transcode_pool = create_process_pool(settings.TRANSCODE_WORKERS) if (
+            profile.transcode_jpeg_ls and settings.TRANSCODE_WORKERS > 1) else None
+        try:
+            with DicomArchiveWriter(zip_file) as archive:
+                add_files_to_zip(folder, archive, profile.transcode_jpeg_ls, transcode_pool)
+                instances = archive.number_of_instances
+        finally:
+            if transcode_pool is not None:
+                # the processes are waited for so their CPU time is counted
+                transcode_pool.shutdown()
+        duration = time.perf_counter() - start_time
+        return {
+            'wall_s': round(duration, 3),
+            'cpu_s': round(get_cpu_time() - start_cpu_time, 3),
+            'peak_rss_bytes': get_peak_rss(),
+            'output_bytes': zip_file.tell(),
+            'instances': instances,
+            'tiles': tiles,
+            'tiles_per_s': round(tiles / duration, 2),
+        }
+
+
+def run(backend: str, profile_name: str, slide_path: str, repeat: int, sparse_tiling: bool) -> dict:
+    """Median of repeat runs, or the error of the first failing run"""
+    if backend in ('orthanc', 'native') and OUTPUT_PROFILES[profile_name].orthanc_arguments is None:
+        return {'skipped': 'OrthancWSIDicomizer does not produce this profile'}
+    runs = []
+    for _ in range(repeat):
+        with create_process_pool(1) as pool:
+            try:
+                runs.append(pool.submit(convert, backend, profile_name, slide_path, sparse_tiling).result())
+            except Exception as e:
+                return {'error': str(e)}
+    result = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    result['runs'] = runs
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> tuple[dict, bool]:
+    """Ratios of the results to the baseline runs with the same backend and profile, and if one regressed"""
+    comparison = {}
+    regressed = False
+    for key, result in results.items():
+        baseline_result = baseline['results'].get(key, {})
+        if 'tiles_per_s' not in result or 'tiles_per_s' not in baseline_result:
+            continue
+        ratio = result['tiles_per_s'] / baseline_result['tiles_per_s']
+        comparison[key] = {
+            'tiles_per_s_ratio': round(ratio, 3),
+            'wall_s_ratio': round(result['wall_s'] / baseline_result['wall_s'], 3),
+            'peak_rss_ratio': round(result['peak_rss_bytes'] / baseline_result['peak_rss_bytes'], 3),
+            'regression': ratio < 1 - tolerance,
+        }
+        regressed = regressed or comparison[key]['regression']
+    return comparison, regressed
+
+
+def get_environment() -> dict:
+    versions = {}
+    for package in ('wsidicomizer', 'wsidicom', 'openslide-python', 'pydicom', 'pylibjpeg-libjpeg'):
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = None
+    return {'python': platform.python_version(), 'machine': platform.machine(), 'cpu_count': os.cpu_count(),
+            'transcode_workers': settings.TRANSCODE_WORKERS, 'packages': versions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--format', choices=SLIDE_WRITERS.keys(), default='svs',
+                        help='Format of the synthetic slide')
+    parser.add_argument('--size', type=int, default=4096,
+                        help='Width and height in pixels of the synthetic slide')
+    parser.add_argument('--tile-size', type=int, default=256)
+    parser.add_argument('--levels', type=int, default=3)
+    parser.add_argument('--tissue', type=float, default=1,
+                        help='Diameter of the tissue disc of the synthetic slide relative to its size, glass around')
+    parser.add_argument('--sparse-tiling', action='store_true',
+                        help='Write only the tiles of the tissue (native backend)')
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS.keys(), default=list(BACKENDS.keys()))
+    parser.add_argument('--profiles', nargs='+', choices=OUTPUT_PROFILES.keys(),
+                        default=list(OUTPUT_PROFILES.keys()))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs of each backend and profile, the median is reported')
+    parser.add_argument('--output', help='File to write the JSON results in, to use later as baseline')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Accepted decrease of tiles/s compared to the baseline (0.1 for 10%%)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        slide_path = os.path.join(folder, f'slide.{args.format}')
+        SLIDE_WRITERS[args.format](slide_path, args.size, args.tile_size, args.levels, tissue=args.tissue)
+        results = {f'{backend}/{profile}': run(backend, profile, slide_path, args.repeat, args.sparse_tiling)
+                   for backend in args.backends for profile in args.profiles}
+
+    output = {
+        'slide': {'format': args.format, 'size': args.size, 'tile_size': args.tile_size, 'levels': args.levels,
+                  'tissue': args.tissue},
+        'sparse_tiling': args.sparse_tiling,
+        'environment': get_environment(),
+        'results': results,
+    }
+    regressed = False
+    if args.baseline:
+        with open(args.baseline) as file:
+            output['comparison'], regressed = compare(results, json.load(file), args.tolerance)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(output, file, indent=2)
+    print(json.dumps(output, indent=2))
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Load test of concurrent downloads of a stored DICOM zip, served by gunicorn with sync workers (WSGI) and
+with uvicorn workers (ASGI, async views).
+
+Each server is started with --workers processes, then --clients clients download the file at once, at most
+--client-rate bytes/s each to simulate slow networks. Meanwhile a client requests the welcome page to
+measure the latency of the other requests. Reports the time to first byte and the duration of the downloads
+and the latency of the welcome page, p50, p95 and max, in milliseconds.
+"""
+import argparse
+import base64
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+import requests
+from requests.adapters import HTTPAdapter
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                      'gaelo_pathology_processing.settings')
+django.setup()
+
+from gaelo_pathology_processing.services.file_helper import delete_file, move_to_storage  # noqa: E402
+
+SERVERS = {
+    'wsgi': ['--worker-class', 'sync', 'gaelo_pathology_processing.wsgi:application'],
+    'asgi': ['--worker-class', 'uvicorn_worker.UvicornWorker', 'gaelo_pathology_processing.asgi:application'],
+}
+DOWNLOAD_ID = 'benchmark-download'
+READ_SIZE = 64 * 1024
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(server: str, port: int, workers: int) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+         '--timeout', '900', *SERVERS[server]],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    for _ in range(300):
+        try:
+            requests.get(f'http://127.0.0.1:{port}/', timeout=5)
+            break
+        except requests.RequestException:
+            time.sleep(0.1)
+    else:
+        process.kill()
+        raise RuntimeError(f'The {server} server did not start')
+    # the workers load the views on their first request
+    with ThreadPoolExecutor(workers * 4) as executor:
+        list(executor.map(lambda _: requests.get(f'http://127.0.0.1:{port}/', timeout=60), range(workers * 16)))
+    return process
+
+
+def summarize(latencies: list[float]) -> dict:
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(latencies[max(int(len(latencies) * 0.95) - 1, 0)], 2),
+        'max_ms': round(latencies[-1], 2),
+    }
+
+
+def run(server: str, workers: int, clients: int, client_rate: int, authorization: str) -> dict:
+    port = get_free_port()
+    process = start_server(server, port, workers)
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(pool_maxsize=clients + 1))
+    done = threading.Event()
+
+    def download(_) -> tuple[float, float, int]:
+        start = time.perf_counter()
+        with session.get(f'http://127.0.0.1:{port}/dicom/{DOWNLOAD_ID}', headers={'Authorization': authorization},
+                         stream=True, timeout=900) as response:
+            response.raise_for_status()
+            first_byte = None
+            received = 0
+            for chunk in response.iter_content(READ_SIZE):
+                if first_byte is None:
+                    first_byte = time.perf_counter()
+                received += len(chunk)
+                if client_rate:
+                    # the client reads no faster than its rate
+                    time.sleep(max(start + received / client_rate - time.perf_counter(), 0))
+        end = time.perf_counter()
+        return (first_byte - start) * 1000, (end - start) * 1000, received
+
+    def probe() -> list[float]:
+        latencies = []
+        while not done.is_set():
+            start = time.perf_counter()
+            requests.get(f'http://127.0.0.1:{port}/', timeout=900)
+            latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.05)
+        return latencies
+
+    try:
+        with ThreadPoolExecutor(1) as probe_executor:
+            probe_latencies = probe_executor.submit(probe)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(clients) as executor:
+                results = list(executor.map(download, range(clients)))
+            duration = time.perf_counter() - start
+            done.set()
+        received = sum(result[2] for result in results)
+        return {
+            'time_to_first_byte': summarize([result[0] for result in results]),
+            'download': summarize([result[1] for result in results]),
+            'welcome_latency': summarize(probe_latencies.result()),
+            'throughput_mb_per_s': round(received / duration / 1024 / 1024, 2),
+        }
+    finally:
+        done.set()
+        session.close()
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--servers', nargs='+', choices=SERVERS.keys(), default=list(SERVERS.keys()))
+    parser.add_argument('--workers', type=int, default=3, help='Server worker processes')
+    parser.add_argument('--clients', type=int, default=200, help='Concurrent downloads')
+    parser.add_argument('--size', type=int, default=16 * 1024 * 1024, help='Size in bytes of the downloaded file')
+    parser.add_argument('--client-rate', type=int, default=4 * 1024 * 1024,
+                        help='Maximum bytes/s read by each client, 0 for no limit')
+    parser.add_argument('--user', default='GaelO:GaelO', help='login:password of a registered user')
+    args = parser.parse_args()
+
+    authorization = 'Basic ' + base64.b64encode(args.user.encode()).decode()
+    with tempfile.NamedTemporaryFile(delete=False) as file:
+        file.write(os.urandom(args.size))
+    move_to_storage('dicoms', file.name, DOWNLOAD_ID + '.zip')
+    os.remove(file.name)
+    try:
+        results = {server: run(server, args.workers, args.clients, args.client_rate, authorization)
+                   for server in args.servers}
+    finally:
+        delete_file('dicoms', DOWNLOAD_ID + '.zip')
+    print(json.dumps({'workers': args.workers, 'clients': args.clients, 'size': args.size,
+                      'client_rate': args.client_rate, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
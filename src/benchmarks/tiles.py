@@ -0,0 +1,83 @@
+"""
+Measures the latency of the DeepZoom tiles of a synthetic slide requested by concurrent viewers, with the
+tile cache cold (tiles read and encoded) then warm (panning back over the same tiles).
+
+Reports the p50, p95 and max latency in milliseconds of each pass.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                      'gaelo_pathology_processing.settings')
+django.setup()
+
+from gaelo_pathology_processing.services.deepzoom import close_opened_slide, get_tile  # noqa: E402
+from gaelo_pathology_processing.services.file_helper import delete_file, get_hash, move_to_storage  # noqa: E402
+from gaelo_pathology_processing.services.probe import probe_wsi  # noqa: E402
+from gaelo_pathology_processing.services.slide_pool import open_slide_handle  # noqa: E402
+from gaelo_pathology_processing.services.wsi_index import delete_wsi_index, index_wsi  # noqa: E402
+from gaelo_pathology_processing.tests.synthetic import write_tiff_slide  # noqa: E402
+
+
+async def request_tiles(wsi_id: str, tiles: list[tuple[int, int, int]], viewers: int) -> dict:
+    # at most viewers tiles requested at once, as the async tile view does
+    requests = asyncio.Semaphore(viewers)
+
+    async def request_tile(tile: tuple[int, int, int]) -> float:
+        async with requests:
+            start = time.perf_counter()
+            await get_tile(wsi_id, *tile)
+            return (time.perf_counter() - start) * 1000
+
+    latencies = sorted(await asyncio.gather(*(request_tile(tile) for tile in tiles)))
+    return {
+        'tiles': len(latencies),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 2),
+        'max_ms': round(latencies[-1], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=8192,
+                        help='Width and height in pixels of the synthetic slide')
+    parser.add_argument('--viewers', type=int, default=8,
+                        help='Number of concurrent tile requests')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'slide.tiff')
+        write_tiff_slide(path, args.size, levels=4)
+        wsi_id = get_hash(path)
+        probe = probe_wsi(path)
+        index_wsi(wsi_id, path, probe)
+        move_to_storage('wsi', path, wsi_id)
+    try:
+        with open_slide_handle(wsi_id, lambda: probe) as handle:
+            deepzoom = handle.deepzoom
+        # the 2 highest resolution levels, as seen while panning
+        tiles = [(level, column, row) for level in range(deepzoom.level_count - 2, deepzoom.level_count)
+                 for column in range(deepzoom.level_tiles[level][0])
+                 for row in range(deepzoom.level_tiles[level][1])]
+        random.Random(0).shuffle(tiles)
+        results = {'viewers': args.viewers,
+                   'cold': asyncio.run(request_tiles(wsi_id, tiles, args.viewers)),
+                   'warm': asyncio.run(request_tiles(wsi_id, tiles, args.viewers))}
+    finally:
+        close_opened_slide(wsi_id)
+        delete_file('wsi', wsi_id)
+        delete_wsi_index(wsi_id)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Compares the serial and the pipelined JPEG-LS transcoding of add_files_to_zip on synthetic instances.
+
+Reports instances/s and bytes/s (of transcoded DICOM written in the zip) for each mode.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                      'gaelo_pathology_processing.settings')
+django.setup()
+
+from gaelo_pathology_processing.services.archive_writer import DicomArchiveWriter  # noqa: E402
+from gaelo_pathology_processing.services.conversion import add_files_to_zip  # noqa: E402
+from gaelo_pathology_processing.services.utils import create_process_pool  # noqa: E402
+from gaelo_pathology_processing.tests.synthetic import write_wsi_instance  # noqa: E402
+
+
+def run(folder: str, workers: int) -> dict:
+    with tempfile.NamedTemporaryFile(suffix='.zip') as zip_temp_file:
+        start = time.perf_counter()
+        with DicomArchiveWriter(zip_temp_file) as archive:
+            if workers > 1:
+                with create_process_pool(workers) as pool:
+                    # spawns the processes before measuring
+                    list(pool.map(abs, range(workers)))
+                    start = time.perf_counter()
+                    instances = add_files_to_zip(folder, archive, True, pool)
+            else:
+                instances = add_files_to_zip(folder, archive, True)
+        duration = time.perf_counter() - start
+        size = zip_temp_file.seek(0, 2)
+    return {
+        'workers': workers,
+        'instances': instances,
+        'duration_s': round(duration, 3),
+        'instances_per_s': round(instances / duration, 2),
+        'bytes_per_s': round(size / duration),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--instances', type=int, default=16)
+    parser.add_argument('--frames', type=int, default=64,
+                        help='Number of tiles per instance')
+    parser.add_argument('--tile-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Processes of the pipelined transcoding')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        for index in range(args.instances):
+            write_wsi_instance(os.path.join(folder, f'{index}.dcm'),
+                               args.tile_size, args.frames, seed=index)
+        results = {'serial': run(folder, 1),
+                   'pipelined': run(folder, args.workers)}
+    results['speedup'] = round(
+        results['serial']['duration_s'] / results['pipelined']['duration_s'], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Measures the peak RSS of the worker while a multi-GB WSI is uploaded through POST /wsi, served by the ASGI
+application as the uvicorn workers of production do.
+
+The body is generated on the fly and sent as ASGI http.request messages, so the benchmark
+itself does not hold the payload in memory. The upload is refused at format detection
+(random content) which does not matter here : the whole body has been read, hashed
+and written to disk at that point.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import resource
+import sys
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE',
+                      'gaelo_pathology_processing.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.handlers.asgi import ASGIHandler  # noqa: E402
+from django.urls import get_resolver  # noqa: E402
+
+BLOCK_SIZE = 1024 * 1024
+
+
+class GeneratedBody:
+    """ASGI receive callable returning size bytes of a repeated random block, one block per message"""
+
+    def __init__(self, size: int):
+        self.remaining = size
+        self.block = os.urandom(BLOCK_SIZE)
+
+    async def __call__(self) -> dict:
+        if self.remaining < 0:
+            # the body is sent, the handler listens for a disconnection until the response is sent
+            await asyncio.Future()
+        size = min(self.remaining, BLOCK_SIZE)
+        self.remaining -= size
+        more_body = self.remaining > 0
+        if not more_body:
+            self.remaining = -1
+        return {'type': 'http.request', 'body': self.block[:size], 'more_body': more_body}
+
+
+def get_peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def upload(size: int) -> int:
+    username, password = next(iter(json.loads(settings.REGISTERED_USERS).items()))
+    credentials = base64.b64encode(f'{username}:{password}'.encode('utf-8'))
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'POST',
+        'scheme': 'http',
+        'path': '/wsi',
+        'raw_path': b'/wsi',
+        'query_string': b'',
+        'root_path': '',
+        'headers': [
+            (b'host', b'localhost:8000'),
+            (b'content-type', b'application/octet-stream'),
+            (b'content-length', str(size).encode('utf-8')),
+            (b'authorization', b'Basic ' + credentials),
+        ],
+        'client': ('127.0.0.1', 0),
+        'server': ('localhost', 8000),
+    }
+    status = []
+
+    async def send(message: dict) -> None:
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    asyncio.run(ASGIHandler()(scope, GeneratedBody(size), send))
+    return status[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-gb', type=float, default=2)
+    parser.add_argument('--max-rss-increase-mb', type=float, default=64,
+                        help='Fails if the peak RSS grows more than this during the upload')
+    args = parser.parse_args()
+
+    size = int(args.size_gb * 1024 ** 3)
+    # Imports the views (openslide, wsidicomizer...) before the measure
+    get_resolver().url_patterns
+    rss_before = get_peak_rss_mb()
+    start = time.perf_counter()
+    status = upload(size)
+    duration = time.perf_counter() - start
+    rss_increase = get_peak_rss_mb() - rss_before
+
+    result = {
+        'upload_size_bytes': size,
+        'http_status': status,
+        'duration_s': round(duration, 2),
+        'throughput_mb_s': round(size / 1024 ** 2 / duration, 1),
+        'peak_rss_before_mb': round(rss_before, 1),
+        'peak_rss_increase_mb': round(rss_increase, 1),
+    }
+    print(json.dumps(result, indent=2))
+    if rss_increase > args.max_rss_increase_mb:
+        sys.exit(f'Peak RSS grew by {rss_increase:.1f} MB, more than {
+                 args.max_rss_increase_mb} MB')
+
+
+if __name__ == '__main__':
+    main()
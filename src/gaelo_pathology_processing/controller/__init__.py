@@ -2,4 +2,8 @@ from .welcome.welcome_view import WelcomeView
 from .dicoms.dicom_view import DicomView
 from .wsi.wsi_view import WsiView
 from .wsi.wsi_metadata import WsiMetadata
-from .tools.convert_to_dicom import ConvertToDicomView
\ No newline at end of file
+from .wsi.wsi_deepzoom import WsiDeepZoomView, WsiTileView, WsiThumbnailView
+from .wsi.wsi_uploads import WsiUploadsView, WsiUploadView, WsiUploadFinalizeView
+from .tools.convert_to_dicom import ConvertToDicomView
+from .tools.conversion_jobs import ConversionJobsView, ConversionJobView, ConversionJobCancelView
+from .metrics.metrics_view import MetricsView
\ No newline at end of file
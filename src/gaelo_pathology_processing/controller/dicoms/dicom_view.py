@@ -1,29 +1,23 @@
+from adrf.views import APIView
 from rest_framework.request import Request
 from rest_framework.response import Response
-from rest_framework.views import APIView
-from django.http import FileResponse, HttpResponse
+from django.http import HttpResponse
 from ...exceptions import GaelONotFoundException
 
-from gaelo_pathology_processing.services.file_helper import get_file, is_file_exists, delete_file
+from gaelo_pathology_processing.services.download import create_download_response
+from gaelo_pathology_processing.services.file_helper import is_file_exists, delete_file
+from gaelo_pathology_processing.services.utils import run_in_thread
 
 
 class DicomView(APIView):
-    def get(self, request: Request, id: str) -> HttpResponse:
+    async def get(self, request: Request, id: str) -> HttpResponse:
         """Retrieves a ZIP containing the DICOM folder associated with the given ID and downloads it from storage."""
-        try:
-            file = get_file('dicoms', id + '.zip')
-            response = FileResponse(file, as_attachment=True)
-            response['Content-Disposition'] = f'attachment; filename="{
-                id}.zip"'
-            response['Content-Type'] = 'application/zip'
+        # a study zip is written once under its study instance uid, which identifies its content
+        return await run_in_thread(create_download_response)(request, 'dicoms', id + '.zip', id + '.zip',
+                                                             'application/zip', f'"{id}"')
 
-            return response
-
-        except Exception as e:
-            return Response({"error": str(e)}, status=500)
-        
-    def delete(self, request : Request, id : str):
-        if not is_file_exists('dicoms', id):
+    async def delete(self, request : Request, id : str):
+        if not await run_in_thread(is_file_exists)('dicoms', id):
             raise GaelONotFoundException("File doesn't exist")
-        delete_file('dicoms', id)
+        await run_in_thread(delete_file)('dicoms', id)
         return Response(status=200)
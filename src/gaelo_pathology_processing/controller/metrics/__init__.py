@@ -0,0 +1 @@
+from .metrics_view import MetricsView
\ No newline at end of file
@@ -0,0 +1,20 @@
+from django.db.models import Count
+from django.http import HttpResponse
+from rest_framework.request import Request
+from rest_framework.views import APIView
+
+from gaelo_pathology_processing.models import ConversionJob
+from gaelo_pathology_processing.services.metrics import render_metrics
+
+
+class MetricsView(APIView):
+    """
+    Prometheus metrics of the upload and conversion stages and of the conversion jobs
+    """
+
+    def get(self, request: Request) -> HttpResponse:
+        jobs = {status: 0 for status, label in ConversionJob.STATUS_CHOICES}
+        for row in ConversionJob.objects.values('status').annotate(count=Count('id')):
+            jobs[row['status']] = row['count']
+        metrics = render_metrics({'gaelo_conversion_jobs': ('Conversion jobs by status', jobs)})
+        return HttpResponse(metrics, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1 +1,2 @@
-from .convert_to_dicom import ConvertToDicomView
\ No newline at end of file
+from .convert_to_dicom import ConvertToDicomView
+from .conversion_jobs import ConversionJobsView, ConversionJobView, ConversionJobCancelView
\ No newline at end of file
@@ -0,0 +1,52 @@
+import json
+from uuid import UUID
+
+from rest_framework.request import Request
+from rest_framework.views import APIView
+from rest_framework.response import Response
+
+from gaelo_pathology_processing.exceptions import GaelOException, GaelONotFoundException
+from gaelo_pathology_processing.models import ConversionJob
+from gaelo_pathology_processing.services.conversion_jobs import create_job, cancel_job, serialize_job
+from gaelo_pathology_processing.services.utils import body_to_dict
+
+
+def get_job(id: UUID) -> ConversionJob:
+    try:
+        return ConversionJob.objects.get(id=id)
+    except ConversionJob.DoesNotExist:
+        raise GaelONotFoundException(f"Conversion job {id} doesn't exist")
+
+
+class ConversionJobsView(APIView):
+
+    def post(self, request: Request) -> Response:
+        """
+        Queues a conversion (same body as /tools/conversion) and returns its job id without waiting for it
+        """
+        try:
+            data = body_to_dict(request.body)
+            job = create_job(data)
+            return Response(serialize_job(job), status=202)
+
+        except json.JSONDecodeError:
+            return Response({"error": "Invalid JSON."}, status=400)
+        except GaelOException as e:
+            return Response({"error": str(e)}, status=e.status_code)
+
+
+class ConversionJobView(APIView):
+
+    def get(self, request: Request, id: UUID) -> Response:
+        """Returns the status of a conversion job with the progress of each slide"""
+        return Response(serialize_job(get_job(id)), status=200)
+
+
+class ConversionJobCancelView(APIView):
+
+    def post(self, request: Request, id: UUID) -> Response:
+        try:
+            job = cancel_job(get_job(id))
+            return Response(serialize_job(job), status=200)
+        except GaelOException as e:
+            return Response({"error": str(e)}, status=e.status_code)
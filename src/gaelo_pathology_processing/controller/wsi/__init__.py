@@ -1,2 +1,4 @@
 from .wsi_view import WsiView
 from .wsi_metadata import WsiMetadata
+from .wsi_uploads import WsiUploadsView, WsiUploadView, WsiUploadFinalizeView
+from .wsi_deepzoom import WsiDeepZoomView, WsiTileView, WsiThumbnailView
\ No newline at end of file
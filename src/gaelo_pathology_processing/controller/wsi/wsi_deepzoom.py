@@ -0,0 +1,36 @@
+from adrf.views import APIView
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.request import Request
+
+from gaelo_pathology_processing.exceptions import GaelOBadRequestException
+from gaelo_pathology_processing.services.deepzoom import get_dzi, get_thumbnail, get_tile
+
+# a WSI id is the MD5 of its content, its tiles never change
+TILE_CACHE_CONTROL = 'private, max-age=86400, immutable'
+
+
+class WsiDeepZoomView(APIView):
+    """DeepZoom descriptor of a WSI, to preview it with a DeepZoom viewer (ex : OpenSeadragon)"""
+
+    async def get(self, request: Request, id: str) -> HttpResponse:
+        return HttpResponse(await get_dzi(id), content_type='application/xml')
+
+
+class WsiTileView(APIView):
+    """JPEG tile of the DeepZoom pyramid of a WSI, at the path following the DeepZoom convention"""
+
+    async def get(self, request: Request, id: str, level: int, column: int, row: int) -> HttpResponse:
+        return HttpResponse(await get_tile(id, level, column, row), content_type='image/jpeg',
+                            headers={'Cache-Control': TILE_CACHE_CONTROL})
+
+
+class WsiThumbnailView(APIView):
+    """JPEG thumbnail of a WSI fitting in ?size= pixels (512 by default)"""
+
+    async def get(self, request: Request, id: str) -> HttpResponse:
+        size = request.query_params.get('size', '512')
+        if not size.isdigit() or not 0 < int(size) <= settings.THUMBNAIL_MAX_SIZE:
+            raise GaelOBadRequestException(f"size must be between 1 and {settings.THUMBNAIL_MAX_SIZE}.")
+        return HttpResponse(await get_thumbnail(id, int(size)), content_type='image/jpeg',
+                            headers={'Cache-Control': TILE_CACHE_CONTROL})
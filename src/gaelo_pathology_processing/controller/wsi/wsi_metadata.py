@@ -1,23 +1,12 @@
-from gaelo_pathology_processing.services.file_helper import get_file
-from openslide import (OpenSlide)
+from adrf.views import APIView
+from gaelo_pathology_processing.services.wsi_index import get_wsi_metadata, serialize_wsi_metadata
 from rest_framework.request import Request
 from rest_framework.response import Response
-from rest_framework.views import APIView
 
 
 class WsiMetadata(APIView):
-    """Get WSI metadata"""
+    """Get WSI metadata, read from the WSI index without opening the slide"""
 
-    def get(self, request : Request, id : str):
-        try:
-            wsi_file = get_file('wsi', id)
-            if not wsi_file:
-                return Response({f"No WSI files found for ID {id}"}, status=404)
-            slide = OpenSlide(wsi_file.name)
-            properties = slide.properties
-            
-            return Response(properties, status=200)
-            
-        except Exception as e:
-            return Response({"error": "Failed to retrieve metadata"}, status=500)
-            
+    async def get(self, request : Request, id : str):
+        wsi = await get_wsi_metadata(id)
+        return Response(serialize_wsi_metadata(wsi), status=200)
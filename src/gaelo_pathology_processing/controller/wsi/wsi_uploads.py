@@ -0,0 +1,75 @@
+import json
+from uuid import UUID
+
+from adrf.views import APIView
+from asgiref.sync import sync_to_async
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from gaelo_pathology_processing.exceptions import GaelOException, GaelONotFoundException
+from gaelo_pathology_processing.models import UploadSession
+from gaelo_pathology_processing.services.utils import body_to_dict
+from gaelo_pathology_processing.services.wsi_upload import (
+    create_upload_session, delete_upload_session, finalize_upload_session, serialize_upload_session,
+    write_upload_chunk)
+
+
+async def get_upload_session(id: UUID) -> UploadSession:
+    try:
+        return await UploadSession.objects.aget(id=id)
+    except UploadSession.DoesNotExist:
+        raise GaelONotFoundException(f"Upload session {id} doesn't exist")
+
+
+class WsiUploadsView(APIView):
+
+    async def post(self, request: Request) -> Response:
+        """
+        Starts a chunked upload of a WSI of {"size": bytes, "md5": optional MD5 of the file}, for files too large
+        to be sent in a single POST /wsi
+        """
+        try:
+            data = body_to_dict(request.body)
+            session = await create_upload_session(data.get('size'), data.get('md5'))
+            return Response(await sync_to_async(serialize_upload_session)(session), status=201)
+
+        except json.JSONDecodeError:
+            return Response({"error": "Invalid JSON."}, status=400)
+        except GaelOException as e:
+            return Response({"error": str(e)}, status=e.status_code)
+
+
+class WsiUploadView(APIView):
+
+    async def get(self, request: Request, id: UUID) -> Response:
+        """Returns the received size and the missing ranges of the file, to resume an interrupted upload"""
+        session = await get_upload_session(id)
+        return Response(await sync_to_async(serialize_upload_session)(session), status=200)
+
+    async def put(self, request: Request, id: UUID) -> Response:
+        """
+        Writes the chunk in the body at the range of its Content-Range header ('bytes start-end/size', end
+        included), chunks can be sent in any order and in parallel, an optional Content-MD5 is checked
+        """
+        try:
+            chunk = await write_upload_chunk(await get_upload_session(id), request.stream,
+                                             request.headers.get('Content-Range'), request.headers.get('Content-MD5'))
+            return Response({'start': chunk.start, 'end': chunk.end, 'md5': chunk.md5}, status=200)
+        except GaelOException as e:
+            return Response({"error": str(e)}, status=e.status_code)
+
+    async def delete(self, request: Request, id: UUID) -> Response:
+        """Aborts the upload"""
+        await delete_upload_session(await get_upload_session(id))
+        return Response(status=200)
+
+
+class WsiUploadFinalizeView(APIView):
+
+    async def post(self, request: Request, id: UUID) -> Response:
+        """Checks and stores the uploaded WSI, returns its id as POST /wsi does"""
+        try:
+            wsi_id = await finalize_upload_session(await get_upload_session(id))
+            return Response({'id': wsi_id}, status=200)
+        except GaelOException as e:
+            return Response({"error": str(e)}, status=e.status_code)
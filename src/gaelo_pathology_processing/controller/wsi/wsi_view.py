@@ -1,48 +1,45 @@
-from pathlib import Path
+import os
 import tempfile
-from django.http import FileResponse
+from adrf.views import APIView
 from rest_framework.request import Request
 from rest_framework.response import Response
-from rest_framework.views import APIView
 
-from gaelo_pathology_processing.services.utils import get_wsi_format
-from gaelo_pathology_processing.services.file_helper import get_file, move_to_storage, get_hash, is_file_exists, delete_file
-from gaelo_pathology_processing.exceptions import GaelONotFoundException
+from gaelo_pathology_processing.services.metrics import STAGE_UPLOAD, measure_stage
+from gaelo_pathology_processing.services.download import create_download_response
+from gaelo_pathology_processing.services.file_helper import write_stream
+from gaelo_pathology_processing.services.utils import run_in_thread
+from gaelo_pathology_processing.services.wsi_upload import delete_wsi, register_wsi
 
 
 class WsiView(APIView):
     """
     Upload a wsi image
+
+    Async view : the storage I/O and the format detection run in a thread of the executor, so a slow transfer
+    does not hold a worker of an ASGI server nor delay the other requests of the worker
     """
 
-    def post(self, request: Request):
+    async def post(self, request: Request):
+        temp_file = tempfile.NamedTemporaryFile(suffix="", delete=False)
         try:
-            binary_data = request.body
-            with tempfile.NamedTemporaryFile(suffix="", delete=False) as temp_file:
-                temp_file.write(binary_data)
-                format_wsi = get_wsi_format(Path(temp_file.name))
-                if format_wsi is None:
-                    return Response({'error': 'Invalid file or unsupported format'}, status=400)
-                file_hash = get_hash(temp_file.name)
-                move_to_storage('wsi', temp_file.name, file_hash)
-                return Response({'id': file_hash}, status=200)
+            # Stream the body to disk instead of loading it through request.body
+            with measure_stage(STAGE_UPLOAD) as measure, temp_file:
+                file_hash = await run_in_thread(write_stream)(request.stream, temp_file)
+                measure.bytes = temp_file.tell()
+            if await register_wsi(temp_file.name, file_hash) is None:
+                return Response({'error': 'Invalid file or unsupported format'}, status=400)
+            return Response({'id': file_hash}, status=200)
 
         except Exception as e:
             return Response({'error': f'{str(e)}'}, status=500)
+        finally:
+            os.remove(temp_file.name)
 
-    def get(self, request: Request, id: str):
-        try:
-            file = get_file('wsi', id)
-            response = FileResponse(file, as_attachment=True)
-            response['Content-Disposition'] = f'attachment; filename="{id}"'
-            response['Content-Type'] = 'application/octet-stream'
-
-            return response
-        except Exception as e:
-            return Response({"error": str(e)}, status=500)
+    async def get(self, request: Request, id: str):
+        # the id is the MD5 of the file content
+        return await run_in_thread(create_download_response)(request, 'wsi', id, id, 'application/octet-stream',
+                                                             f'"{id}"')
 
-    def delete(self, request: Request, id: str):
-        if not is_file_exists('wsi', id):
-            raise GaelONotFoundException("File doesn't exist")
-        delete_file('wsi', id)
+    async def delete(self, request: Request, id: str):
+        await delete_wsi(id)
         return Response(status=200)
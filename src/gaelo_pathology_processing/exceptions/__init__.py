@@ -1 +1 @@
-from .gaelo_pathology_processing_exceptions import GaelOException, GaelOBadRequestException, GaelONotFoundException, GaeloInternalServerErrorException, GaelOConflictException
+from .gaelo_pathology_processing_exceptions import GaelOException, GaelOBadRequestException, GaelONotFoundException, GaeloInternalServerErrorException, GaelOConflictException, GaelOSlidesConversionException, GaelODicomSinkException
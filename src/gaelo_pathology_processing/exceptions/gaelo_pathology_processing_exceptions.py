@@ -28,3 +28,16 @@ class GaelOConflictException(GaelOException):
 class GaeloInternalServerErrorException(GaelOException):
     def __init__(self, message):
         super().__init__(message, 500)
+
+
+class GaelOSlidesConversionException(GaeloInternalServerErrorException):
+    def __init__(self, slide_errors: dict[str, str]):
+        super().__init__("Conversion failed for slides " + ', '.join(slide_errors.keys()))
+        self.slide_errors = slide_errors
+
+
+class GaelODicomSinkException(GaelOException):
+    """The DICOM sink (DICOMweb or Orthanc server) refused or could not receive instances"""
+
+    def __init__(self, message):
+        super().__init__(message, 502)
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from gaelo_pathology_processing.services.conversion_jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued conversion jobs in a pool of processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.CONVERSION_JOBS_CONCURRENCY,
+                            help='Maximum number of jobs converted in parallel')
+        parser.add_argument('--poll-interval', type=float, default=settings.CONVERSION_JOBS_POLL_INTERVAL,
+                            help='Delay in seconds between two checks for pending jobs')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"Conversion worker started with {options['concurrency']} processes")
+        run_worker(options['concurrency'], options['poll_interval'])
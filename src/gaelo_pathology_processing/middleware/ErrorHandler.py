@@ -1,15 +1,27 @@
 import traceback
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.conf import settings
 from ..exceptions.gaelo_pathology_processing_exceptions import GaelOException
 
 class ErrorHandlerMiddleware:
+    # async capable so the async views are not run in a thread by an ASGI server
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         response = self.get_response(request)
         return response
 
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
     def process_exception(self, request, exception):
         if settings.DEBUG:
             if exception:
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gaelo_pathology_processing', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Wsi',
+            fields=[
+                ('id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('format', models.CharField(max_length=32)),
+                ('vendor', models.CharField(blank=True, max_length=64, null=True)),
+                ('width', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('height', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('level_count', models.PositiveIntegerField(blank=True, null=True)),
+                ('level_downsamples', models.JSONField(default=list)),
+                ('mpp_x', models.FloatField(blank=True, null=True)),
+                ('mpp_y', models.FloatField(blank=True, null=True)),
+                ('file_size', models.PositiveBigIntegerField()),
+                ('properties', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
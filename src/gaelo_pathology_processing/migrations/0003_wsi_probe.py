@@ -0,0 +1,36 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:13
+
+from django.db import migrations, models
+
+
+def fill_probe_fields(apps, schema_editor):
+    # mirax is only uploaded zipped, its entry is searched at extraction for the rows indexed before the probe
+    Wsi = apps.get_model('gaelo_pathology_processing', 'Wsi')
+    Wsi.objects.filter(format__in=['leica', 'isyntax']).update(backend='bigpicture')
+    Wsi.objects.filter(format='mirax').update(container='zip')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gaelo_pathology_processing', '0002_wsi'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wsi',
+            name='backend',
+            field=models.CharField(default='orthanc', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='wsi',
+            name='container',
+            field=models.CharField(default='file', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='wsi',
+            name='entry',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.RunPython(fill_probe_fields, migrations.RunPython.noop),
+    ]
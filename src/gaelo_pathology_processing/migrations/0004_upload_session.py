@@ -0,0 +1,36 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:26
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gaelo_pathology_processing', '0003_wsi_probe'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('uploading', 'Uploading'), ('finalizing', 'Finalizing')], default='uploading', max_length=16)),
+                ('size', models.PositiveBigIntegerField()),
+                ('md5', models.CharField(blank=True, max_length=32, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UploadChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.PositiveBigIntegerField()),
+                ('end', models.PositiveBigIntegerField()),
+                ('md5', models.CharField(max_length=32)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='gaelo_pathology_processing.uploadsession')),
+            ],
+        ),
+    ]
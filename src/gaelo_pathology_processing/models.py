@@ -0,0 +1,91 @@
+import uuid
+from django.db import models
+
+
+class ConversionJob(models.Model):
+    """Conversion request processed in background by the conversion worker"""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    # body of the conversion request (dicom_tags_study and slides)
+    request = models.JSONField()
+    # conversion status of each slide : [{'wsi_id': ..., 'status': ...}]
+    slides = models.JSONField(default=list)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def is_finished(self) -> bool:
+        return self.status in (self.COMPLETED, self.FAILED, self.CANCELLED)
+
+
+class Wsi(models.Model):
+    """Metadata of a stored WSI, indexed at upload so that it is served without opening the slide"""
+
+    # MD5 of the file, its name in the wsi storage
+    id = models.CharField(primary_key=True, max_length=64)
+    # probe result (services.probe.WsiProbe) : format (aperio, mirax, isyntax...), container, entry in the
+    # container and dicomizer backend
+    format = models.CharField(max_length=32)
+    container = models.CharField(max_length=16, default='file')
+    entry = models.CharField(max_length=255, null=True, blank=True)
+    backend = models.CharField(max_length=16, default='orthanc')
+    vendor = models.CharField(max_length=64, null=True, blank=True)
+    width = models.PositiveBigIntegerField(null=True, blank=True)
+    height = models.PositiveBigIntegerField(null=True, blank=True)
+    level_count = models.PositiveIntegerField(null=True, blank=True)
+    level_downsamples = models.JSONField(default=list)
+    mpp_x = models.FloatField(null=True, blank=True)
+    mpp_y = models.FloatField(null=True, blank=True)
+    file_size = models.PositiveBigIntegerField()
+    # raw properties of the slide reader
+    properties = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class UploadSession(models.Model):
+    """Chunked upload of a WSI, assembled in the uploads storage until it is finalized"""
+
+    UPLOADING = 'uploading'
+    FINALIZING = 'finalizing'
+    STATUS_CHOICES = [
+        (UPLOADING, 'Uploading'),
+        (FINALIZING, 'Finalizing'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=UPLOADING)
+    # size in bytes of the whole file
+    size = models.PositiveBigIntegerField()
+    # MD5 of the whole file announced by the client, checked at finalization
+    md5 = models.CharField(max_length=32, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class UploadChunk(models.Model):
+    """Byte range written in the file of an upload session, chunks are only inserted so parallel uploads don't race"""
+
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    # range [start, end) of the file
+    start = models.PositiveBigIntegerField()
+    end = models.PositiveBigIntegerField()
+    md5 = models.CharField(max_length=32)
+    created_at = models.DateTimeField(auto_now_add=True)
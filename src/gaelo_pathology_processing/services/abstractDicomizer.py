@@ -1,66 +1,163 @@
 import os
 import json
+import logging
 import shutil
 import tempfile
-import zipfile
 import subprocess
+import time
 from abc import ABC, abstractmethod
-from openslide import OpenSlide
-from pydicom import Dataset
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable
+from django.conf import settings
+from PIL.Image import Image
+import numpy as np
+from pydicom import Dataset, Sequence
 from pydicom.uid import generate_uid
 
 from wsidicomizer.metadata import WsiDicomizerMetadata
 from wsidicomizer import WsiDicomizer
+from wsidicom.codec import Encoder
 from wsidicom.metadata import (
     Equipment,
     Patient,
     Series,
     Study,
 )
-from wsidicom.codec import JpegSettings, Subsampling, JpegLosslessSettings
-from gaelo_pathology_processing.services.utils import get_wsi_format
+from gaelo_pathology_processing.services.utils import extract_zipped_slide
+from gaelo_pathology_processing.services.probe import BACKEND_BIGPICTURE, CONTAINER_ZIP, WsiProbe, probe_wsi
+from gaelo_pathology_processing.services.output_profile import OutputProfile, get_output_profile
+from gaelo_pathology_processing.services.tiled_pyramid import (
+    MissingLevelsWriter, PyramidProgress, TiledPyramidWriter, WrittenFramesCounter, count_pyramid_tiles)
+
+logger = logging.getLogger(__name__)
+
+# seconds between two progress reports of wsidicomizer conversions
+PROGRESS_INTERVAL = 1
+# tags of create_dicom_tags taken from the conversion request, the others are generated or constant
+REQUEST_TAG_KEYWORDS = ['PatientID', 'PatientName', 'StudyDescription', 'StudyID', 'AccessionNumber',
+                        'SeriesDescription', 'SeriesNumber', 'Manufacturer', 'ImageType', 'FocusMethod',
+                        'ExtendedDepthOfField']
+
+
+def create_dicom_tags(study_instance_uid: str, data: dict) -> dict:
+    """DICOM tags of the generated instances by keyword, from the tags of the conversion request"""
+    if not isinstance(data, dict):  # Vérifie si 'data' est un dictionnaire
+        raise ValueError(
+            "Expected a dictionary, got None or an invalid type.")
+    return {
+        "PatientID": data.get('PatientID'),
+        "PatientName": data.get('PatientName'),
+        "StudyInstanceUID": study_instance_uid,
+        "StudyDescription": data.get('StudyDescription'),
+        "StudyID": data.get('StudyID'),
+        "AccessionNumber": data.get('AccessionNumber', "GaelO"),
+        "SeriesInstanceUID": generate_uid(),
+        "SeriesDescription": data.get('SeriesDescription', ''),
+        # --> could be a string
+        "SeriesNumber": data.get("SeriesNumber", '1'),
+        "Manufacturer": data.get('Manufacturer'),
+        "ImageType": data.get('ImageType', "ORIGINAL\\SECONDARY"),
+        "FocusMethod": data.get('FocusMethod', "AUTO"),
+        "ExtendedDepthOfField": data.get('ExtendedDepthOfField', "NO"),
+        "SpecimenDescriptionSequence": [
+            {
+                "SpecimenIdentifier": "Specimen^Identifier",
+                "SpecimenUID": "1.2.276.0.7230010.3.1.4.3252829876.4112.1426166133.871",
+                "IssuerOfTheSpecimenIdentifierSequence": [],
+                "SpecimenPreparationSequence": []
+            }
+        ]
+    }
+
+
+def create_dataset(tags: dict) -> Dataset:
+    """Dataset of DICOM tags by keyword, lists of dict being sequences, the tags without value are skipped"""
+    dataset = Dataset()
+    for keyword, value in tags.items():
+        if value is None:
+            continue
+        if isinstance(value, list) and all(isinstance(item, dict) for item in value):
+            value = Sequence([create_dataset(item) for item in value])
+        setattr(dataset, keyword, value)
+    return dataset
 
 
 class AbstractDicomizer(ABC):
 
+    output_profile: OutputProfile
+    probe: WsiProbe | None
+    # threads reading and encoding the tiles, and tiles processed at a time by each one (wsidicomizer)
+    workers: int
+    chunk_size: int
+    # if only the tiles of the tissue are written (native dicomizer, the others write all the tiles)
+    sparse_tiling: bool
+    # called with the tiles written so far during the conversion, raising in it cancels the conversion
+    progress: Callable[[PyramidProgress], None] | None
+
+    def __init__(self, output_profile: OutputProfile | None = None, probe: WsiProbe | None = None,
+                 workers: int | None = None, chunk_size: int | None = None, sparse_tiling: bool | None = None,
+                 progress: Callable[[PyramidProgress], None] | None = None):
+        self.output_profile = output_profile or get_output_profile(None)
+        self.probe = probe
+        self.workers = workers or settings.DICOMIZER_WORKERS
+        self.chunk_size = chunk_size or settings.DICOMIZER_CHUNK_SIZE
+        self.sparse_tiling = settings.SPARSE_TILING if sparse_tiling is None else sparse_tiling
+        self.progress = progress
+
     @classmethod
-    def get_dicomizer(cls, image_path: str):
+    def get_dicomizer(cls, image_path: str, output_profile: OutputProfile | None = None, probe: WsiProbe | None = None,
+                      **options):
+        """
+        Dicomizer of the image for the output profile, options (workers, chunk_size, sparse_tiling, progress) are
+        passed to it
+        """
+
+        output_profile = output_profile or get_output_profile(None)
+        # stored WSI are probed at upload (WSI index), other files are probed here
+        if probe is None:
+            probe = probe_wsi(image_path)
+        logger.info('Detected image format: %s', probe.format if probe else None)
+        return DICOMIZERS[cls.get_dicomizer_backend(output_profile, probe)](output_profile, probe, **options)
 
-        image_format = get_wsi_format(image_path)
-        print(f"Detected image format: {image_format}")
-        if image_format == 'leica' or image_format == 'isyntax':
-            big_picture = BigPictureDicomizer()
-            return big_picture
+    @classmethod
+    def get_dicomizer_backend(cls, output_profile: OutputProfile, probe: WsiProbe | None) -> str:
+        """Name in DICOMIZERS of the dicomizer converting a probed image to the output profile"""
+        # OrthancWSIDicomizer (and its in-process replacement) can't read leica and isyntax and only
+        # produces some of the output profiles
+        if (probe is not None and probe.backend == BACKEND_BIGPICTURE) or output_profile.orthanc_arguments is None:
+            return 'bigpicture'
+        elif settings.DICOMIZER_BACKEND == 'orthanc':
+            return 'orthanc'
         else:
-            orthanc = OrthancDicomizer()
-            return orthanc
+            return 'native'
+
+    @classmethod
+    def get_request_tags(cls, data: dict) -> dict:
+        """
+        Tags of the conversion request written by the dicomizer in the instances by keyword, with the value it
+        writes when the request omits them, None if it writes nothing then
+        """
+        tags = create_dicom_tags('', data)
+        return {keyword: tags[keyword] for keyword in REQUEST_TAG_KEYWORDS}
 
-    def convert(self, study_instance_uid, metadata, image_path, output_path):
+    def convert(self, study_instance_uid, metadata, image_path, output_path) -> PyramidProgress | None:
+        """Converts the image to DICOM files in output_path, returns the final progress if the dicomizer reports it"""
         self.initialize_dicoms_tags(study_instance_uid, metadata)
 
-        if zipfile.is_zipfile(image_path):
+        probe = self.probe or probe_wsi(image_path)
+        if probe is not None and probe.container == CONTAINER_ZIP:
             temp_dir = tempfile.mkdtemp()
             try:
-                with zipfile.ZipFile(image_path, 'r') as zip_ref:
-                    zip_ref.extractall(temp_dir)
-                # Search for file to open with OpenSlide in the extracted files (some format has splits in part files)
-                slide_file = None
-                for f in os.listdir(temp_dir):
-                    file_path = os.path.join(temp_dir, f)
-                    if os.path.isfile(file_path) and OpenSlide.detect_format(file_path) is not None:
-                        slide_file = file_path
-                        break
-                if not slide_file:
-                    raise ValueError(
-                        "No file compatible with OpenSlide found in the zip archive.")
-                self.convert_to_dicom(slide_file, output_path)
+                # the file to open with OpenSlide in the extracted files (some format has splits in part files)
+                slide_file = extract_zipped_slide(image_path, temp_dir, probe.entry)
+                return self.convert_to_dicom(slide_file, output_path)
             finally:
                 shutil.rmtree(temp_dir)
         else:
-            self.convert_to_dicom(image_path, output_path)
+            return self.convert_to_dicom(image_path, output_path)
 
     @abstractmethod
-    def convert_to_dicom(self, image_path: str, output_path: str):
+    def convert_to_dicom(self, image_path: str, output_path: str) -> PyramidProgress | None:
         pass
 
     @abstractmethod
@@ -99,13 +196,13 @@ class OrthancDicomizer(AbstractDicomizer):
         command = [
             str(executable_path),
             "--openslide="+str(openslide_path),
-            "--compression=jpeg",
-            "--jpeg-quality=100",
+            *self.output_profile.orthanc_arguments,
             str(image_path),
             "--dataset="+metadata_path.name,
             "--folder",
             str(output_path),
             "--force-openslide", "1",
+            "--threads=" + str(self.workers),
             "--max-size=10",
             "--levels=6",
             "--smooth=1"
@@ -118,85 +215,153 @@ class OrthancDicomizer(AbstractDicomizer):
 
     def initialize_dicoms_tags(self, study_instance_uid: str, data: dict):
         """Initialize the DICOM tags dataset."""
+        self.wsi_metadata = create_dicom_tags(study_instance_uid, data)
+
+
+class NativeDicomizer(AbstractDicomizer):
+    """
+    In-process replacement of OrthancWSIDicomizer writing the same pyramid (6 levels smoothed from the
+    level 0, instances of at most 10 MB), see TiledPyramidWriter. The tiles are read and encoded by
+    workers threads, only those of the tissue with sparse_tiling.
+    """
+
+    dataset: Dataset
+
+    def convert_to_dicom(self, image_path: str, output_path: str) -> PyramidProgress:
+        """
+            Converts an image to DICOM files with TiledPyramidWriter.
+
+            Args:
+                image_path (str): Path of image
+                output_path (str): Path of the output directory (after conversion)
+
+            Returns:
+                PyramidProgress: number of written tiles and duration of the conversion
+        """
+        writer = TiledPyramidWriter(self.dataset, self.output_profile.encoding_settings,
+                                    self.workers, self.progress, self.sparse_tiling)
+        try:
+            return writer.write(image_path, output_path)
+        except Exception as e:
+            raise Exception(f"Error converting to DICOM : {e}")
+
+    def initialize_dicoms_tags(self, study_instance_uid: str, data: dict):
+        """Initialize the DICOM tags dataset, the image type of each level is set by the writer."""
+        tags = create_dicom_tags(study_instance_uid, data)
+        del tags['ImageType']
+        tags['ContainerIdentifier'] = tags['SpecimenDescriptionSequence'][0]['SpecimenIdentifier']
+        tags['IssuerOfTheContainerIdentifierSequence'] = []
+        tags['ContainerTypeCodeSequence'] = []
+        self.dataset = create_dataset(tags)
+
+    @classmethod
+    def get_request_tags(cls, data: dict) -> dict:
+        tags = super().get_request_tags(data)
+        del tags['ImageType']
+        return tags
 
-        if not isinstance(data, dict):  # Vérifie si 'data' est un dictionnaire
-            raise ValueError(
-                "Expected a dictionary, got None or an invalid type.")
-        self.wsi_metadata = {
-            "PatientID": data.get('PatientID'),
-            "PatientName": data.get('PatientName'),
-            "StudyInstanceUID": study_instance_uid,
-            "StudyDescription": data.get('StudyDescription'),
-            "StudyID": data.get('StudyID'),
-            "AccessionNumber": data.get('AccessionNumber', "GaelO"),
-            "SeriesInstanceUID": generate_uid(),
-            "SeriesDescription": data.get('SeriesDescription', ''),
-            # --> could be a string
-            "SeriesNumber": data.get("SeriesNumber", '1'),
-            "Manufacturer": data.get('Manufacturer'),
-            "ImageType": data.get('ImageType', "ORIGINAL\\SECONDARY"),
-            "FocusMethod": data.get('FocusMethod', "AUTO"),
-            "ExtendedDepthOfField": data.get('ExtendedDepthOfField', "NO"),
-            "SpecimenDescriptionSequence": [
-                {
-                    "SpecimenIdentifier": "Specimen^Identifier",
-                    "SpecimenUID": "1.2.276.0.7230010.3.1.4.3252829876.4112.1426166133.871",
-                    "IssuerOfTheSpecimenIdentifierSequence": [],
-                    "SpecimenPreparationSequence": []
-                }
-            ]
-        }
+
+class CancellableEncoder(Encoder):
+    """Encoder of the tiles encoded by the threads of wsidicomizer, they stop once cancelled is set"""
+
+    def __init__(self, encoder: Encoder):
+        super().__init__(encoder.settings)
+        self.encoder = encoder
+        self.cancelled = False
+
+    def encode(self, image: Image | np.ndarray) -> bytes:
+        if self.cancelled:
+            raise InterruptedError('Conversion cancelled')
+        return self.encoder.encode(image)
+
+    @property
+    def lossy(self) -> bool:
+        return self.encoder.lossy
+
+    @property
+    def lossy_method(self):
+        return self.encoder.lossy_method
+
+    @classmethod
+    def supports_settings(cls, settings) -> bool:
+        return False
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return True
 
 
 class BigPictureDicomizer(AbstractDicomizer):
 
     wsi_metadata: WsiDicomizerMetadata
 
-    def convert_to_dicom(self, image_path: str, output_path: str):
+    def convert_to_dicom(self, image_path: str, output_path: str) -> PyramidProgress:
         """
-            Converts an image to a DICOM file using big_picture.
+            Converts an image to a DICOM file using big_picture, the slide is opened once to count its levels
+            and to write them with workers threads processing chunk_size tiles at a time.
             Args:
                 image_path (str): Path of image
-                base_output_dir (str): Path of the output directory (after conversion)
-                wsi_id (str): ID of the wsi image to convert
-                dataset_path (str): Path of the dataset.json for the dicoms tags
+                output_path (str): Path of the output directory (after conversion)
+
+            Returns:
+                PyramidProgress: number of written tiles and duration of the conversion
         """
         os.makedirs(output_path, exist_ok=True)
 
         try:
 
-            subsampling = Subsampling.from_string("420")
-            encoding_settings = JpegSettings(
-                quality=100, subsampling=subsampling
-            )
-            # encoding_settings = JpegLosslessSettings()
+            encoding_settings = self.output_profile.encoding_settings
 
-            # Déterminer les paramètres pour les niveaux en fonction des propriétés du WSI
-            with WsiDicomizer.open(image_path, self.wsi_metadata) as wsi:
+            with WsiDicomizer.open(image_path, self.wsi_metadata, encoding=encoding_settings,
+                                   include_confidential=True) as wsi:
+                # Déterminer les paramètres pour les niveaux en fonction des propriétés du WSI
                 total_levels = len(wsi.levels)
-                print(f"Total levels in WSI: {total_levels}")
-                if total_levels < 6:
-                    # If less than 6 levels, add the missing ones to reach 6 levels (0-5)
-                    add_missing_levels_param = True
-                    include_levels_param = list(range(6))
-                else:  # total_levels >= 6
-                    # If 6 or more levels, take the first 6 levels
-                    add_missing_levels_param = False
-                    include_levels_param = list(range(6))
-
-            WsiDicomizer.convert(
-                filepath=image_path,
-                output_path=output_path,
-                metadata=self.wsi_metadata,
-                encoding=encoding_settings,
-                include_label=False,
-                include_overview=False,
-                include_thumbnail=False,
-                include_confidential=True,
-                add_missing_levels=add_missing_levels_param,
-                include_levels=include_levels_param,
-
-            )
+                logger.info('Total levels in WSI: %d', total_levels)
+                # If less than 6 levels, add the missing ones down to the single tile level, else take the first
+                # 6 levels
+                add_missing_levels = total_levels < 6
+                include_levels_param = list(range(6))
+
+                # the profile decides if the tiles are re-encoded, the progress counts the frames written in
+                # the output files whether they are encoded or copied from the source
+                encoder = CancellableEncoder(Encoder.create_for_settings(encoding_settings))
+                transcoding = encoder if self.output_profile.reencode_tiles else None
+                frames = WrittenFramesCounter(output_path)
+                total = count_pyramid_tiles(wsi.size.width, wsi.size.height)
+
+                def save():
+                    wsi.save(output_path, workers=self.workers, chunk_size=self.chunk_size,
+                             include_levels=include_levels_param, add_missing_levels=False,
+                             include_labels=False, include_overviews=False, include_thumbnails=False,
+                             transcoding=transcoding)
+                    # built in one pass over each present level rather than by wsidicom, which decodes the
+                    # level above each missing level tile by tile
+                    if add_missing_levels:
+                        highest_level = max(wsi.levels.pyramid_indices[-1], wsi.levels.lowest_single_tile_level)
+                        MissingLevelsWriter(wsi, encoder, self.workers).write(output_path, highest_level)
+
+                start_time = time.perf_counter()
+                with ThreadPoolExecutor(1, thread_name_prefix='wsidicomizer') as executor:
+                    saving = executor.submit(save)
+                    # the progress is reported from this thread while wsidicomizer writes the levels
+                    while not wait([saving], PROGRESS_INTERVAL).done:
+                        if self.progress is not None:
+                            try:
+                                self.progress(PyramidProgress(min(frames.count(), total), total,
+                                                              time.perf_counter() - start_time))
+                            except BaseException:
+                                # stops the encoding threads, copied tiles are written until the end
+                                encoder.cancelled = True
+                                wait([saving])
+                                raise
+                    saving.result()
+            tiles = frames.count()
+            progress = PyramidProgress(tiles, max(tiles, total), time.perf_counter() - start_time)
+            logger.info('Wrote %d tiles in %.1f s (%.1f tiles/s)', progress.tiles, progress.seconds,
+                        progress.tiles_per_second)
+            if self.progress is not None:
+                self.progress(progress)
+            return progress
         except Exception as e:
             raise Exception(f"Error converting to DICOM : {e}")
 
@@ -228,3 +393,18 @@ class BigPictureDicomizer(AbstractDicomizer):
         )
 
         self.wsi_metadata = metadata
+
+    @classmethod
+    def get_request_tags(cls, data: dict) -> dict:
+        """Only some tags of the request are in the metadata, wsidicomizer writing its defaults for the others"""
+        return {
+            'PatientName': data.get('PatientName') or '',
+            'StudyID': data.get('StudyID') or '',
+            'AccessionNumber': data.get('AccessionNumber') or '',
+            'SeriesNumber': str(int(data.get('SeriesNumber', '1'))),
+            'Manufacturer': data.get('Manufacturer') or 'Unknown',
+        }
+
+
+# dicomizers by name, see AbstractDicomizer.get_dicomizer_backend
+DICOMIZERS = {'orthanc': OrthancDicomizer, 'native': NativeDicomizer, 'bigpicture': BigPictureDicomizer}
@@ -0,0 +1,66 @@
+import os
+import shutil
+import time
+import uuid
+import zipfile
+from io import BytesIO
+from typing import BinaryIO
+
+from pydicom import dcmread
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def is_compressed_instance(file: BinaryIO) -> bool:
+    """Returns True if the DICOM file uses a compressed transfer syntax, reads only its header"""
+    position = file.tell()
+    dataset = dcmread(file, stop_before_pixels=True, specific_tags=['SOPClassUID'])
+    file.seek(position)
+    return dataset.file_meta.TransferSyntaxUID.is_compressed
+
+
+class DicomArchiveWriter:
+    """
+    Zip of DICOM instances streamed in an opened binary file (ex : from open_storage_writer) with uuid names.
+
+    Instances already compressed (JPEG, JPEG-LS, JPEG 2000) are stored as is, the other ones are deflated.
+    """
+
+    def __init__(self, file: BinaryIO):
+        self.zip_file = zipfile.ZipFile(file, 'w')
+        self.number_of_instances = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        self.zip_file.close()
+
+    def __create_zip_info(self, compressed: bool) -> zipfile.ZipInfo:
+        zip_info = zipfile.ZipInfo(
+            str(uuid.uuid4()), time.localtime(time.time())[:6])
+        zip_info.compress_type = zipfile.ZIP_STORED if compressed else zipfile.ZIP_DEFLATED
+        return zip_info
+
+    def add_instance(self, data: bytes) -> None:
+        """Adds an encoded DICOM instance held in memory"""
+        zip_info = self.__create_zip_info(is_compressed_instance(BytesIO(data)))
+        self.zip_file.writestr(zip_info, data)
+        self.number_of_instances += 1
+
+    def open_instance(self, compressed: bool, file_size: int) -> BinaryIO:
+        """Opens a new entry to write an instance of file_size bytes in, compressed tells its transfer syntax"""
+        zip_info = self.__create_zip_info(compressed)
+        zip_info.file_size = file_size
+        self.number_of_instances += 1
+        return self.zip_file.open(zip_info, 'w')
+
+    def add_instance_file(self, path: str) -> None:
+        """Adds a DICOM file, copied by chunks"""
+        with open(path, 'rb') as source:
+            compressed = is_compressed_instance(source)
+            with self.open_instance(compressed, os.fstat(source.fileno()).st_size) as destination:
+                shutil.copyfileobj(source, destination, COPY_BUFFER_SIZE)
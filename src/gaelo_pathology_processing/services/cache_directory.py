@@ -0,0 +1,136 @@
+import fcntl
+import json
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator
+
+from django.core.files.storage import storages
+
+MANIFEST_NAME = 'manifest.json'
+
+
+@dataclass
+class CacheEntry:
+    """
+    Directory of a disk cache shared by the processes, with a manifest giving at least its size.
+
+    An entry is used while a shared lock is held on its manifest (one per user, acting as reference count),
+    the eviction only deletes the entries it can lock exclusively.
+    """
+
+    path: str
+    manifest: dict
+
+
+def get_cache_root(storage_name: str) -> str:
+    """Local folder of a cache storage"""
+    root = storages[storage_name].path('')
+    os.makedirs(root, exist_ok=True)
+    return root
+
+
+def create_cache_entry(root: str) -> str:
+    """Creates the hidden folder to write a new entry in before commit_cache_entry"""
+    temp_path = os.path.join(root, f'.tmp-{uuid.uuid4()}')
+    os.makedirs(temp_path)
+    return temp_path
+
+
+@contextmanager
+def open_cache_entry(root: str, key: str) -> Iterator[CacheEntry | None]:
+    """Yields the locked entry of key, None if there is none, and marks it as recently used"""
+    entry_path = os.path.join(root, key)
+    try:
+        manifest_file = open(os.path.join(entry_path, MANIFEST_NAME), 'r')
+    except FileNotFoundError:
+        yield None
+        return
+    with manifest_file:
+        fcntl.flock(manifest_file, fcntl.LOCK_SH)
+        # evicted between the open and the lock
+        if not os.path.exists(manifest_file.name):
+            yield None
+            return
+        os.utime(manifest_file.name)
+        yield CacheEntry(entry_path, json.load(manifest_file))
+
+
+@contextmanager
+def commit_cache_entry(root: str, key: str, temp_path: str, manifest: dict) -> Iterator[CacheEntry]:
+    """
+    Writes the manifest of an entry filled in temp_path (from create_cache_entry), makes it visible as key
+    and yields it locked
+    """
+    manifest_path = os.path.join(temp_path, MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        manifest_file = open(manifest_path, 'r')
+    except BaseException:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+    with manifest_file:
+        # locked before being visible so that it can't be evicted before its use
+        fcntl.flock(manifest_file, fcntl.LOCK_SH)
+        try:
+            os.rename(temp_path, os.path.join(root, key))
+            entry_path = os.path.join(root, key)
+        except OSError:
+            # committed meanwhile by another process, this copy is used then dropped
+            entry_path = temp_path
+        try:
+            yield CacheEntry(entry_path, manifest)
+        finally:
+            if entry_path == temp_path:
+                shutil.rmtree(temp_path, ignore_errors=True)
+
+
+@contextmanager
+def lock_cache_key(root: str, key: str) -> Iterator[None]:
+    """Exclusive lock of a key between processes, so that an entry is only built once"""
+    with open(os.path.join(root, f'.{key}.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def evict_cache(root: str, max_size: int) -> None:
+    """Deletes the least recently used entries not in use until the cache fits in max_size"""
+    entries = []
+    for key in os.listdir(root):
+        # entries being built or deleted, lock files
+        if key.startswith('.'):
+            continue
+        manifest_path = os.path.join(root, key, MANIFEST_NAME)
+        try:
+            with open(manifest_path, 'r') as manifest_file:
+                entries.append((os.path.getmtime(manifest_path), key, json.load(manifest_file)['size']))
+        except (FileNotFoundError, NotADirectoryError, ValueError, KeyError):
+            continue
+    total_size = sum(size for last_use, key, size in entries)
+    for last_use, key, size in sorted(entries):
+        if total_size <= max_size:
+            break
+        if delete_cache_entry(root, key):
+            total_size -= size
+
+
+def delete_cache_entry(root: str, key: str) -> bool:
+    """Deletes the entry of key if it is not in use, returns False if it is in use"""
+    entry_path = os.path.join(root, key)
+    try:
+        manifest_file = open(os.path.join(entry_path, MANIFEST_NAME), 'r')
+    except FileNotFoundError:
+        return True
+    with manifest_file:
+        try:
+            fcntl.flock(manifest_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        # renamed while locked so a new user never opens a half deleted entry
+        evicted_path = os.path.join(root, f'.evicted-{uuid.uuid4()}')
+        os.rename(entry_path, evicted_path)
+    shutil.rmtree(evicted_path, ignore_errors=True)
+    return True
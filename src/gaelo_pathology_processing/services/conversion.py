@@ -0,0 +1,418 @@
+import os
+import tempfile
+import hashlib
+import multiprocessing
+import queue
+import shutil
+import time
+from pathlib import Path
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+from contextlib import ExitStack
+from functools import partial
+from typing import Callable
+
+from django.conf import settings
+from pydicom.uid import generate_uid
+
+from gaelo_pathology_processing.exceptions import GaelOBadRequestException, GaelONotFoundException, GaelOSlidesConversionException
+from gaelo_pathology_processing.services.abstractDicomizer import AbstractDicomizer
+from gaelo_pathology_processing.services.archive_writer import DicomArchiveWriter
+from gaelo_pathology_processing.services.conversion_cache import (
+    evict_conversion_cache, get_conversion_cache_key, is_conversion_cache_enabled, open_cached_slide, store_cached_slide)
+from gaelo_pathology_processing.services.dicom_sink import DicomSink, is_dicom_sink_configured, open_dicom_sink
+from gaelo_pathology_processing.services.extraction_cache import open_stored_slide
+from gaelo_pathology_processing.services.file_helper import open_storage_writer, is_file_exists
+from gaelo_pathology_processing.services.metrics import (
+    STAGE_ARCHIVE, STAGE_DICOMIZATION, STAGE_SINK, STAGE_TRANSCODE, add_timings, collect_timings, measure_stage,
+    run_with_timings, summarize_timings)
+from gaelo_pathology_processing.services.output_profile import get_output_profile
+from gaelo_pathology_processing.services.probe import WsiProbe
+from gaelo_pathology_processing.services.dicom_transcoder import transcode_dicom_frames_to_jpeg_lossless
+from gaelo_pathology_processing.services.tiled_pyramid import PyramidProgress
+from gaelo_pathology_processing.services.utils import create_process_pool
+from gaelo_pathology_processing.services.wsi_index import get_wsi_index, get_wsi_probe
+
+SLIDE_PENDING = 'pending'
+SLIDE_CONVERTING = 'converting'
+SLIDE_CONVERTED = 'converted'
+SLIDE_FAILED = 'failed'
+
+
+def get_study_orthanc_id(patient_id, study_instance_uid) -> str:
+    string_to_hash = str(patient_id) + '|' + str(study_instance_uid)
+    myhash = hashlib.sha1(string_to_hash.encode('utf-8'))
+    hash = myhash.hexdigest()
+    hash = '-'.join(hash[i:i+8] for i in range(0, len(hash), 8))
+    return hash
+
+
+def validate_conversion_request(data: dict) -> None:
+    """
+    Checks the body of a conversion request, raises GaelOBadRequestException if it is not valid
+    """
+    requested_dicom_tags = data.get('dicom_tags_study')
+    slides = data.get('slides', [])
+    if not slides or not all('wsi_id' in slide for slide in slides):
+        raise GaelOBadRequestException("Each slide must contain a 'wsi_id'.")
+
+    if not requested_dicom_tags:
+        raise GaelOBadRequestException("Dicom tags are required.")
+
+    if not requested_dicom_tags.get('PatientID'):
+        raise GaelOBadRequestException("Patient ID is required.")
+
+    if not requested_dicom_tags.get('PatientName'):
+        raise GaelOBadRequestException("Patient name is required.")
+
+    get_output_profile(data.get('output_profile'))
+
+    for option in ('include_timings', 'send_to_sink', 'sparse_tiling'):
+        if not isinstance(data.get(option, False), bool):
+            raise GaelOBadRequestException(f"{option} must be a boolean.")
+
+    workers = data.get('dicomizer_workers')
+    if workers is not None and (type(workers) is not int or not 1 <= workers <= os.cpu_count()):
+        raise GaelOBadRequestException(f"dicomizer_workers must be an integer between 1 and {os.cpu_count()}.")
+    chunk_size = data.get('dicomizer_chunk_size')
+    if chunk_size is not None and (type(chunk_size) is not int or chunk_size < 1):
+        raise GaelOBadRequestException("dicomizer_chunk_size must be a positive integer.")
+
+    if data.get('send_to_sink', False) and not is_dicom_sink_configured():
+        raise GaelOBadRequestException("No DICOM sink is configured.")
+
+
+def convert_study(data: dict, on_progress: Callable[[str, str, PyramidProgress | None], None] | None = None) -> dict:
+    """
+    Converts all slides of a conversion request to DICOM, zips them and sends the zip to storage, or with
+    send_to_sink pushes the instances to the configured DICOMweb / Orthanc server instead of zipping them, once
+    all the slides are converted so that a failing slide leaves no partial study on the server
+
+    Slides are converted in parallel processes if CONVERSION_SLIDE_WORKERS > 1, a failing slide does not stop
+    the other ones and all the failures are raised together in a GaelOSlidesConversionException.
+
+    With the conversion cache enabled, a slide already converted with the same output profile is not converted
+    again : its cached instances are added to the zip with rewritten headers (tags and UIDs of this study).
+
+    Args:
+        data (dict): conversion request body (dicom_tags_study, slides and optional output_profile,
+            send_to_sink, include_timings, dicomizer_workers, dicomizer_chunk_size and sparse_tiling)
+        on_progress (Callable[[str, str, PyramidProgress | None], None], optional): called with (wsi_id, slide
+            status, None) each time a slide starts or ends its conversion and with the tiles written so far
+            every CONVERSION_PROGRESS_INTERVAL seconds while it is converted, exceptions raised by the callback
+            abort the conversion
+
+    Returns:
+        dict: study_instance_uid, study_orthanc_id, number_of_instances of the generated study, the wsi_id
+            of the cache_hits, with send_to_sink the number of stored_instances, when instances were transcoded
+            in JPEG-LS the frame deduplication and with include_timings the timings per stage (see
+            summarize_timings)
+    """
+    validate_conversion_request(data)
+    # stages run in this process and in the pools, reported with include_timings and always logged
+    with collect_timings() as timings:
+        result = __convert_study(data, on_progress)
+    transcodes = [timing for timing in timings if timing['stage'] == STAGE_TRANSCODE]
+    if transcodes:
+        result['deduplication'] = __summarize_deduplication(transcodes)
+    if data.get('include_timings', False):
+        result['timings'] = summarize_timings(timings)
+    return result
+
+
+def __convert_study(data: dict, on_progress: Callable[[str, str, PyramidProgress | None], None] | None) -> dict:
+    output_profile = get_output_profile(data.get('output_profile'))
+    sparse_tiling = data.get('sparse_tiling', settings.SPARSE_TILING)
+    dicomizer_options = (data.get('dicomizer_workers'), data.get('dicomizer_chunk_size'), sparse_tiling)
+    send_to_sink = data.get('send_to_sink', False)
+    patient_id = data['dicom_tags_study'].get('PatientID')
+    slides = data['slides']
+    for slide in slides:
+        if not is_file_exists('wsi', slide['wsi_id']):
+            raise GaelONotFoundException(
+                f"WSI file with ID '{slide['wsi_id']}' does not exist.")
+
+    def notify(wsi_id: str, status: str, progress: PyramidProgress | None = None):
+        if on_progress is not None:
+            on_progress(wsi_id, status, progress)
+
+    # Generate a study instance UID to make all series belongs to the same study
+    study_instance_uid = generate_uid()
+    dicom_tags = [data['dicom_tags_study'] | slide['dicom_tags_series'] for slide in slides]
+    cache_enabled = is_conversion_cache_enabled()
+    cache_keys = [get_conversion_cache_key(slide['wsi_id'], output_profile, sparse_tiling) for slide in slides]
+    # one temporary folder per slide, in the slides order, to fuse for generating dicom zip batch
+    dicom_folders = [tempfile.TemporaryDirectory() for slide in slides]
+    try:
+        with ExitStack() as cached_slides_stack:
+            # cached slides stay locked (not evictable) until the zip is written
+            cached_slides = [cached_slides_stack.enter_context(open_cached_slide(key)) if cache_enabled else None
+                             for key in cache_keys]
+            cache_hits = [slide['wsi_id'] for slide, cached_slide in zip(slides, cached_slides)
+                          if cached_slide is not None]
+            for wsi_id in cache_hits:
+                notify(wsi_id, SLIDE_CONVERTED)
+            slide_errors = {}
+            # the probes are read from the index in this process, the pool processes make no database query
+            conversions = []
+            # name of the dicomizer of each converted slide, stored in its cache entry
+            dicomizers = {}
+            for index, (slide, tags, dicom_folder) in enumerate(zip(slides, dicom_tags, dicom_folders)):
+                if cached_slides[index] is not None:
+                    continue
+                try:
+                    probe = get_wsi_probe(get_wsi_index(slide['wsi_id']))
+                except Exception as e:
+                    slide_errors[slide['wsi_id']] = str(e)
+                    notify(slide['wsi_id'], SLIDE_FAILED)
+                    continue
+                dicomizers[index] = AbstractDicomizer.get_dicomizer_backend(output_profile, probe.as_extracted())
+                conversions.append((study_instance_uid, tags, slide['wsi_id'], probe, dicom_folder.name,
+                                    output_profile.name, *dicomizer_options))
+            workers = min(settings.CONVERSION_SLIDE_WORKERS, len(conversions))
+            if workers > 1:
+                with ExitStack() as pool_stack:
+                    # the pool processes send the progress of their slide in a queue read in this process, its
+                    # manager is stopped after the pool
+                    progress_queue = None
+                    if on_progress is not None:
+                        progress_queue = pool_stack.enter_context(multiprocessing.get_context('spawn').Manager()).Queue()
+                    pool = pool_stack.enter_context(create_process_pool(workers))
+                    try:
+                        futures = {}
+                        for conversion in conversions:
+                            wsi_id = conversion[2]
+                            notify(wsi_id, SLIDE_CONVERTING)
+                            on_tiles = partial(__put_progress, progress_queue, wsi_id) if progress_queue is not None \
+                                else None
+                            futures[pool.submit(run_with_timings, convert_slide, *conversion, on_tiles)] = wsi_id
+                        pending = set(futures)
+                        while pending:
+                            done, pending = wait(pending, settings.CONVERSION_PROGRESS_INTERVAL, FIRST_COMPLETED)
+                            # queued before the end of their slide, notified before it
+                            __notify_queued_progress(progress_queue, notify)
+                            for future in done:
+                                wsi_id = futures[future]
+                                if future.exception() is None:
+                                    add_timings(future.result()[1])
+                                    notify(wsi_id, SLIDE_CONVERTED)
+                                else:
+                                    slide_errors[wsi_id] = str(future.exception())
+                                    notify(wsi_id, SLIDE_FAILED)
+                    except BaseException:
+                        # aborted by on_progress, the slides not started yet are dropped
+                        pool.shutdown(cancel_futures=True)
+                        raise
+            else:
+                for conversion in conversions:
+                    wsi_id = conversion[2]
+                    notify(wsi_id, SLIDE_CONVERTING)
+                    # an exception of on_progress raised in the dicomizer aborts the conversion, not only the slide
+                    aborts = []
+
+                    def on_tiles(progress: PyramidProgress, wsi_id=wsi_id, aborts=aborts):
+                        try:
+                            notify(wsi_id, SLIDE_CONVERTING, progress)
+                        except BaseException as e:
+                            aborts.append(e)
+                            raise
+
+                    try:
+                        convert_slide(*conversion, on_tiles if on_progress else None)
+                    except Exception as e:
+                        if aborts:
+                            raise aborts[0]
+                        slide_errors[wsi_id] = str(e)
+                        notify(wsi_id, SLIDE_FAILED)
+                        continue
+                    notify(wsi_id, SLIDE_CONVERTED)
+            if slide_errors:
+                raise GaelOSlidesConversionException(slide_errors)
+
+            def write_instances(output: DicomArchiveWriter | DicomSink) -> None:
+                for index, dicom_folder in enumerate(dicom_folders):
+                    if cached_slides[index] is not None:
+                        # the pixel data is reused, only the headers are written for this study
+                        cached_slides[index].add_to_archive(output, study_instance_uid, dicom_tags[index])
+                    elif cache_enabled:
+                        # the instances are moved in a new cache entry once added
+                        with store_cached_slide(cache_keys[index], dicomizers[index]) as cache_folder:
+                            add_files_to_zip(dicom_folder.name, output, output_profile.transcode_jpeg_ls,
+                                             transcode_pool, cache_folder)
+                    else:
+                        # add all file in it (with uuid name)
+                        add_files_to_zip(
+                            dicom_folder.name, output, output_profile.transcode_jpeg_ls, transcode_pool)
+
+            transcode_pool = create_process_pool(settings.TRANSCODE_WORKERS) if (
+                output_profile.transcode_jpeg_ls and settings.TRANSCODE_WORKERS > 1) else None
+            try:
+                if send_to_sink:
+                    # the instances of all the converted slides are pushed to the sink (each one as soon as it is
+                    # transcoded), no zip is stored
+                    with measure_stage(STAGE_SINK) as measure:
+                        with open_dicom_sink() as sink:
+                            write_instances(sink)
+                        measure.bytes = sink.sent_bytes
+                    number_of_all_instances = sink.number_of_instances
+                else:
+                    # create final zip file, written directly in the dicoms storage
+                    zip_file_name = f"{study_instance_uid}.zip"
+                    with measure_stage(STAGE_ARCHIVE) as measure, \
+                            open_storage_writer('dicoms', zip_file_name) as zip_storage_file:
+                        with DicomArchiveWriter(zip_storage_file) as archive:
+                            write_instances(archive)
+                            number_of_all_instances = archive.number_of_instances
+                        measure.bytes = zip_storage_file.tell()
+            finally:
+                if transcode_pool is not None:
+                    transcode_pool.shutdown(cancel_futures=True)
+        if cache_enabled:
+            evict_conversion_cache(settings.CONVERSION_CACHE_MAX_SIZE)
+    finally:
+        for dicom_folder in dicom_folders:
+            dicom_folder.cleanup()
+
+    study_orthanc_id = get_study_orthanc_id(patient_id, study_instance_uid)
+    result = {"study_instance_uid": study_instance_uid, 'study_orthanc_id': study_orthanc_id,
+              'number_of_instances': number_of_all_instances, 'output_profile': output_profile.name,
+              'cache_hits': cache_hits}
+    if send_to_sink:
+        result['stored_instances'] = sink.stored_instances
+    return result
+
+
+def __summarize_deduplication(transcodes: list[dict]) -> dict:
+    """Frames of the transcoded instances, the unique ones encoded and their ratio (1 without duplicates)"""
+    unique_frames = sum(timing['tiles'] for timing in transcodes)
+    frames = unique_frames + sum(timing['deduplicated'] for timing in transcodes)
+    return {'frames': frames, 'unique_frames': unique_frames,
+            'ratio': round(frames / unique_frames, 3) if unique_frames else 1}
+
+
+def __put_progress(progress_queue: queue.Queue, wsi_id: str, progress: PyramidProgress) -> None:
+    progress_queue.put((wsi_id, progress))
+
+
+def __notify_queued_progress(progress_queue: queue.Queue | None,
+                             notify: Callable[[str, str, PyramidProgress], None]) -> None:
+    """Notifies the progress sent by the pool processes, only the last one of each slide"""
+    if progress_queue is None:
+        return
+    last_progress = {}
+    while True:
+        try:
+            wsi_id, progress = progress_queue.get_nowait()
+        except queue.Empty:
+            break
+        last_progress[wsi_id] = progress
+    for wsi_id, progress in last_progress.items():
+        notify(wsi_id, SLIDE_CONVERTING, progress)
+
+
+def __throttle_progress(on_tiles: Callable[[PyramidProgress], None]) -> Callable[[PyramidProgress], None]:
+    """Calls on_tiles at most once every CONVERSION_PROGRESS_INTERVAL seconds, and for the last tile"""
+    last_call = -settings.CONVERSION_PROGRESS_INTERVAL
+
+    def throttled(progress: PyramidProgress) -> None:
+        nonlocal last_call
+        now = time.monotonic()
+        if now - last_call >= settings.CONVERSION_PROGRESS_INTERVAL or progress.tiles >= progress.total:
+            last_call = now
+            on_tiles(progress)
+    return throttled
+
+
+def convert_slide(study_instance_uid: str, dicom_tags: dict, wsi_id: str, probe: WsiProbe, output_path: str,
+                  output_profile: str, workers: int | None = None, chunk_size: int | None = None,
+                  sparse_tiling: bool | None = None, on_tiles: Callable[[PyramidProgress], None] | None = None) -> None:
+    """
+    Converts one stored WSI to DICOM files written in output_path, run in a pool process when slides are
+    converted in parallel
+
+    Args:
+        probe (WsiProbe): probe of the WSI from its index, read by the caller so this function makes no
+            database query
+        workers, chunk_size (int, optional): dicomizer threads and tiles per chunk, DICOMIZER_* settings if None
+        sparse_tiling (bool, optional): if only the tissue tiles are written, SPARSE_TILING setting if None
+        on_tiles (Callable[[PyramidProgress], None], optional): called with the tiles written so far, at most
+            every CONVERSION_PROGRESS_INTERVAL seconds
+    """
+    # zipped WSI are extracted once in the extraction cache, shared by the conversions
+    with open_stored_slide(wsi_id, probe) as slide_path:
+        dicomizer = AbstractDicomizer.get_dicomizer(
+            slide_path, get_output_profile(output_profile), probe.as_extracted(), workers=workers,
+            chunk_size=chunk_size, sparse_tiling=sparse_tiling, progress=__throttle_progress(on_tiles) if on_tiles else None)
+        # the dicomizers write all the levels in one call, measured as a whole with the size of the output
+        with measure_stage(STAGE_DICOMIZATION) as measure:
+            progress = dicomizer.convert(study_instance_uid, dicom_tags,
+                                         slide_path, output_path)
+            measure.tiles = progress.tiles if progress is not None else 0
+            measure.bytes = sum(os.path.getsize(os.path.join(directory, file))
+                                for directory, dirs, files in os.walk(output_path) for file in files)
+
+
+def add_files_to_zip(folder_path: str, archive: DicomArchiveWriter | DicomSink, compress_jpeg_ls=False, pool: Executor | None = None,
+                     cache_folder: str | None = None) -> int:
+    """
+    Adds all the files of the specified folder to a DICOM archive.
+
+    The JPEG-LS transcoded instances are written in temporary files, copied by chunks in the archive then
+    deleted, so the memory does not depend on the size of the instances. With a pool, the transcoding is
+    pipelined : the pool encodes the next instances while the encoded ones are added in order, with at most
+    TRANSCODE_QUEUE_DEPTH instances in flight to cap the temporary files.
+
+    Args:
+        folder_path (str): Path of the folder to zip
+        archive (DicomArchiveWriter | DicomSink): Opened archive or sink to write in
+        compress_jpeg_ls (bool): Transcode the DICOM files in JPEG-LS lossless before adding them
+        pool (Executor, optional): Executor running the transcoding, transcoded one by one in this process if None
+        cache_folder (str, optional): Folder keeping the added instances (named by their index) instead of
+            deleting them, the transcoded ones being written in it
+
+    Returns:
+        int: number of added files
+    """
+    file_paths = sorted(Path(root) / file for root, dirs, files in os.walk(folder_path)
+                        for file in files)
+    if not compress_jpeg_ls:
+        for index, file_path in enumerate(file_paths):
+            archive.add_instance_file(file_path)
+            if cache_folder is not None:
+                # an instance streamed by a sink keeps its file opened
+                shutil.move(file_path, os.path.join(cache_folder, f'{index:06d}.dcm'))
+        return len(file_paths)
+
+    with ExitStack() as stack:
+        transcoded_folder = cache_folder or stack.enter_context(tempfile.TemporaryDirectory())
+        keep = cache_folder is not None
+        transcoded_paths = [os.path.join(transcoded_folder, f'{index:06d}.dcm') for index in range(len(file_paths))]
+        if pool is None:
+            for file_path, transcoded_path in zip(file_paths, transcoded_paths):
+                transcode_dicom_frames_to_jpeg_lossless(str(file_path), transcoded_path)
+                __add_transcoded(archive, transcoded_path, keep)
+        else:
+            in_flight = deque()
+            for file_path, transcoded_path in zip(file_paths, transcoded_paths):
+                # only the timings are sent back by the pool, the instance is in its file
+                in_flight.append((pool.submit(run_with_timings, transcode_dicom_frames_to_jpeg_lossless,
+                                              str(file_path), transcoded_path), transcoded_path))
+                if len(in_flight) >= settings.TRANSCODE_QUEUE_DEPTH:
+                    __pop_transcoded(archive, in_flight, keep)
+            while in_flight:
+                __pop_transcoded(archive, in_flight, keep)
+    return len(file_paths)
+
+
+def __add_transcoded(archive: DicomArchiveWriter | DicomSink, transcoded_path: str, keep: bool) -> None:
+    archive.add_instance_file(transcoded_path)
+    # an instance streamed by a sink keeps its file opened
+    if not keep:
+        os.remove(transcoded_path)
+
+
+def __pop_transcoded(archive: DicomArchiveWriter | DicomSink, in_flight: deque, keep: bool) -> None:
+    future, transcoded_path = in_flight.popleft()
+    result, timings = future.result()
+    add_timings(timings)
+    __add_transcoded(archive, transcoded_path, keep)
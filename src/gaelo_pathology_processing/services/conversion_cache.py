@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import shutil
+from io import BytesIO
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from django.conf import settings
+from pydicom import Dataset, dcmread
+from pydicom.filewriter import dcmwrite
+from pydicom.uid import generate_uid
+
+from gaelo_pathology_processing.services.abstractDicomizer import DICOMIZERS
+from gaelo_pathology_processing.services.archive_writer import DicomArchiveWriter
+from gaelo_pathology_processing.services.dicom_sink import DicomSink
+from gaelo_pathology_processing.services.cache_directory import (
+    CacheEntry, commit_cache_entry, create_cache_entry, evict_cache, get_cache_root, open_cache_entry)
+from gaelo_pathology_processing.services.output_profile import OutputProfile
+
+# to bump when the dicomizers produce different pixels for the same profile (levels, tile size...) or when
+# the manifest changes
+CONVERSION_CACHE_VERSION = 3
+COPY_BUFFER_SIZE = 1024 * 1024
+# UIDs generated by the dicomizers, replaced by new ones each time a cached slide is reused
+GENERATED_UID_KEYWORDS = ['SeriesInstanceUID', 'SOPInstanceUID', 'FrameOfReferenceUID',
+                          'DimensionOrganizationUID', 'PyramidUID', 'ConcatenationUID',
+                          'SOPInstanceUIDOfConcatenationSource']
+
+
+class CachedSlide(CacheEntry):
+    """
+    Entry of the conversion cache : the DICOM instances of a converted slide (with their final encoding)
+    and the manifest naming the dicomizer which wrote them, which decides the request tags in their headers.
+    """
+
+    def instance_paths(self) -> list[Path]:
+        return sorted(Path(self.path) / name for name in self.manifest['instances'])
+
+    def add_to_archive(self, archive: DicomArchiveWriter | DicomSink, study_instance_uid: str, dicom_tags: dict) -> int:
+        """
+        Adds the cached instances to an archive with their headers rewritten for a new conversion : request
+        tags, the study_instance_uid and new series/instance UIDs, the pixel data is copied as is.
+
+        Returns:
+            int: number of added instances
+        """
+        uid_map = {}
+        request_tags = DICOMIZERS[self.manifest['dicomizer']].get_request_tags(dicom_tags)
+        for instance_path in self.instance_paths():
+            with open(instance_path, 'rb') as source:
+                dataset = dcmread(source, stop_before_pixels=True)
+                # the file is positioned on the Pixel Data element
+                pixel_data_position = source.tell()
+                rewrite_header(dataset, study_instance_uid, request_tags, uid_map)
+                header = BytesIO()
+                dcmwrite(header, dataset, enforce_file_format=False)
+                file_size = header.tell() + os.fstat(source.fileno()).st_size - pixel_data_position
+                compressed = dataset.file_meta.TransferSyntaxUID.is_compressed
+                with archive.open_instance(compressed, file_size) as destination:
+                    destination.write(header.getvalue())
+                    shutil.copyfileobj(source, destination, COPY_BUFFER_SIZE)
+        return len(self.manifest['instances'])
+
+
+def is_conversion_cache_enabled() -> bool:
+    return settings.CONVERSION_CACHE_MAX_SIZE > 0
+
+
+def get_conversion_cache_key(wsi_id: str, output_profile: OutputProfile, sparse_tiling: bool = False) -> str:
+    """
+    Key of the cached conversion of a WSI : its id (MD5 of the file) and all the settings affecting the
+    pixels (the output profile with its encoding, the dicomizer backend, the sparse tiling, the cache
+    version), the DICOM tags are not part of it.
+    """
+    parameters = {
+        'wsi_id': wsi_id,
+        'output_profile': repr(output_profile),
+        'dicomizer_backend': settings.DICOMIZER_BACKEND,
+        'version': CONVERSION_CACHE_VERSION,
+    }
+    # the keys of the full conversions are unchanged
+    if sparse_tiling:
+        parameters['sparse_tiling'] = True
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+@contextmanager
+def open_cached_slide(key: str) -> Iterator[CachedSlide | None]:
+    """Yields the locked cache entry of key, None if the slide is not cached, and marks it as recently used"""
+    with open_cache_entry(get_cache_root('conversion_cache'), key) as entry:
+        yield CachedSlide(entry.path, entry.manifest) if entry is not None else None
+
+
+@contextmanager
+def store_cached_slide(key: str, dicomizer: str) -> Iterator[str]:
+    """
+    Yields the folder of a new cache entry to fill with the DICOM instances of a converted slide (with their
+    final encoding), committed when the block ends, dropped if it raises.
+
+    Args:
+        key (str): conversion cache key of the slide
+        dicomizer (str): name in DICOMIZERS of the dicomizer which converted the slide
+    """
+    root = get_cache_root('conversion_cache')
+    temp_path = create_cache_entry(root)
+    try:
+        yield temp_path
+        instances = sorted(os.listdir(temp_path))
+        manifest = {
+            'instances': instances,
+            'dicomizer': dicomizer,
+            'size': sum(os.path.getsize(os.path.join(temp_path, name)) for name in instances),
+        }
+    except BaseException:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+    with commit_cache_entry(root, key, temp_path, manifest):
+        pass
+
+
+def evict_conversion_cache(max_size: int) -> None:
+    """Deletes the least recently used entries not locked by a conversion until the cache fits in max_size"""
+    evict_cache(get_cache_root('conversion_cache'), max_size)
+
+
+def rewrite_header(dataset: Dataset, study_instance_uid: str, request_tags: dict, uid_map: dict) -> None:
+    """
+    Rewrites the header of a cached instance for a new conversion.
+
+    The request tags of the dicomizer for the new request (see AbstractDicomizer.get_request_tags) replace the
+    cached ones, the tags without value are removed, the study gets study_instance_uid and the dicomizer UIDs
+    new ones, uid_map keeping the same new UID for all the instances (and references) of the slide.
+    """
+    for keyword, value in request_tags.items():
+        if value is not None:
+            setattr(dataset, keyword, value)
+        elif keyword in dataset:
+            delattr(dataset, keyword)
+
+    if 'StudyInstanceUID' in dataset:
+        uid_map[dataset.StudyInstanceUID] = study_instance_uid
+    for keyword in GENERATED_UID_KEYWORDS:
+        if keyword in dataset and dataset[keyword].value not in uid_map:
+            uid_map[dataset[keyword].value] = generate_uid()
+
+    def replace_uid(dataset: Dataset, element) -> None:
+        if element.VR == 'UI' and element.value in uid_map:
+            element.value = uid_map[element.value]
+
+    dataset.walk(replace_uid)
+    dataset.file_meta.MediaStorageSOPInstanceUID = dataset.SOPInstanceUID
@@ -0,0 +1,172 @@
+import logging
+import time
+import traceback
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from uuid import UUID
+
+from django.db import connections
+
+from gaelo_pathology_processing.exceptions import GaelOConflictException, GaelOException, GaelOSlidesConversionException
+from gaelo_pathology_processing.models import ConversionJob
+from gaelo_pathology_processing.services.conversion import convert_study, validate_conversion_request, SLIDE_PENDING
+from gaelo_pathology_processing.services.tiled_pyramid import PyramidProgress
+from gaelo_pathology_processing.services.utils import create_process_pool
+
+logger = logging.getLogger(__name__)
+
+
+class ConversionCancelled(Exception):
+    pass
+
+
+def create_job(data: dict) -> ConversionJob:
+    """Validates a conversion request and queues it for the conversion worker"""
+    validate_conversion_request(data)
+    slides = [{'wsi_id': slide['wsi_id'], 'status': SLIDE_PENDING}
+              for slide in data['slides']]
+    return ConversionJob.objects.create(request=data, slides=slides)
+
+
+def cancel_job(job: ConversionJob) -> ConversionJob:
+    """
+    Cancels a pending or running job, a running job is stopped by its worker at the next progress step
+    """
+    cancelled = ConversionJob.objects.filter(
+        id=job.id, status__in=[ConversionJob.PENDING, ConversionJob.RUNNING]
+    ).update(status=ConversionJob.CANCELLED)
+    job.refresh_from_db()
+    if not cancelled:
+        raise GaelOConflictException(f"Job is already {job.status}")
+    return job
+
+
+def serialize_job(job: ConversionJob) -> dict:
+    return {
+        'id': str(job.id),
+        'status': job.status,
+        'slides': job.slides,
+        'result': job.result,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'updated_at': job.updated_at.isoformat(),
+    }
+
+
+def claim_pending_jobs(limit: int) -> list[UUID]:
+    """Marks up to limit pending jobs as running and returns their ids, oldest first"""
+    claimed = []
+    pending_ids = ConversionJob.objects.filter(
+        status=ConversionJob.PENDING).values_list('id', flat=True)[:limit]
+    for job_id in pending_ids:
+        # conditional update so a job cancelled meanwhile is not started
+        if ConversionJob.objects.filter(id=job_id, status=ConversionJob.PENDING).update(status=ConversionJob.RUNNING):
+            claimed.append(job_id)
+    return claimed
+
+
+def run_job(job_id: UUID) -> None:
+    """
+    Runs a claimed job, called in a process of the worker pool
+    """
+    job = ConversionJob.objects.get(id=job_id)
+
+    def on_progress(wsi_id: str, status: str, progress: PyramidProgress | None):
+        job.refresh_from_db(fields=['status', 'slides'])
+        if job.status == ConversionJob.CANCELLED:
+            raise ConversionCancelled()
+        for slide in job.slides:
+            if slide['wsi_id'] == wsi_id:
+                slide['status'] = status
+                if progress is not None:
+                    slide['progress'] = {'tiles': progress.tiles, 'total_tiles': progress.total,
+                                         'tiles_per_second': round(progress.tiles_per_second, 1)}
+        ConversionJob.objects.filter(id=job_id, status=ConversionJob.RUNNING).update(
+            slides=job.slides)
+
+    try:
+        result = convert_study(job.request, on_progress)
+        finished = {'status': ConversionJob.COMPLETED, 'result': result}
+    except ConversionCancelled:
+        logger.info("Conversion job %s cancelled", job_id)
+        return
+    except GaelOSlidesConversionException as e:
+        finished = {'status': ConversionJob.FAILED, 'error': str(e),
+                    'result': {'slides': e.slide_errors}}
+    except GaelOException as e:
+        finished = {'status': ConversionJob.FAILED, 'error': str(e)}
+    except Exception as e:
+        logger.error("Conversion job %s failed : %s", job_id, traceback.format_exc())
+        finished = {'status': ConversionJob.FAILED, 'error': str(e)}
+    # a job cancelled during the final step keeps its cancelled status
+    ConversionJob.objects.filter(
+        id=job_id, status=ConversionJob.RUNNING).update(**finished)
+
+
+def run_worker(concurrency: int, poll_interval: float, max_iterations: int | None = None) -> None:
+    """
+    Polls the pending jobs and runs them in a pool of processes, at most concurrency jobs at a time
+
+    A job whose process raised is marked as failed. If a process of the pool dies (killed, out of memory...),
+    the pool is broken : its running jobs are marked as failed and a new pool runs the next jobs.
+
+    Args:
+        concurrency (int): maximum number of jobs converted in parallel
+        poll_interval (float): delay in seconds between two checks for pending jobs
+        max_iterations (int, optional): stops after this number of polls, runs forever if None
+    """
+    # jobs left running by a stopped worker are started again
+    interrupted = ConversionJob.objects.filter(
+        status=ConversionJob.RUNNING).update(status=ConversionJob.PENDING)
+    if interrupted:
+        logger.info("%d interrupted conversion jobs queued again", interrupted)
+    # database connections must not be shared with the pool processes
+    connections.close_all()
+    running: dict[Future, UUID] = {}
+    iteration = 0
+    pool = create_process_pool(concurrency)
+    try:
+        while max_iterations is None or iteration < max_iterations:
+            broken = False
+            for future in [future for future in running if future.done()]:
+                job_id = running.pop(future)
+                try:
+                    future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    __fail_job(job_id, 'The conversion process stopped unexpectedly')
+                except Exception as e:
+                    # the conversion errors are handled by run_job, not its own ones (database...)
+                    logger.error("Conversion job %s failed : %s", job_id, traceback.format_exc())
+                    __fail_job(job_id, str(e))
+            available = concurrency - len(running)
+            if available > 0 and not broken:
+                claimed = claim_pending_jobs(available)
+                for index, job_id in enumerate(claimed):
+                    try:
+                        running[pool.submit(run_job, job_id)] = job_id
+                    except BrokenProcessPool:
+                        broken = True
+                        # never started, run by the next pool
+                        ConversionJob.objects.filter(id__in=claimed[index:], status=ConversionJob.RUNNING).update(
+                            status=ConversionJob.PENDING)
+                        break
+                    logger.info("Starting conversion job %s", job_id)
+            if broken:
+                logger.error("A conversion process stopped unexpectedly, the pool is created again")
+                # the other jobs of the pool are lost with it
+                for job_id in running.values():
+                    __fail_job(job_id, 'The conversion process stopped unexpectedly')
+                running.clear()
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = create_process_pool(concurrency)
+            iteration += 1
+            time.sleep(poll_interval)
+    finally:
+        pool.shutdown()
+
+
+def __fail_job(job_id: UUID, error: str) -> None:
+    """Marks a job failed out of run_job, unless it ended (or was cancelled) meanwhile"""
+    ConversionJob.objects.filter(id=job_id, status=ConversionJob.RUNNING).update(
+        status=ConversionJob.FAILED, error=error)
@@ -0,0 +1,110 @@
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image
+
+from gaelo_pathology_processing.exceptions import GaelONotFoundException
+from gaelo_pathology_processing.services.probe import WsiProbe
+from gaelo_pathology_processing.services.slide_pool import close_slide_handle, open_slide_handle
+from gaelo_pathology_processing.services.utils import run_in_thread
+from gaelo_pathology_processing.services.wsi_index import aget_wsi_index, get_wsi_probe
+
+
+class TileCache:
+    """Thread safe LRU cache of encoded tiles, bounded by the TILE_CACHE_MAX_SIZE bytes of the tiles"""
+
+    def __init__(self):
+        self.tiles = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> bytes | None:
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+            return tile
+
+    def put(self, key: tuple, tile: bytes) -> None:
+        with self.lock:
+            if key in self.tiles:
+                return
+            self.tiles[key] = tile
+            self.size += len(tile)
+            while self.size > settings.TILE_CACHE_MAX_SIZE and self.tiles:
+                evicted_key, evicted_tile = self.tiles.popitem(last=False)
+                self.size -= len(evicted_tile)
+
+    def clear(self, wsi_id: str | None = None) -> None:
+        with self.lock:
+            for key in [key for key in self.tiles if wsi_id is None or key[0] == wsi_id]:
+                self.size -= len(self.tiles.pop(key))
+
+
+tile_cache = TileCache()
+
+
+async def __get_probe(wsi_id: str) -> WsiProbe:
+    return get_wsi_probe(await aget_wsi_index(wsi_id))
+
+
+def close_opened_slide(wsi_id: str) -> None:
+    """Closes the slide handle of a WSI and drops its tiles from the cache, ex : when it is deleted"""
+    close_slide_handle(wsi_id)
+    tile_cache.clear(wsi_id)
+
+
+def encode_jpeg(image: Image.Image) -> bytes:
+    buffer = BytesIO()
+    image.convert('RGB').save(buffer, format='JPEG', quality=settings.DEEPZOOM_JPEG_QUALITY)
+    return buffer.getvalue()
+
+
+def __read_dzi(wsi_id: str, probe: WsiProbe) -> str:
+    with open_slide_handle(wsi_id, lambda: probe) as handle:
+        return handle.deepzoom.get_dzi('jpeg')
+
+
+def __read_tile(wsi_id: str, probe: WsiProbe, level: int, column: int, row: int) -> bytes:
+    with open_slide_handle(wsi_id, lambda: probe) as handle:
+        try:
+            image = handle.deepzoom.get_tile(level, (column, row))
+        except ValueError:
+            raise GaelONotFoundException(f"Tile {level}/{column}_{row} doesn't exist")
+    return encode_jpeg(image)
+
+
+def __read_thumbnail(wsi_id: str, probe: WsiProbe, size: int) -> bytes:
+    with open_slide_handle(wsi_id, lambda: probe) as handle:
+        image = handle.slide.get_thumbnail((size, size))
+    return encode_jpeg(image)
+
+
+async def get_dzi(wsi_id: str) -> str:
+    """DeepZoom descriptor (XML) of a stored WSI, its tiles are served by get_tile"""
+    return await run_in_thread(__read_dzi)(wsi_id, await __get_probe(wsi_id))
+
+
+async def get_tile(wsi_id: str, level: int, column: int, row: int) -> bytes:
+    """
+    JPEG DeepZoom tile of a stored WSI, read and encoded in a thread of the executor. Raises
+    GaelONotFoundException if the tile doesn't exist
+    """
+    key = (wsi_id, 'tile', level, column, row)
+    tile = tile_cache.get(key)
+    if tile is None:
+        tile = await run_in_thread(__read_tile)(wsi_id, await __get_probe(wsi_id), level, column, row)
+        tile_cache.put(key, tile)
+    return tile
+
+
+async def get_thumbnail(wsi_id: str, size: int) -> bytes:
+    """JPEG thumbnail of a stored WSI fitting in size x size pixels, read and encoded in a thread of the executor"""
+    key = (wsi_id, 'thumbnail', size)
+    thumbnail = tile_cache.get(key)
+    if thumbnail is None:
+        thumbnail = await run_in_thread(__read_thumbnail)(wsi_id, await __get_probe(wsi_id), size)
+        tile_cache.put(key, thumbnail)
+    return thumbnail
@@ -0,0 +1,200 @@
+import logging
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from gaelo_pathology_processing.exceptions import GaelOBadRequestException, GaelODicomSinkException
+
+logger = logging.getLogger(__name__)
+
+SINK_STOW_RS = 'stow-rs'
+SINK_ORTHANC = 'orthanc'
+SINK_TYPES = (SINK_STOW_RS, SINK_ORTHANC)
+# delay before the first retry of a failed instance, doubled at each retry
+RETRY_DELAY = 0.5
+# (0008,1198) Failed SOP Sequence and (0008,1197) Failure Reason of a STOW-RS response
+FAILED_SOP_SEQUENCE = '00081198'
+FAILURE_REASON = '00081197'
+
+
+class InstanceBody:
+    """
+    Read only request body of a DICOM instance of file_size bytes read from file, between prefix and suffix
+    (multipart delimiters), streamed by requests with its Content-Length
+    """
+
+    def __init__(self, file: BinaryIO, file_size: int, prefix: bytes = b'', suffix: bytes = b''):
+        self.parts = [part for part in (prefix, file, suffix) if part != b'']
+        self.length = len(prefix) + file_size + len(suffix)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def read(self, size: int = -1) -> bytes:
+        data = b''
+        while self.parts and (size < 0 or len(data) < size):
+            part = self.parts[0]
+            if isinstance(part, bytes):
+                length = len(part) if size < 0 else size - len(data)
+                data += part[:length]
+                self.parts[0] = part[length:]
+                if not self.parts[0]:
+                    self.parts.pop(0)
+            else:
+                chunk = part.read(-1 if size < 0 else size - len(data))
+                if chunk:
+                    data += chunk
+                else:
+                    self.parts.pop(0)
+        return data
+
+
+class DicomSink:
+    """
+    Sends DICOM instances to a DICOMweb STOW-RS or Orthanc REST endpoint as they are added, with the interface
+    of DicomArchiveWriter so a conversion can write its instances in one or the other.
+
+    Instances are sent by concurrency threads over a keep-alive connection pool, at most twice as many
+    instances wait to be sent to cap the memory and the temporary files. A failed instance is retried and
+    the first definitive failure stops the sink : it is raised by the next add and by close.
+    """
+
+    def __init__(self, url: str, sink_type: str = SINK_STOW_RS, auth: tuple[str, str] | None = None,
+                 concurrency: int = 4, timeout: float = 60, retries: int = 2):
+        if sink_type not in SINK_TYPES:
+            raise GaelOBadRequestException(
+                f"Unknown DICOM sink type '{sink_type}', expected one of {', '.join(SINK_TYPES)}")
+        self.url = url.rstrip('/') + ('/studies' if sink_type == SINK_STOW_RS else '/instances')
+        self.sink_type = sink_type
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        self.session.auth = auth
+        self.session.mount(self.url, HTTPAdapter(pool_connections=1, pool_maxsize=concurrency))
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='dicom-sink')
+        self.slots = threading.BoundedSemaphore(2 * concurrency)
+        self.lock = threading.Lock()
+        self.errors = []
+        self.number_of_instances = 0
+        self.stored_instances = 0
+        self.sent_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        """Waits for the instances being sent, raises GaelODicomSinkException if one could not be stored"""
+        self.executor.shutdown(wait=True)
+        self.session.close()
+        self.__raise_errors()
+
+    def __raise_errors(self) -> None:
+        if self.errors:
+            raise GaelODicomSinkException(
+                f"{len(self.errors)} instances could not be stored in the DICOM sink : {self.errors[0]}")
+
+    def __submit(self, file: BinaryIO) -> None:
+        # blocks while too many instances are waiting to be sent
+        self.slots.acquire()
+        self.number_of_instances += 1
+        future = self.executor.submit(self.__send, file)
+        future.add_done_callback(lambda future: self.__done(future, file))
+
+    def __done(self, future: Future, file: BinaryIO) -> None:
+        file.close()
+        self.slots.release()
+        with self.lock:
+            if future.exception() is not None:
+                self.errors.append(str(future.exception()))
+            else:
+                self.stored_instances += 1
+                self.sent_bytes += future.result()
+
+    def __send(self, file: BinaryIO) -> int:
+        position = file.tell()
+        file_size = file.seek(0, 2) - position
+        for attempt in range(self.retries + 1):
+            file.seek(position)
+            try:
+                if self.sink_type == SINK_STOW_RS:
+                    boundary = uuid.uuid4().hex
+                    body = InstanceBody(file, file_size,
+                                        f'--{boundary}\r\nContent-Type: application/dicom\r\n\r\n'.encode(),
+                                        f'\r\n--{boundary}--\r\n'.encode())
+                    headers = {'Content-Type': f'multipart/related; type="application/dicom"; boundary={boundary}',
+                               'Accept': 'application/dicom+json'}
+                else:
+                    body = InstanceBody(file, file_size)
+                    headers = {'Content-Type': 'application/dicom'}
+                response = self.session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+                # 5xx are retried, the other errors would fail again
+                if response.status_code < 500 or attempt == self.retries:
+                    response.raise_for_status()
+                    if self.sink_type == SINK_STOW_RS:
+                        self.__raise_failed_sop(response)
+                    return file_size
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+            logger.warning('Storing an instance in %s failed, retrying', self.url)
+            time.sleep(RETRY_DELAY * 2 ** attempt)
+
+    @staticmethod
+    def __raise_failed_sop(response: requests.Response) -> None:
+        """A STOW-RS server answers 202 with the instance in the Failed SOP Sequence when it did not store it"""
+        try:
+            content = response.json()
+        except ValueError:
+            return
+        failed_sops = content.get(FAILED_SOP_SEQUENCE, {}).get('Value', []) if isinstance(content, dict) else []
+        if failed_sops:
+            reason = failed_sops[0].get(FAILURE_REASON, {}).get('Value', ['unknown'])[0]
+            raise GaelODicomSinkException(f"The instance was not stored by the STOW-RS server, failure reason {reason}")
+
+    def add_instance(self, data: bytes) -> None:
+        """Sends an encoded DICOM instance held in memory"""
+        self.__raise_errors()
+        file = tempfile.SpooledTemporaryFile(max_size=settings.TRANSCODE_SPOOL_MAX_SIZE)
+        file.write(data)
+        file.seek(0)
+        self.__submit(file)
+
+    @contextmanager
+    def open_instance(self, compressed: bool, file_size: int) -> Iterator[BinaryIO]:
+        """Opens a file to write an instance in, sent once closed"""
+        self.__raise_errors()
+        file = tempfile.SpooledTemporaryFile(max_size=settings.TRANSCODE_SPOOL_MAX_SIZE)
+        try:
+            yield file
+        except BaseException:
+            file.close()
+            raise
+        file.seek(0)
+        self.__submit(file)
+
+    def add_instance_file(self, path: str) -> None:
+        """Sends a DICOM file, streamed from the disk"""
+        self.__raise_errors()
+        self.__submit(open(path, 'rb'))
+
+
+def is_dicom_sink_configured() -> bool:
+    return bool(settings.DICOM_SINK_URL)
+
+
+def open_dicom_sink() -> DicomSink:
+    """DicomSink of the endpoint configured by the DICOM_SINK_* settings"""
+    auth = (settings.DICOM_SINK_USERNAME, settings.DICOM_SINK_PASSWORD) if settings.DICOM_SINK_USERNAME else None
+    return DicomSink(settings.DICOM_SINK_URL, settings.DICOM_SINK_TYPE, auth, settings.DICOM_SINK_CONCURRENCY,
+                     settings.DICOM_SINK_TIMEOUT, settings.DICOM_SINK_RETRIES)
@@ -0,0 +1,160 @@
+import hashlib
+import os
+import tempfile
+from struct import pack
+from typing import BinaryIO, Callable, Iterator
+
+import numpy as np
+from django.conf import settings
+from pydicom import Dataset, dcmread
+from pydicom.encaps import encapsulate, generate_frames
+from pydicom.filewriter import dcmwrite
+from pydicom.pixels import as_pixel_options, get_decoder, get_encoder, iter_pixels
+from pydicom.uid import JPEGLSLossless
+
+from gaelo_pathology_processing.services.metrics import STAGE_TRANSCODE, measure_stage
+
+ITEM_TAG = b'\xFE\xFF\x00\xE0'
+SEQUENCE_DELIMITER = b'\xFE\xFF\xDD\xE0\x00\x00\x00\x00'
+# (7FE0,0010) Pixel Data, OB, undefined length
+PIXEL_DATA_HEADER = b'\xE0\x7F\x10\x00OB\x00\x00\xFF\xFF\xFF\xFF'
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def transcode_dicom_frames_to_jpeg_lossless(input_path: str, output: str | BinaryIO) -> None:
+    """
+    Transcodes a DICOM file in JPEG-LS lossless one frame at a time.
+
+    Frames are decoded from the input file and encoded one by one into a spooled temporary file (kept in
+    memory up to TRANSCODE_SPOOL_MAX_SIZE), the pixel data
+    is then written in the output after the header with its offset table, so the peak memory is bounded by
+    a single decoded frame whatever the number of frames of the instance.
+
+    The frames are deduplicated : a frame whose encoded bytes, or else decoded pixels, are the ones of a
+    previous frame (background and padding tiles) is not decoded or encoded again, its JPEG-LS item is
+    copied. The transcode stage counts the encoded tiles and the deduplicated ones.
+
+    Args:
+        input_path (str): Path of the DICOM file to transcode
+        output (str | BinaryIO): Path or opened binary file to write the transcoded DICOM in
+    """
+    with measure_stage(STAGE_TRANSCODE) as measure:
+        measure.bytes = os.path.getsize(input_path)
+        measure.tiles, measure.deduplicated = __transcode_dicom_frames(input_path, output)
+
+
+def __iter_frames(input_path: str, dataset: Dataset) -> Iterator[tuple[bytes, Callable[[], np.ndarray]]]:
+    """Yields the encoded bytes of each frame with a function decoding it, one frame in memory at a time"""
+    transfer_syntax = dataset.file_meta.TransferSyntaxUID
+    if not transfer_syntax.is_encapsulated:
+        for frame in iter_pixels(input_path):
+            yield frame.tobytes(), lambda frame=frame: frame
+        return
+
+    decoder = get_decoder(transfer_syntax)
+    options = as_pixel_options(dataset) | {'number_of_frames': 1}
+    extended_offsets = (dataset.ExtendedOffsetTable, dataset.ExtendedOffsetTableLengths) \
+        if 'ExtendedOffsetTable' in dataset else None
+    with open(input_path, 'rb') as input_file:
+        # positioned at the Pixel Data element, its value starts with the Basic Offset Table item
+        dcmread(input_file, stop_before_pixels=True)
+        input_file.seek(len(PIXEL_DATA_HEADER), os.SEEK_CUR)
+        for frame in generate_frames(input_file, number_of_frames=int(dataset.get('NumberOfFrames', 1)),
+                                     extended_offsets=extended_offsets):
+            yield frame, lambda frame=frame: decoder.as_array(encapsulate([frame]), **options)[0]
+
+
+def __transcode_dicom_frames(input_path: str, output: str | BinaryIO) -> tuple[int, int]:
+    """Returns the number of encoded frames and of deduplicated frames"""
+    dataset = dcmread(input_path, stop_before_pixels=True)
+    samples_per_pixel = dataset.get('SamplesPerPixel', 1)
+    # decoded color frames are RGB
+    photometric_interpretation = 'RGB' if samples_per_pixel == 3 else dataset.PhotometricInterpretation
+    encoder = get_encoder(JPEGLSLossless)
+    encoding_options = {
+        'rows': dataset.Rows,
+        'columns': dataset.Columns,
+        'number_of_frames': 1,
+        'samples_per_pixel': samples_per_pixel,
+        'bits_allocated': dataset.BitsAllocated,
+        'bits_stored': dataset.BitsStored,
+        'pixel_representation': dataset.PixelRepresentation,
+        'photometric_interpretation': photometric_interpretation,
+        'planar_configuration': 0,
+    }
+
+    with tempfile.SpooledTemporaryFile(max_size=settings.TRANSCODE_SPOOL_MAX_SIZE) as frames_file:
+        # (position, length) in frames_file of the encoded frames, each frame is one of them
+        encoded_frames = []
+        frames = []
+        # index in encoded_frames by hash of the input frames and of their decoded pixels
+        encoded_indexes = {}
+        decoded_indexes = {}
+        for frame, decode in __iter_frames(input_path, dataset):
+            frame_hash = hashlib.sha256(frame).digest()
+            index = encoded_indexes.get(frame_hash)
+            if index is None:
+                pixels = decode()
+                pixels_hash = hashlib.sha256(pixels.tobytes()).digest()
+                index = decoded_indexes.get(pixels_hash)
+                if index is None:
+                    encoded_frame = encoder.encode(pixels, **encoding_options)
+                    # items have an even length
+                    if len(encoded_frame) % 2:
+                        encoded_frame += b'\x00'
+                    index = len(encoded_frames)
+                    encoded_frames.append((frames_file.tell(), len(encoded_frame)))
+                    frames_file.write(encoded_frame)
+                    decoded_indexes[pixels_hash] = index
+                encoded_indexes[frame_hash] = index
+            frames.append(index)
+        frame_lengths = [encoded_frames[index][1] for index in frames]
+
+        # offsets of the item of each frame from the end of the Basic Offset Table item
+        offsets = []
+        position = 0
+        for frame_length in frame_lengths:
+            offsets.append(position)
+            position += 8 + frame_length
+
+        for keyword in ('ExtendedOffsetTable', 'ExtendedOffsetTableLengths'):
+            if keyword in dataset:
+                delattr(dataset, keyword)
+        if position < 2 ** 32:
+            basic_offset_table = pack(f'<{len(offsets)}I', *offsets)
+        else:
+            # 32 bits offsets overflow, the Basic Offset Table stays empty and the Extended Offset Table is used
+            basic_offset_table = b''
+            dataset.ExtendedOffsetTable = pack(f'<{len(offsets)}Q', *offsets)
+            dataset.ExtendedOffsetTableLengths = pack(
+                f'<{len(frame_lengths)}Q', *frame_lengths)
+
+        dataset.file_meta.TransferSyntaxUID = JPEGLSLossless
+        dataset.PhotometricInterpretation = photometric_interpretation
+        if samples_per_pixel == 3:
+            dataset.PlanarConfiguration = 0
+
+        output_file = open(output, 'wb') if isinstance(output, str) else output
+        try:
+            # the header stops before Pixel Data, which is appended directly from the frames file
+            dcmwrite(output_file, dataset, enforce_file_format=False)
+            output_file.write(PIXEL_DATA_HEADER)
+            output_file.write(ITEM_TAG + pack('<I', len(basic_offset_table)))
+            output_file.write(basic_offset_table)
+            for index in frames:
+                frame_position, frame_length = encoded_frames[index]
+                # the frames are read in order, the deduplicated ones again
+                if frames_file.tell() != frame_position:
+                    frames_file.seek(frame_position)
+                output_file.write(ITEM_TAG + pack('<I', frame_length))
+                remaining = frame_length
+                while remaining:
+                    chunk = frames_file.read(min(remaining, COPY_BUFFER_SIZE))
+                    output_file.write(chunk)
+                    remaining -= len(chunk)
+            output_file.write(SEQUENCE_DELIMITER)
+        finally:
+            if isinstance(output, str):
+                output_file.close()
+    return len(encoded_frames), len(frames) - len(encoded_frames)
+
@@ -0,0 +1,148 @@
+import re
+from typing import AsyncIterator, BinaryIO
+
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpRequest, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+from django.utils.http import content_disposition_header
+
+from gaelo_pathology_processing.exceptions import GaelONotFoundException
+from gaelo_pathology_processing.services.file_helper import get_size, is_file_exists, open_file_range
+from gaelo_pathology_processing.services.utils import run_in_thread
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+# blocks read in a thread by AsyncFileResponse, large so the thread switches are negligible
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+
+class RangeFile:
+    """
+    Read only view of the next length bytes of a file, streamed by FileResponse.
+
+    fileno is the one of the file positioned on the range, so gunicorn sends it with sendfile (it sends
+    Content-Length bytes from the current offset), other servers and storages read it by blocks.
+    """
+
+    def __init__(self, file: BinaryIO, length: int):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class AsyncFileResponse(StreamingHttpResponse):
+    """
+    Attachment response streaming length bytes of a file by blocks read in a thread of the executor, for ASGI
+    servers : they would read the synchronous iterator of a FileResponse at once in memory
+    """
+
+    def __init__(self, file: BinaryIO, length: int, filename: str, content_type: str, status: int = 200,
+                 headers: dict | None = None):
+        super().__init__(self.__read_blocks(file, length), status=status, content_type=content_type,
+                         headers=headers)
+        # closed even if the client disconnects before the end
+        self._resource_closers.append(file.close)
+        self['Content-Length'] = length
+        self['Content-Disposition'] = content_disposition_header(True, filename)
+
+    @staticmethod
+    async def __read_blocks(file: BinaryIO, length: int) -> AsyncIterator[bytes]:
+        read = run_in_thread(file.read)
+        while length > 0:
+            data = await read(min(STREAM_BLOCK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def is_asgi_request(request: HttpRequest) -> bool:
+    # the DRF Request wraps the Django one
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+def parse_range(range_header: str, size: int) -> tuple[int, int] | None:
+    """
+    Parses a single range Range header into (start, end) included, start >= size if it is not satisfiable,
+    None if it must be ignored (malformed or several ranges)
+    """
+    match = RANGE_PATTERN.match(range_header.strip())
+    if match is None or (not match[1] and not match[2]):
+        return None
+    if match[1]:
+        start = int(match[1])
+        if not match[2]:
+            return start, size - 1
+        end = int(match[2])
+        if end < start:
+            return None
+        return start, min(end, size - 1)
+    # suffix range : last bytes of the file
+    suffix_length = int(match[2])
+    if suffix_length == 0:
+        return size, size - 1
+    return max(size - suffix_length, 0), size - 1
+
+
+def etag_matches(header: str | None, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header with the etag"""
+    if header is None:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in header.split(',')]
+    return '*' in tags or etag.removeprefix('W/') in tags
+
+
+def create_download_response(request: HttpRequest, storage_name: str, filename: str, download_name: str,
+                             content_type: str, etag: str) -> HttpResponseBase:
+    """
+    Response downloading a stored file with conditional (If-None-Match) and range (Range, If-Range) requests
+    support, so interrupted downloads of large files can resume. Served by blocks read in a thread to ASGI
+    servers, with sendfile by gunicorn sync workers, only the sent range is fetched from object storages.
+
+    Args:
+        request (HttpRequest): the download request
+        storage_name (str): The name of the storage (ex: 'dicoms').
+        filename (str): The name of the file in the storage.
+        download_name (str): File name of the Content-Disposition
+        content_type (str): Content-Type of the file
+        etag (str): quoted strong ETag of the file content (stored files are never modified)
+    """
+    if not is_file_exists(storage_name, filename):
+        raise GaelONotFoundException("File doesn't exist")
+    headers = {'ETag': etag, 'Accept-Ranges': 'bytes'}
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return HttpResponseNotModified(headers=headers)
+
+    size = get_size(storage_name, filename)
+    byte_range = None
+    # a range of a different version of the file is ignored and the whole file is sent
+    if 'Range' in request.headers and request.headers.get('If-Range', etag) == etag:
+        byte_range = parse_range(request.headers['Range'], size)
+    if byte_range is not None and byte_range[0] >= size:
+        return HttpResponse(status=416, headers=headers | {'Content-Range': f'bytes */{size}'})
+
+    status, length = 200, size
+    if byte_range is None:
+        file = open_file_range(storage_name, filename, 0, size)
+    else:
+        start, end = byte_range
+        status, length = 206, end - start + 1
+        file = RangeFile(open_file_range(storage_name, filename, start, length), length)
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    if is_asgi_request(request):
+        return AsyncFileResponse(file, length, download_name, content_type, status, headers)
+    response = FileResponse(file, status=status, as_attachment=True, filename=download_name,
+                            content_type=content_type, headers=headers)
+    response['Content-Length'] = length
+    return response
@@ -0,0 +1,101 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import ExitStack, contextmanager
+from typing import Iterator
+
+from django.conf import settings
+
+from gaelo_pathology_processing.services.cache_directory import (
+    commit_cache_entry, create_cache_entry, delete_cache_entry, evict_cache, get_cache_root, lock_cache_key,
+    open_cache_entry)
+from gaelo_pathology_processing.services.file_helper import materialize
+from gaelo_pathology_processing.services.probe import CONTAINER_ZIP, WsiProbe
+from gaelo_pathology_processing.services.utils import extract_zipped_slide
+
+logger = logging.getLogger(__name__)
+
+# extracted files are in a sub folder, next to the manifest of the entry
+SLIDE_FOLDER = 'slide'
+
+
+def is_extraction_cache_enabled() -> bool:
+    return settings.EXTRACTION_CACHE_MAX_SIZE > 0
+
+
+@contextmanager
+def open_extracted_slide(wsi_id: str, zip_path: str, probe: WsiProbe) -> Iterator[str]:
+    """
+    Yields the path of the file to open of a zipped WSI, extracted once in the extraction cache.
+
+    The extraction is shared by the conversions of the same WSI, concurrent users wait for the first
+    extraction instead of extracting again, and the entry is not evicted while it is used. Without the cache
+    the WSI is extracted in a temporary folder.
+
+    Args:
+        wsi_id (str): id of the WSI, key of the extraction
+        zip_path (str): local path of the zip
+        probe (WsiProbe): probe result of the zip
+    """
+    if not is_extraction_cache_enabled():
+        with tempfile.TemporaryDirectory() as temp_dir:
+            yield extract_zipped_slide(zip_path, temp_dir, probe.entry)
+        return
+
+    root = get_cache_root('extraction_cache')
+    with ExitStack() as stack:
+        entry = stack.enter_context(open_cache_entry(root, wsi_id))
+        if entry is None:
+            with lock_cache_key(root, wsi_id):
+                # extracted meanwhile by the holder of the lock
+                entry = stack.enter_context(open_cache_entry(root, wsi_id))
+                if entry is None:
+                    temp_path = create_cache_entry(root)
+                    try:
+                        slide_path = extract_zipped_slide(
+                            zip_path, os.path.join(temp_path, SLIDE_FOLDER), probe.entry)
+                        size = sum(os.path.getsize(os.path.join(directory, file))
+                                   for directory, dirs, files in os.walk(temp_path) for file in files)
+                    except BaseException:
+                        shutil.rmtree(temp_path, ignore_errors=True)
+                        raise
+                    manifest = {'entry': os.path.relpath(slide_path, temp_path), 'size': size}
+                    entry = stack.enter_context(commit_cache_entry(root, wsi_id, temp_path, manifest))
+            evict_cache(root, settings.EXTRACTION_CACHE_MAX_SIZE)
+        yield os.path.join(entry.path, entry.manifest['entry'])
+
+
+@contextmanager
+def open_stored_slide(wsi_id: str, probe: WsiProbe) -> Iterator[str]:
+    """Yields the local path of the file to open of a stored WSI, extracted through the cache if zipped"""
+    with materialize('wsi', wsi_id) as wsi_path:
+        if probe.container == CONTAINER_ZIP:
+            with open_extracted_slide(wsi_id, wsi_path, probe) as slide_path:
+                yield slide_path
+        else:
+            yield wsi_path
+
+
+def warm_extraction_cache(wsi_id: str, probe: WsiProbe) -> threading.Thread | None:
+    """Extracts a stored zipped WSI in the cache in a background thread, None if there is nothing to do"""
+    if probe.container != CONTAINER_ZIP or not is_extraction_cache_enabled():
+        return None
+
+    def extract():
+        try:
+            with open_stored_slide(wsi_id, probe):
+                pass
+        except Exception:
+            logger.exception('Extraction of WSI %s failed', wsi_id)
+
+    thread = threading.Thread(target=extract, name=f'extract-{wsi_id}', daemon=True)
+    thread.start()
+    return thread
+
+
+def delete_extracted_slide(wsi_id: str) -> None:
+    """Removes the extraction of a WSI from the cache, kept until eviction if a conversion uses it"""
+    if is_extraction_cache_enabled():
+        delete_cache_entry(get_cache_root('extraction_cache'), wsi_id)
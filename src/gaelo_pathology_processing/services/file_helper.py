@@ -1,11 +1,45 @@
 import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import ExitStack, contextmanager
+from typing import BinaryIO, Iterator
+from django.conf import settings
 from django.core.files.storage import storages, Storage
-from django.core.files.base import ContentFile
+from django.core.files.base import ContentFile, File
+
+from gaelo_pathology_processing.services.cache_directory import (
+    commit_cache_entry, create_cache_entry, delete_cache_entry, evict_cache, get_cache_root, lock_cache_key,
+    open_cache_entry)
 
 
 def get_hash(path_to_tmp: str) -> str:
-    hash = hashlib.md5(open(path_to_tmp, 'rb').read()).hexdigest()
-    return hash
+    hash = hashlib.md5()
+    with open(path_to_tmp, 'rb') as file:
+        for chunk in iter(lambda: file.read(settings.UPLOAD_CHUNK_SIZE), b''):
+            hash.update(chunk)
+    return hash.hexdigest()
+
+
+def write_stream(stream: BinaryIO | None, destination: BinaryIO) -> str:
+    """
+    Copies a binary stream into destination chunk by chunk and hashes it on the fly,
+    so memory usage does not depend on the stream size.
+
+    Args:
+        stream (BinaryIO | None): Stream to read (ex: the WSGI input of a request), None is handled as empty
+        destination (BinaryIO): Opened binary file to write into
+
+    Returns:
+        str: md5 hexdigest of the written content
+    """
+    hash = hashlib.md5()
+    if stream is not None:
+        for chunk in iter(lambda: stream.read(settings.UPLOAD_CHUNK_SIZE), b''):
+            hash.update(chunk)
+            destination.write(chunk)
+    destination.flush()
+    return hash.hexdigest()
 
 
 def __get_storage(storage_name: str) -> Storage:
@@ -22,7 +56,122 @@ def move_to_storage(storage_name: str, path_origin: str, filename: str) -> None:
     storage = __get_storage(storage_name)
 
     if (not storage.exists(filename)):
-        storage.save(filename, open(path_origin, 'rb'))
+        # object storages upload the parts of large files in parallel
+        if hasattr(storage, 'upload_from_path'):
+            storage.upload_from_path(path_origin, filename)
+            return
+        with open(path_origin, 'rb') as file:
+            storage.save(filename, file)
+
+
+def __get_local_path(storage: Storage, filename: str) -> str | None:
+    try:
+        return storage.path(filename)
+    except NotImplementedError:
+        return None
+
+
+@contextmanager
+def open_storage_writer(storage_name: str, filename: str) -> Iterator[BinaryIO]:
+    """
+    Yields a binary file to write filename in, the file appears in the storage only once the block succeeds.
+
+    For storages on the local filesystem the file is written directly in the storage folder and renamed
+    atomically at the end, avoiding a copy of the whole file. Other storages get a temporary file saved
+    in the storage at the end.
+
+    Args:
+        storage_name (str): The name of the storage (ex: 'dicoms').
+        filename (str): The name of the file to create.
+    """
+    storage = __get_storage(storage_name)
+    final_path = __get_local_path(storage, filename)
+    if final_path is None:
+        with tempfile.TemporaryFile() as temp_file:
+            yield temp_file
+            temp_file.seek(0)
+            if (not storage.exists(filename)):
+                storage.save(filename, File(temp_file))
+        return
+
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    temp_file = tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(final_path), prefix='.', suffix='.part', delete=False)
+    try:
+        with temp_file:
+            yield temp_file
+        os.chmod(temp_file.name, storage.file_permissions_mode or 0o644)
+        os.replace(temp_file.name, final_path)
+    except BaseException:
+        os.remove(temp_file.name)
+        raise
+
+
+def __get_materialization_key(storage_name: str, filename: str) -> str:
+    return f"{storage_name}-{filename.replace('/', '_')}"
+
+
+def __download(storage: Storage, filename: str, path: str) -> None:
+    # object storages download the ranges of large files in parallel
+    if hasattr(storage, 'download_to_path'):
+        storage.download_to_path(filename, path)
+        return
+    with storage.open(filename, 'rb') as file, open(path, 'wb') as destination:
+        shutil.copyfileobj(file, destination, settings.UPLOAD_CHUNK_SIZE)
+
+
+def is_materialization_cache_enabled() -> bool:
+    return settings.MATERIALIZATION_CACHE_MAX_SIZE > 0
+
+
+@contextmanager
+def materialize(storage_name: str, filename: str) -> Iterator[str]:
+    """
+    Yields a local path of a stored file, for the readers which need a real file (OpenSlide, zipfile, the
+    dicomizers).
+
+    Files of a storage on the local filesystem are used in place. Files of other storages (object storage)
+    are downloaded once in the materialization cache, shared by the processes, concurrent users wait for the
+    first download and the copy is not evicted while it is used. Without the cache the file is downloaded in
+    a temporary folder.
+
+    Args:
+        storage_name (str): The name of the storage (ex: 'wsi').
+        filename (str): The name of the file in the storage.
+    """
+    storage = __get_storage(storage_name)
+    local_path = __get_local_path(storage, filename)
+    if local_path is not None:
+        yield local_path
+        return
+
+    basename = os.path.basename(filename)
+    if not is_materialization_cache_enabled():
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, basename)
+            __download(storage, filename, path)
+            yield path
+        return
+
+    root = get_cache_root('materialization_cache')
+    key = __get_materialization_key(storage_name, filename)
+    with ExitStack() as stack:
+        entry = stack.enter_context(open_cache_entry(root, key))
+        if entry is None:
+            with lock_cache_key(root, key):
+                # downloaded meanwhile by the holder of the lock
+                entry = stack.enter_context(open_cache_entry(root, key))
+                if entry is None:
+                    temp_path = create_cache_entry(root)
+                    try:
+                        __download(storage, filename, os.path.join(temp_path, basename))
+                    except BaseException:
+                        shutil.rmtree(temp_path, ignore_errors=True)
+                        raise
+                    manifest = {'entry': basename, 'size': os.path.getsize(os.path.join(temp_path, basename))}
+                    entry = stack.enter_context(commit_cache_entry(root, key, temp_path, manifest))
+            evict_cache(root, settings.MATERIALIZATION_CACHE_MAX_SIZE)
+        yield os.path.join(entry.path, entry.manifest['entry'])
 
 
 def get_file(storage_name: str, filename: str):
@@ -41,6 +190,19 @@ def get_file(storage_name: str, filename: str):
     return file
 
 
+def open_file_range(storage_name: str, filename: str, start: int, length: int) -> BinaryIO:
+    """
+    Opens a stored file to read length bytes from start, object storages fetch only this range where get_file
+    downloads the whole file, the other storages open the file positioned on start.
+    """
+    storage = __get_storage(storage_name)
+    if hasattr(storage, 'open_range'):
+        return storage.open_range(filename, start, length)
+    file = storage.open(filename, 'rb')
+    file.seek(start)
+    return file
+
+
 def is_file_exists(storage_name: str, filename: str) -> bool:
     storage = __get_storage(storage_name)
     return storage.exists(filename)
@@ -67,6 +229,14 @@ def list_files(storage_name: str, path: str = '') -> tuple[list[str], list[str]]
 def delete_file(storage_name: str, filename: str) -> None:
     storage = __get_storage(storage_name)
     storage.delete(filename)
+    if __get_local_path(storage, filename) is None and is_materialization_cache_enabled():
+        # a copy in use is evicted once released
+        delete_cache_entry(get_cache_root('materialization_cache'), __get_materialization_key(storage_name, filename))
+
+
+def get_size(storage_name: str, filename: str) -> int:
+    storage = __get_storage(storage_name)
+    return storage.size(filename)
 
 
 def get_path(storage_name: str, filename: str) -> str:
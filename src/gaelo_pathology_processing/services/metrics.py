@@ -0,0 +1,259 @@
+import fcntl
+import json
+import logging
+import os
+import resource
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# stages of the upload and conversion pipeline
+STAGE_UPLOAD = 'upload'
+STAGE_PROBE = 'probe'
+STAGE_STORE = 'store'
+STAGE_EXTRACTION = 'extraction'
+STAGE_DICOMIZATION = 'dicomization'
+STAGE_TRANSCODE = 'transcode'
+STAGE_ARCHIVE = 'archive'
+STAGE_SINK = 'sink'
+
+# totals of the processes stopped since the start, in METRICS_DIR next to the files of the running ones
+RETIRED_METRICS_FILE = 'retired.json'
+
+__lock = threading.Lock()
+# totals of this process : stage -> {count, seconds, bytes, tiles, deduplicated, process_peak_rss}
+__stages: dict[str, dict] = {}
+# file of this process in METRICS_DIR is {pid}-{id}.json, the id telling apart the processes reusing a pid
+__process_id = uuid.uuid4().hex
+__timings: ContextVar[list | None] = ContextVar('timings', default=None)
+# if the stages run in this context are sent back to another process, which records them
+__sent_back: ContextVar[bool] = ContextVar('sent_back', default=False)
+
+
+@dataclass
+class StageMeasure:
+    """
+    Measure of a running stage, bytes is set by the stage to the size of the data it processed, tiles to
+    the number of tiles it encoded and deduplicated to the number of tiles it reused instead of encoding them
+    """
+
+    stage: str
+    bytes: int = 0
+    tiles: int = 0
+    deduplicated: int = 0
+
+
+def get_process_peak_rss() -> int:
+    """Peak resident memory of this process in bytes since its start, not only during the current stage"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def measure_stage(stage: str) -> Iterator[StageMeasure]:
+    """Measures the duration and processed bytes of a stage, recorded even if it fails"""
+    measure = StageMeasure(stage)
+    start = time.perf_counter()
+    try:
+        yield measure
+    finally:
+        record_stage(stage, time.perf_counter() - start, measure.bytes, measure.tiles, measure.deduplicated)
+
+
+def record_stage(stage: str, seconds: float, bytes: int = 0, tiles: int = 0, deduplicated: int = 0) -> None:
+    """
+    Adds a stage run to the timings being collected and to the metrics of the process, unless run_with_timings
+    sends them back to another process
+    """
+    process_peak_rss = get_process_peak_rss()
+    logger.info('Stage %s : %.3f s, %d bytes, %d tiles (%d deduplicated), process peak RSS %d bytes', stage, seconds,
+                bytes, tiles, deduplicated, process_peak_rss)
+    timing = {'stage': stage, 'seconds': seconds, 'bytes': bytes, 'tiles': tiles, 'deduplicated': deduplicated,
+              'process_peak_rss': process_peak_rss}
+    timings = __timings.get()
+    if timings is not None:
+        timings.append(timing)
+    if not __sent_back.get():
+        __add_process_metrics([timing])
+
+
+def __add_process_metrics(timings: list[dict]) -> None:
+    with __lock:
+        for timing in timings:
+            __add_stage(__stages, timing['stage'], timing)
+        # one file per long running process (web workers, conversion worker and its job processes), summed by
+        # render_metrics, the short lived pool processes send their timings back instead
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        __write_stages(os.path.join(settings.METRICS_DIR, f'{os.getpid()}-{__process_id}.json'), __stages)
+
+
+def __add_stage(stages: dict, stage: str, values: dict, count: int = 1) -> None:
+    """Adds count runs of a stage (a timing or the totals of a process) to the totals of stages"""
+    totals = stages.setdefault(stage, {'count': 0, 'seconds': 0.0, 'bytes': 0, 'tiles': 0, 'deduplicated': 0,
+                                       'process_peak_rss': 0})
+    totals['count'] += count
+    totals['seconds'] += values['seconds']
+    totals['bytes'] += values['bytes']
+    # absent from the files of the processes started before they were counted
+    totals['tiles'] += values.get('tiles', 0)
+    totals['deduplicated'] += values.get('deduplicated', 0)
+    totals['process_peak_rss'] = max(totals['process_peak_rss'], values.get('process_peak_rss', 0))
+
+
+def __write_stages(path: str, stages: dict) -> None:
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), prefix='.', delete=False) as file:
+        json.dump(stages, file)
+    os.replace(file.name, path)
+
+
+def __read_stages(path: str) -> dict:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def __is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def __retire_stopped_processes() -> None:
+    """
+    Adds the totals of the stopped processes to RETIRED_METRICS_FILE and deletes their files, so the totals
+    never decrease and the files of the running processes only are read
+    """
+    with open(os.path.join(settings.METRICS_DIR, '.lock'), 'a') as lock_file:
+        # one scrape at a time, a file is retired once
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        retired_path = os.path.join(settings.METRICS_DIR, RETIRED_METRICS_FILE)
+        retired = __read_stages(retired_path)
+        stopped = []
+        for name in os.listdir(settings.METRICS_DIR):
+            pid = name.split('-')[0]
+            if name.startswith('.') or not pid.isdigit() or __is_running(int(pid)):
+                continue
+            path = os.path.join(settings.METRICS_DIR, name)
+            for stage, values in __read_stages(path).items():
+                __add_stage(retired, stage, values, values['count'])
+            stopped.append(path)
+        if stopped:
+            __write_stages(retired_path, retired)
+            for path in stopped:
+                os.remove(path)
+
+
+@contextmanager
+def collect_timings() -> Iterator[list[dict]]:
+    """Collects the stages run in this context (and the ones added by add_timings) in the yielded list"""
+    timings = []
+    token = __timings.set(timings)
+    try:
+        yield timings
+    finally:
+        __timings.reset(token)
+
+
+def run_with_timings(function: Callable, *args) -> tuple[Any, list[dict]]:
+    """
+    Runs function and returns its result with its stage timings, to send them back from a pool process : they
+    are recorded by the caller (add_timings), not in the metrics of the pool process
+    """
+    token = __sent_back.set(True)
+    try:
+        with collect_timings() as timings:
+            result = function(*args)
+    finally:
+        __sent_back.reset(token)
+    return result, timings
+
+
+def add_timings(timings: list[dict]) -> None:
+    """Adds the timings of stages run in another process to the timings being collected and to the metrics"""
+    current_timings = __timings.get()
+    if current_timings is not None:
+        current_timings.extend(timings)
+    if not __sent_back.get():
+        __add_process_metrics(timings)
+
+
+def summarize_timings(timings: list[dict]) -> dict:
+    """
+    Per stage breakdown of collected timings : {stage: {count, seconds, bytes, tiles, deduplicated,
+    process_peak_rss}}, process_peak_rss being the highest peak RSS of the processes since their start
+    """
+    summary = {}
+    for timing in timings:
+        __add_stage(summary, timing['stage'], timing)
+    for totals in summary.values():
+        totals['seconds'] = round(totals['seconds'], 3)
+    return summary
+
+
+def render_metrics(extra_gauges: dict[str, tuple[str, dict[str, float]]] | None = None) -> str:
+    """
+    Prometheus text exposition of the stage metrics of all the processes, the running ones and the stopped ones
+
+    Args:
+        extra_gauges (dict, optional): {name: (help, {label value: value})} gauges with a status label
+    """
+    stages = {}
+    if os.path.isdir(settings.METRICS_DIR):
+        __retire_stopped_processes()
+        for name in os.listdir(settings.METRICS_DIR):
+            if name.startswith('.'):
+                continue
+            for stage, values in __read_stages(os.path.join(settings.METRICS_DIR, name)).items():
+                __add_stage(stages, stage, values, values['count'])
+
+    lines = [
+        '# HELP gaelo_stage_duration_seconds Time spent in each stage of the upload and conversion pipeline',
+        '# TYPE gaelo_stage_duration_seconds summary',
+    ]
+    for stage, totals in sorted(stages.items()):
+        lines.append(f'gaelo_stage_duration_seconds_sum{{stage="{stage}"}} {totals["seconds"]}')
+        lines.append(f'gaelo_stage_duration_seconds_count{{stage="{stage}"}} {totals["count"]}')
+    lines += [
+        '# HELP gaelo_stage_bytes_total Bytes processed by each stage',
+        '# TYPE gaelo_stage_bytes_total counter',
+    ]
+    for stage, totals in sorted(stages.items()):
+        lines.append(f'gaelo_stage_bytes_total{{stage="{stage}"}} {totals["bytes"]}')
+    lines += [
+        '# HELP gaelo_stage_tiles_total Tiles encoded by each stage',
+        '# TYPE gaelo_stage_tiles_total counter',
+    ]
+    for stage, totals in sorted(stages.items()):
+        lines.append(f'gaelo_stage_tiles_total{{stage="{stage}"}} {totals["tiles"]}')
+    lines += [
+        '# HELP gaelo_stage_deduplicated_tiles_total Tiles reused by each stage instead of being encoded again',
+        '# TYPE gaelo_stage_deduplicated_tiles_total counter',
+    ]
+    for stage, totals in sorted(stages.items()):
+        lines.append(f'gaelo_stage_deduplicated_tiles_total{{stage="{stage}"}} {totals["deduplicated"]}')
+    lines += [
+        '# HELP gaelo_stage_process_peak_rss_bytes Highest peak resident memory, since their start, of the processes '
+        'having run each stage',
+        '# TYPE gaelo_stage_process_peak_rss_bytes gauge',
+    ]
+    for stage, totals in sorted(stages.items()):
+        lines.append(f'gaelo_stage_process_peak_rss_bytes{{stage="{stage}"}} {totals["process_peak_rss"]}')
+    for name, (help, values) in (extra_gauges or {}).items():
+        lines += [f'# HELP {name} {help}', f'# TYPE {name} gauge']
+        for label, value in sorted(values.items()):
+            lines.append(f'{name}{{status="{label}"}} {value}')
+    return '\n'.join(lines) + '\n'
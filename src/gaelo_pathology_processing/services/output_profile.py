@@ -0,0 +1,47 @@
+from dataclasses import dataclass
+
+from django.conf import settings
+from wsidicom.codec import JpegSettings, JpegLsSettings, Jpeg2kSettings, Subsampling, Settings
+
+from gaelo_pathology_processing.exceptions import GaelOBadRequestException
+
+
+@dataclass(frozen=True)
+class OutputProfile:
+    """Encoding of the tiles of the generated DICOM, chosen by the output_profile of a conversion request"""
+
+    name: str
+    # encoding used by wsidicomizer (BigPictureDicomizer) for the tiles it has to encode
+    encoding_settings: Settings
+    # compression arguments of OrthancWSIDicomizer, None if it can't produce this encoding
+    orthanc_arguments: list[str] | None
+    # transcode the dicomizer output in JPEG-LS lossless after the conversion
+    transcode_jpeg_ls: bool
+    # re-encode every tile with encoding_settings, else wsidicomizer copies the source tiles it can read encoded
+    reencode_tiles: bool = True
+
+
+JPEG_100 = JpegSettings(quality=100, subsampling=Subsampling.from_string("420"))
+
+OUTPUT_PROFILES = {profile.name: profile for profile in [
+    # historical behavior : JPEG tiles re-encoded in JPEG-LS lossless
+    OutputProfile('jpegls-transcode', JPEG_100,
+                  ["--compression=jpeg", "--jpeg-quality=100"], True),
+    OutputProfile('jpeg', JPEG_100,
+                  ["--compression=jpeg", "--jpeg-quality=100"], False),
+    # JPEG-LS lossless tiles encoded directly from the source pixels
+    OutputProfile('jpegls-direct', JpegLsSettings(level=0), None, False),
+    OutputProfile('jpeg2000-lossless', Jpeg2kSettings(levels=0), None, False),
+    # source tiles copied without re-encoding when wsidicomizer can (ex : svs, ndpi), JPEG otherwise
+    OutputProfile('passthrough', JPEG_100, None, False, reencode_tiles=False),
+]}
+
+
+def get_output_profile(name: str | None) -> OutputProfile:
+    """Returns the named profile, DEFAULT_OUTPUT_PROFILE if name is None"""
+    if name is None:
+        name = settings.DEFAULT_OUTPUT_PROFILE
+    if name not in OUTPUT_PROFILES:
+        raise GaelOBadRequestException(
+            f"Unknown output profile '{name}', expected one of {', '.join(OUTPUT_PROFILES.keys())}")
+    return OUTPUT_PROFILES[name]
@@ -0,0 +1,89 @@
+import zipfile
+from dataclasses import dataclass, replace
+
+from isyntax import ISyntax
+from openslide import OpenSlide
+
+from gaelo_pathology_processing.services.metrics import STAGE_PROBE, StageMeasure, measure_stage
+
+CONTAINER_FILE = 'file'
+CONTAINER_ZIP = 'zip'
+
+# dicomizer able to read the format
+BACKEND_ORTHANC = 'orthanc'
+BACKEND_BIGPICTURE = 'bigpicture'
+# formats OrthancWSIDicomizer can't read
+BIGPICTURE_ONLY_FORMATS = ('leica', 'isyntax')
+
+ZIP_MAGIC = b'PK\x03\x04'
+# iSyntax files start with an XML header describing the DPUfsImport object
+ISYNTAX_MAGIC = b'DPUfsImport'
+HEADER_SIZE = 4096
+
+
+@dataclass(frozen=True)
+class WsiProbe:
+    """Result of the format detection of a WSI file, computed once at upload and stored in the WSI index"""
+
+    # slide format (aperio, mirax, isyntax...)
+    format: str
+    # CONTAINER_FILE for a single file, CONTAINER_ZIP for a slide split in several files zipped together
+    container: str
+    # path inside the zip of the file to open, None for CONTAINER_FILE
+    entry: str | None
+    # BACKEND_ORTHANC or BACKEND_BIGPICTURE
+    backend: str
+
+    def as_extracted(self) -> 'WsiProbe':
+        """Probe of the entry file once extracted from its container"""
+        return replace(self, container=CONTAINER_FILE, entry=None)
+
+
+def __create_probe(format: str, container: str = CONTAINER_FILE, entry: str | None = None) -> WsiProbe:
+    backend = BACKEND_BIGPICTURE if format in BIGPICTURE_ONLY_FORMATS else BACKEND_ORTHANC
+    return WsiProbe(format, container, entry, backend)
+
+
+def probe_wsi(path: str) -> WsiProbe | None:
+    """
+    Detects the format of a WSI file from its header, without opening the slide, returns None if the file
+    is not a supported WSI
+    """
+    with measure_stage(STAGE_PROBE) as measure:
+        return __probe_wsi(path, measure)
+
+
+def __probe_wsi(path: str, measure: StageMeasure) -> WsiProbe | None:
+    with open(path, 'rb') as file:
+        header = file.read(HEADER_SIZE)
+    measure.bytes = len(header)
+
+    if header.startswith(ZIP_MAGIC):
+        # zipped mirax : the .mrxs file with its data folder
+        try:
+            with zipfile.ZipFile(path, 'r') as zip_ref:
+                for name in zip_ref.namelist():
+                    if name.lower().endswith('.mrxs'):
+                        return __create_probe('mirax', CONTAINER_ZIP, name)
+        except zipfile.BadZipFile:
+            return None
+        return None
+
+    if header.lstrip().startswith(b'<'):
+        if ISYNTAX_MAGIC in header or __is_isyntax(path):
+            return __create_probe('isyntax')
+        return None
+
+    try:
+        format = OpenSlide.detect_format(path)
+    except Exception:
+        return None
+    return __create_probe(format) if format is not None else None
+
+
+def __is_isyntax(path: str) -> bool:
+    try:
+        with ISyntax.open(path):
+            return True
+    except Exception:
+        return False
@@ -0,0 +1,51 @@
+from io import BytesIO
+from typing import BinaryIO
+
+from boto3.s3.transfer import TransferConfig
+from django.conf import settings
+from storages.backends.s3 import S3Storage as BaseS3Storage
+from storages.utils import clean_name
+
+
+class S3Storage(BaseS3Storage):
+    """
+    Storage in a bucket of an S3 compatible object storage (AWS, MinIO, Ceph...), configured by the S3_* settings,
+    the OPTIONS of the storage (ex : location, the prefix of its files) take precedence.
+
+    Files larger than S3_MULTIPART_CHUNK_SIZE are uploaded and downloaded by parts of this size, S3_MAX_CONCURRENCY
+    in parallel. Files opened with storage.open are downloaded in a temporary file, spooled to disk above
+    FILE_UPLOAD_MAX_MEMORY_SIZE, the readers needing a path use file_helper.materialize and the downloads
+    stream the requested range with open_range.
+    """
+
+    def get_default_settings(self) -> dict:
+        return super().get_default_settings() | {
+            'bucket_name': settings.S3_BUCKET,
+            'endpoint_url': settings.S3_ENDPOINT_URL or None,
+            'region_name': settings.S3_REGION or None,
+            'access_key': settings.S3_ACCESS_KEY_ID or None,
+            'secret_key': settings.S3_SECRET_ACCESS_KEY or None,
+            'max_memory_size': settings.FILE_UPLOAD_MAX_MEMORY_SIZE,
+            'transfer_config': TransferConfig(multipart_threshold=settings.S3_MULTIPART_CHUNK_SIZE,
+                                              multipart_chunksize=settings.S3_MULTIPART_CHUNK_SIZE,
+                                              max_concurrency=settings.S3_MAX_CONCURRENCY),
+        }
+
+    def __get_key(self, name: str) -> str:
+        return self._normalize_name(clean_name(name))
+
+    def upload_from_path(self, path: str, name: str) -> None:
+        """Uploads a local file as name, the parts of a large file are read and sent in parallel"""
+        self.bucket.upload_file(path, self.__get_key(name), ExtraArgs=self._get_write_parameters(name),
+                                Config=self.transfer_config)
+
+    def download_to_path(self, name: str, path: str) -> None:
+        """Downloads name to a local file, by ranges fetched in parallel for a large file"""
+        self.bucket.download_file(self.__get_key(name), path, Config=self.transfer_config)
+
+    def open_range(self, name: str, start: int, length: int) -> BinaryIO:
+        """Streams length bytes of name from start with a ranged GET, the rest of the object is not fetched"""
+        if length == 0:
+            return BytesIO()
+        response = self.bucket.Object(self.__get_key(name)).get(Range=f'bytes={start}-{start + length - 1}')
+        return response['Body']
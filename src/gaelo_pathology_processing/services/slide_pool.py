@@ -0,0 +1,223 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from functools import cached_property
+from typing import Callable, Iterator
+
+from django.conf import settings
+from isyntax import ISyntax
+from openslide import OpenSlide
+from openslide.deepzoom import DeepZoomGenerator
+from PIL import Image
+
+from gaelo_pathology_processing.services.extraction_cache import open_stored_slide
+from gaelo_pathology_processing.services.probe import WsiProbe
+
+
+class ISyntaxSlide:
+    """Read only iSyntax slide with the OpenSlide interface used by DeepZoomGenerator and get_thumbnail"""
+
+    def __init__(self, path: str):
+        self.slide = ISyntax.open(path)
+        self.dimensions = self.slide.dimensions
+        self.level_count = self.slide.level_count
+        self.level_dimensions = self.slide.level_dimensions
+        self.level_downsamples = self.slide.level_downsamples
+        self.mpp_x = self.slide.mpp_x
+        self.mpp_y = self.slide.mpp_y
+        self.properties = {}
+        # the libisyntax cache of the slide is not shared between threads
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_best_level_for_downsample(self, downsample: float) -> int:
+        for level in reversed(range(self.level_count)):
+            if self.level_downsamples[level] <= downsample:
+                return level
+        return 0
+
+    def read_region(self, location: tuple[int, int], level: int, size: tuple[int, int]) -> Image.Image:
+        # OpenSlide locations are in the level 0 reference frame, iSyntax ones in the level frame
+        downsample = self.level_downsamples[level]
+        with self.lock:
+            pixels = self.slide.read_region(location[0] // downsample, location[1] // downsample,
+                                            size[0], size[1], level)
+        return Image.fromarray(pixels, 'RGBA')
+
+    def get_thumbnail(self, size: tuple[int, int]) -> Image.Image:
+        downsample = max(dimension / max_size for dimension, max_size in zip(self.dimensions, size))
+        level = self.get_best_level_for_downsample(downsample)
+        thumbnail = self.read_region((0, 0), level, self.level_dimensions[level]).convert('RGB')
+        thumbnail.thumbnail(size, Image.Resampling.LANCZOS)
+        return thumbnail
+
+    def close(self) -> None:
+        self.slide.close()
+
+
+def open_slide(path: str, probe: WsiProbe) -> OpenSlide | ISyntaxSlide:
+    """Opens a slide (a single file, extracted from its container) with the reader of its format"""
+    return ISyntaxSlide(path) if probe.format == 'isyntax' else OpenSlide(path)
+
+
+class SlideHandle:
+    """
+    Slide of a stored WSI opened once and shared by the threads of the worker process, see open_slide_handle.
+    Zipped WSI are opened from the extraction cache, locked while the handle is open.
+    """
+
+    def __init__(self, wsi_id: str, probe: WsiProbe):
+        self.wsi_id = wsi_id
+        self.probe = probe
+        # number of open_slide_handle using the handle, guarded by the pool lock
+        self.references = 0
+        self.last_used = time.monotonic()
+        # dropped from the pool while in use, closed by its last user
+        self.evicted = False
+        self.stack = ExitStack()
+        try:
+            path = self.stack.enter_context(open_stored_slide(wsi_id, probe))
+            self.slide = self.stack.enter_context(open_slide(path, probe))
+        except BaseException:
+            self.stack.close()
+            raise
+
+    @cached_property
+    def deepzoom(self) -> DeepZoomGenerator:
+        return DeepZoomGenerator(self.slide, settings.DEEPZOOM_TILE_SIZE, settings.DEEPZOOM_OVERLAP,
+                                 limit_bounds=True)
+
+    def close(self) -> None:
+        self.stack.close()
+
+
+__handles_lock = threading.Lock()
+# wsi_id -> open SlideHandle, least recently used first
+__handles: OrderedDict[str, SlideHandle] = OrderedDict()
+# one lock per wsi_id being opened, so a slide is opened once by concurrent requests
+__opening_locks: dict[str, threading.Lock] = {}
+__reaper: threading.Thread | None = None
+
+
+def __pop_closable_handles(now: float) -> list[SlideHandle]:
+    """
+    Removes from the pool the unused handles idle for more than SLIDE_POOL_IDLE_TIMEOUT and the least
+    recently used unused ones while more than SLIDE_POOL_SIZE are open, called with the pool lock held
+    """
+    excess = len(__handles) - settings.SLIDE_POOL_SIZE
+    closable = []
+    for handle in list(__handles.values()):
+        if handle.references == 0 and (excess > 0 or now - handle.last_used > settings.SLIDE_POOL_IDLE_TIMEOUT):
+            del __handles[handle.wsi_id]
+            closable.append(handle)
+            excess -= 1
+    return closable
+
+
+def close_idle_slide_handles() -> None:
+    """Closes the unused handles idle for more than SLIDE_POOL_IDLE_TIMEOUT"""
+    with __handles_lock:
+        closable = __pop_closable_handles(time.monotonic())
+    for handle in closable:
+        handle.close()
+
+
+def __reap_idle_handles() -> None:
+    # idle handles are closed even if the worker gets no more request
+    while True:
+        time.sleep(max(settings.SLIDE_POOL_IDLE_TIMEOUT / 2, 1))
+        close_idle_slide_handles()
+
+
+def __start_reaper() -> None:
+    global __reaper
+    if __reaper is None or not __reaper.is_alive():
+        __reaper = threading.Thread(target=__reap_idle_handles, name='slide-pool-reaper', daemon=True)
+        __reaper.start()
+
+
+def __acquire_handle(wsi_id: str, get_probe: Callable[[], WsiProbe]) -> SlideHandle:
+    with __handles_lock:
+        handle = __handles.get(wsi_id)
+        if handle is not None:
+            handle.references += 1
+            __handles.move_to_end(wsi_id)
+            return handle
+        opening_lock = __opening_locks.setdefault(wsi_id, threading.Lock())
+    with opening_lock:
+        with __handles_lock:
+            handle = __handles.get(wsi_id)
+            if handle is not None:
+                handle.references += 1
+                __handles.move_to_end(wsi_id)
+                return handle
+        try:
+            handle = SlideHandle(wsi_id, get_probe())
+        except BaseException:
+            with __handles_lock:
+                __opening_locks.pop(wsi_id, None)
+            raise
+        with __handles_lock:
+            handle.references = 1
+            __handles[wsi_id] = handle
+            __opening_locks.pop(wsi_id, None)
+            closable = __pop_closable_handles(time.monotonic())
+            __start_reaper()
+    for closable_handle in closable:
+        closable_handle.close()
+    return handle
+
+
+def __release_handle(handle: SlideHandle) -> None:
+    with __handles_lock:
+        handle.references -= 1
+        handle.last_used = time.monotonic()
+        if not handle.evicted:
+            __handles.move_to_end(handle.wsi_id)
+        closable = __pop_closable_handles(handle.last_used)
+        if handle.references == 0 and handle.evicted:
+            closable.append(handle)
+    for closable_handle in closable:
+        closable_handle.close()
+
+
+@contextmanager
+def open_slide_handle(wsi_id: str, get_probe: Callable[[], WsiProbe]) -> Iterator[SlideHandle]:
+    """
+    Opens the slide of a stored WSI, or reuses the handle already opened by another request of the worker
+    process. The handle stays open SLIDE_POOL_IDLE_TIMEOUT seconds after its last use, unused handles are
+    closed while more than SLIDE_POOL_SIZE are open.
+
+    Args:
+        wsi_id (str): id of the WSI in the wsi storage
+        get_probe (Callable[[], WsiProbe]): returns the probe result of the WSI, called if it is not open yet
+    """
+    handle = __acquire_handle(wsi_id, get_probe)
+    try:
+        yield handle
+    finally:
+        __release_handle(handle)
+
+
+def close_slide_handle(wsi_id: str) -> None:
+    """Drops the handle of a WSI from the pool, ex : when it is deleted. It is closed once no longer used."""
+    with __handles_lock:
+        handle = __handles.pop(wsi_id, None)
+        if handle is None:
+            return
+        handle.evicted = True
+        closable = handle.references == 0
+    if closable:
+        handle.close()
+
+
+def get_open_slide_handles() -> list[str]:
+    """wsi_id of the handles open in the worker process"""
+    with __handles_lock:
+        return list(__handles)
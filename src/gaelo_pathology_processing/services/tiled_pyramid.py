@@ -0,0 +1,570 @@
+import copy
+import logging
+import math
+import os
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from io import BytesIO
+from struct import unpack, unpack_from
+from typing import Callable, Iterable
+
+import numpy as np
+from openslide import OpenSlide
+from PIL import Image
+from pydicom import Dataset, Sequence, dcmread
+from pydicom.dataset import FileMetaDataset
+from pydicom.encaps import encapsulate
+from pydicom.uid import PYDICOM_IMPLEMENTATION_UID, generate_uid
+from wsidicom import WsiDicom
+from wsidicom.codec import Encoder, JpegSettings, Subsampling
+
+from gaelo_pathology_processing.services.dicom_transcoder import ITEM_TAG, PIXEL_DATA_HEADER
+from gaelo_pathology_processing.services.tissue_mask import compute_tissue_mask
+
+logger = logging.getLogger(__name__)
+
+VL_WHOLE_SLIDE_MICROSCOPY_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.77.1.6'
+# the pyramid written by OrthancWSIDicomizer with --levels=6 --smooth=1 --max-size=10
+TILE_SIZE = 512
+LEVELS = 6
+# maximum size in bytes of the frames of an instance, larger levels are split in a concatenation
+MAX_INSTANCE_SIZE = 10 * 1024 * 1024
+# seconds between two progress logs
+PROGRESS_LOG_INTERVAL = 10
+BACKGROUND = 255
+# tiles of a row halved at once when building the lower levels
+DOWNSAMPLE_BATCH = 8
+# bytes of the start of a DICOM file searched for its Pixel Data element
+HEADER_SEARCH_SIZE = 1024 * 1024
+PILLOW_SUBSAMPLINGS = {Subsampling.R444: '4:4:4', Subsampling.R422: '4:2:2', Subsampling.R420: '4:2:0'}
+
+
+def count_pyramid_tiles(width: int, height: int) -> int:
+    """Number of tiles of the pyramid written for a slide of width x height pixels"""
+    return sum(level.columns * level.rows for level in create_levels(width, height, LEVELS))
+
+
+@dataclass
+class PyramidLevel:
+    """Size of a level of the pyramid, in pixels and in tiles"""
+
+    index: int
+    width: int
+    height: int
+    # tiles per row and rows of tiles
+    columns: int
+    rows: int
+
+
+def create_levels(width: int, height: int, levels: int, tile_size: int = TILE_SIZE,
+                  first_index: int = 0) -> list[PyramidLevel]:
+    """Sizes of a level of width x height pixels and of the levels - 1 levels below it, each halving the previous"""
+    pyramid = []
+    for index in range(first_index, first_index + levels):
+        pyramid.append(PyramidLevel(index, width, height, math.ceil(width / tile_size), math.ceil(height / tile_size)))
+        width, height = math.ceil(width / 2), math.ceil(height / 2)
+    return pyramid
+
+
+@dataclass
+class PyramidProgress:
+    """Tiles written out of total, with the throughput since the start of the conversion"""
+
+    tiles: int
+    total: int
+    seconds: float
+
+    @property
+    def tiles_per_second(self) -> float:
+        return self.tiles / self.seconds if self.seconds else 0
+
+
+class WrittenFramesCounter:
+    """
+    Counts the frames written in the DICOM files of a folder while they are being written, each count only reads
+    the item headers added to the files since the previous count.
+    """
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        # position of the next item header and frames counted of each file, None until its pixel data is found
+        self.files: dict[str, tuple[int | None, int]] = {}
+
+    def count(self) -> int:
+        for name in os.listdir(self.output_path):
+            if name.endswith('.dcm'):
+                position, frames = self.files.get(name, (None, 0))
+                self.files[name] = self.__count_frames(os.path.join(self.output_path, name), position, frames)
+        return sum(frames for _, frames in self.files.values())
+
+    @staticmethod
+    def __count_frames(path: str, position: int | None, frames: int) -> tuple[int | None, int]:
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if position is None:
+                # the pixel data starts with the Basic Offset Table item, skipped
+                head = file.read(HEADER_SEARCH_SIZE)
+                start = head.find(PIXEL_DATA_HEADER + ITEM_TAG)
+                if start < 0 or start + len(PIXEL_DATA_HEADER) + 8 > len(head):
+                    return None, 0
+                start += len(PIXEL_DATA_HEADER)
+                position = start + 8 + unpack_from('<I', head, start + 4)[0]
+            # an item is counted once its header is written, the sequence delimiter ends the frames
+            while position + 8 <= size:
+                file.seek(position)
+                header = file.read(8)
+                if header[:4] != ITEM_TAG:
+                    break
+                frames += 1
+                position += 8 + unpack('<I', header[4:])[0]
+        return position, frames
+
+
+class LevelSynthesizer:
+    """
+    Builds the levels below a source level in a single streaming pass over its rows of tiles. Each row is halved
+    with a 2x2 box filter in the strip of the next level, which is written once two rows are downsampled in it
+    (or after the last row) and halved in turn : the source level is decoded once, whatever the number of
+    levels built, and only one strip of tiles of each level is in memory.
+    """
+
+    def __init__(self, width: int, height: int, levels: int, write_row: Callable[[int, np.ndarray], None],
+                 tile_size: int = TILE_SIZE, executor: Executor | None = None):
+        """
+        Args:
+            width, height (int): size in pixels of the source level
+            levels (int): number of levels built below the source level
+            write_row (Callable[[int, np.ndarray], None]): called with the index of the built level (1 for the
+                level below the source) and its next row of tiles, whose pixels are reused once it returns
+            tile_size (int): size of the tiles of the source and built levels
+            executor (Executor, optional): threads downsampling batches of tiles of a row in parallel
+        """
+        self.levels = create_levels(width, height, levels + 1, tile_size)
+        self.write_row = write_row
+        self.tile_size = tile_size
+        self.executor = executor
+        self.added_rows = [0] * len(self.levels)
+        self.strips = [None] + [np.full((tile_size, level.columns * tile_size, 3), BACKGROUND, np.uint8)
+                                for level in self.levels[1:]]
+
+    def add_row(self, pixels: np.ndarray) -> None:
+        """Adds the next row of tiles of the source level, a tile_size x columns * tile_size RGB array"""
+        self.__add_row(0, pixels)
+
+    def __add_row(self, index: int, pixels: np.ndarray) -> None:
+        self.added_rows[index] += 1
+        if index + 1 == len(self.levels):
+            return
+        strip = self.strips[index + 1]
+        half = self.tile_size // 2
+        # half of the strip of the next level filled by this row
+        top = (self.added_rows[index] - 1) % 2 * half
+        self.__downsample(pixels, strip[top:top + half])
+
+        # the next level row is complete once two rows are downsampled in it, or after the last row
+        if self.added_rows[index] % 2 == 0 or self.added_rows[index] == self.levels[index].rows:
+            self.write_row(index + 1, strip)
+            self.__add_row(index + 1, strip)
+            strip.fill(BACKGROUND)
+
+    def __downsample(self, pixels: np.ndarray, target: np.ndarray) -> None:
+        """Halves a row of tiles in target, by batches of DOWNSAMPLE_BATCH tiles to bound the temporary arrays"""
+        width = DOWNSAMPLE_BATCH * self.tile_size
+
+        def downsample(start: int) -> None:
+            batch = pixels[:, start:start + width].astype(np.uint16)
+            target[:, start // 2:(start + batch.shape[1]) // 2] = \
+                ((batch[0::2, 0::2] + batch[1::2, 0::2] + batch[0::2, 1::2] + batch[1::2, 1::2] + 2) >> 2) \
+                .astype(np.uint8)
+
+        starts = range(0, pixels.shape[1], width)
+        if self.executor is not None:
+            list(self.executor.map(downsample, starts))
+        else:
+            for start in starts:
+                downsample(start)
+
+
+class LevelWriter:
+    """
+    Writes the frames of a level, added one row of tiles at a time, in TILED_FULL instances (TILED_SPARSE
+    when only some tiles of the rows are written) : a concatenation of instances of at most MAX_INSTANCE_SIZE
+    bytes of frames for the large levels.
+    """
+
+    def __init__(self, level: PyramidLevel, create_dataset: Callable[[PyramidLevel], Dataset], output_path: str,
+                 sparse: bool = False):
+        """
+        Args:
+            level (PyramidLevel): written level, its instances are named level-{index}-{instance}.dcm
+            create_dataset (Callable[[PyramidLevel], Dataset]): attributes of a new instance of the level
+            output_path (str): folder of the instances
+            sparse (bool): if the rows are written with the columns of their frames, the position of each
+                frame is written in its functional groups
+        """
+        self.level = level
+        self.create_dataset = create_dataset
+        self.output_path = output_path
+        self.sparse = sparse
+        self.written_rows = 0
+        # encoded frames not written in an instance yet, with their column and row if sparse
+        self.frames = []
+        self.positions = []
+        self.frames_size = 0
+        # frames written in the previous instances of the level
+        self.frame_offset = 0
+        self.instances = 0
+        self.concatenation_uid = None
+        self.concatenation_source_uid = None
+
+    def write_row(self, frames: Iterable[bytes], columns: Iterable[int] | None = None) -> None:
+        """
+        Adds the frames of the next row of tiles (of the given columns if sparse), the last instance is written
+        after the last row
+        """
+        if columns is None:
+            columns = range(self.level.columns)
+        for frame, column in zip(frames, columns):
+            if self.frames and self.frames_size + len(frame) > MAX_INSTANCE_SIZE:
+                self.__write_instance(last=False)
+            self.frames.append(frame)
+            self.positions.append((column, self.written_rows))
+            self.frames_size += len(frame)
+        self.written_rows += 1
+        if self.written_rows == self.level.rows:
+            self.__write_instance(last=True)
+
+    def __write_instance(self, last: bool) -> None:
+        dataset = self.create_dataset(self.level)
+        # a level written in several instances is a concatenation
+        if self.instances > 0 or not last:
+            if self.concatenation_uid is None:
+                self.concatenation_uid = generate_uid()
+                self.concatenation_source_uid = generate_uid()
+            dataset.ConcatenationUID = self.concatenation_uid
+            dataset.SOPInstanceUIDOfConcatenationSource = self.concatenation_source_uid
+            dataset.InConcatenationNumber = self.instances + 1
+            dataset.ConcatenationFrameOffsetNumber = self.frame_offset
+        if self.sparse:
+            dataset.DimensionOrganizationType = 'TILED_SPARSE'
+            dataset.PerFrameFunctionalGroupsSequence = self.__create_plane_positions(dataset)
+        dataset.NumberOfFrames = len(self.frames)
+        dataset.PixelData = encapsulate(self.frames)
+        dataset['PixelData'].VR = 'OB'
+        dataset.save_as(os.path.join(self.output_path, f'level-{self.level.index}-{self.instances}.dcm'),
+                        enforce_file_format=True)
+        self.frame_offset += len(self.frames)
+        self.instances += 1
+        self.frames = []
+        self.positions = []
+        self.frames_size = 0
+
+    def __create_plane_positions(self, dataset: Dataset) -> Sequence:
+        """Positions of the frames in the total pixel matrix and on the slide (in mm, 0 without pixel spacing)"""
+        spacing = (0, 0)
+        if 'SharedFunctionalGroupsSequence' in dataset:
+            spacing = dataset.SharedFunctionalGroupsSequence[0].PixelMeasuresSequence[0].PixelSpacing
+        origin = dataset.TotalPixelMatrixOriginSequence[0]
+        groups = []
+        for column, row in self.positions:
+            x, y = column * dataset.Columns, row * dataset.Rows
+            plane_position = Dataset()
+            plane_position.ColumnPositionInTotalImagePixelMatrix = x + 1
+            plane_position.RowPositionInTotalImagePixelMatrix = y + 1
+            plane_position.XOffsetInSlideCoordinateSystem = round(
+                float(origin.XOffsetInSlideCoordinateSystem) + x * float(spacing[1]), 6)
+            plane_position.YOffsetInSlideCoordinateSystem = round(
+                float(origin.YOffsetInSlideCoordinateSystem) + y * float(spacing[0]), 6)
+            plane_position.ZOffsetInSlideCoordinateSystem = 0
+            frame_groups = Dataset()
+            frame_groups.PlanePositionSlideSequence = Sequence([plane_position])
+            groups.append(frame_groups)
+        return Sequence(groups)
+
+
+class TiledPyramidWriter:
+    """
+    Writes a slide read with OpenSlide as a VL Whole Slide Microscopy series, one TILED_FULL instance per
+    level (a concatenation of instances of at most MAX_INSTANCE_SIZE bytes of frames for the large levels).
+
+    The level 0 is read by rows of tiles, the following levels are built from it by a LevelSynthesizer, so
+    LEVELS levels are written whatever the levels of the slide, in a single pass over the slide. The tiles of
+    a row are read, encoded and downsampled by a pool of threads (OpenSlide, Pillow and NumPy release the GIL).
+
+    With sparse, only the tiles of the tissue mask of the slide (and of the lower levels tiles covering them)
+    are read and written, in TILED_SPARSE instances, the background tiles are left to the viewers.
+    """
+
+    def __init__(self, dataset: Dataset, encoding_settings: JpegSettings, workers: int,
+                 progress: Callable[[PyramidProgress], None] | None = None, sparse: bool = False):
+        """
+        Args:
+            dataset (Dataset): patient, study, series and specimen attributes of the instances
+            encoding_settings (JpegSettings): JPEG encoding of the tiles
+            workers (int): threads reading and encoding the tiles
+            progress (Callable, optional): called after each row of tiles, raising in it cancels the conversion
+            sparse (bool): if the background tiles are skipped, see compute_tissue_mask
+        """
+        if not isinstance(encoding_settings, JpegSettings) or encoding_settings.subsampling not in PILLOW_SUBSAMPLINGS:
+            raise ValueError(f"Unsupported tile encoding : {encoding_settings}")
+        self.dataset = dataset
+        self.encoding_settings = encoding_settings
+        self.workers = workers
+        self.progress = progress
+        self.sparse = sparse
+
+    def write(self, image_path: str, output_path: str) -> PyramidProgress:
+        """Writes the instances of the pyramid of the slide in output_path, returns the final progress"""
+        os.makedirs(output_path, exist_ok=True)
+        self.frame_of_reference_uid = generate_uid()
+        self.acquisition_datetime = datetime.now()
+        self.start_time = self.last_log_time = time.perf_counter()
+        with OpenSlide(image_path) as slide, ThreadPoolExecutor(self.workers, thread_name_prefix='pyramid') as executor:
+            self.slide = slide
+            self.executor = executor
+            self.mpp = self.__get_mpp(slide)
+            levels = create_levels(*slide.dimensions, LEVELS)
+            self.writers = [LevelWriter(level, self.__create_dataset, output_path, self.sparse) for level in levels]
+            # tiles written in each level
+            self.masks = self.__create_masks(slide, levels)
+            self.tiles = 0
+            self.total = int(sum(mask.sum() for mask in self.masks))
+            synthesizer = LevelSynthesizer(*slide.dimensions, LEVELS - 1, self.__write_row, executor=executor)
+            pixels = np.empty((TILE_SIZE, levels[0].columns * TILE_SIZE, 3), np.uint8)
+            for row in range(levels[0].rows):
+                # the background tiles are not read but downsampled in the lower levels as background
+                pixels.fill(BACKGROUND)
+                list(executor.map(lambda column, row=row: self.__read_tile(pixels, column, row),
+                                  np.flatnonzero(self.masks[0][row])))
+                self.__write_row(0, pixels)
+                synthesizer.add_row(pixels)
+        progress = self.__get_progress()
+        logger.info('Wrote %d tiles in %.1f s (%.1f tiles/s)', progress.tiles, progress.seconds,
+                    progress.tiles_per_second)
+        return progress
+
+    @staticmethod
+    def __get_mpp(slide: OpenSlide) -> tuple[float, float] | None:
+        try:
+            return float(slide.properties['openslide.mpp-x']), float(slide.properties['openslide.mpp-y'])
+        except (KeyError, ValueError):
+            return None
+
+    def __create_masks(self, slide: OpenSlide, levels: list[PyramidLevel]) -> list[np.ndarray]:
+        """Tiles of each level to write, a tile of a lower level is written if one of the 4 it halves is"""
+        if not self.sparse:
+            return [np.ones((level.rows, level.columns), bool) for level in levels]
+        masks = [compute_tissue_mask(slide, TILE_SIZE)]
+        for level in levels[1:]:
+            previous = np.pad(masks[-1], ((0, 2 * level.rows - masks[-1].shape[0]),
+                                          (0, 2 * level.columns - masks[-1].shape[1])))
+            masks.append(previous.reshape(level.rows, 2, level.columns, 2).any(axis=(1, 3)))
+        return masks
+
+    def __read_tile(self, pixels: np.ndarray, column: int, row: int) -> None:
+        """Reads a tile of level 0 in its place in the pixels of its row"""
+        region = np.asarray(self.slide.read_region((column * TILE_SIZE, row * TILE_SIZE), 0, (TILE_SIZE, TILE_SIZE)))
+        tile = pixels[:, column * TILE_SIZE:(column + 1) * TILE_SIZE]
+        if region[:, :, 3].min() == 255:
+            tile[:] = region[:, :, :3]
+            return
+        # transparent pixels (outside of the scanned regions or of the slide) are blended on the background
+        alpha = region[:, :, 3:].astype(np.uint16)
+        tile[:] = (region[:, :, :3] * alpha + BACKGROUND * (255 - alpha) + 127) // 255
+
+    def __encode(self, tile: np.ndarray) -> bytes:
+        buffer = BytesIO()
+        # the tiles of a row are strided
+        Image.fromarray(np.ascontiguousarray(tile)).save(
+            buffer, 'JPEG', quality=self.encoding_settings.quality,
+            subsampling=PILLOW_SUBSAMPLINGS[self.encoding_settings.subsampling])
+        return buffer.getvalue()
+
+    def __write_row(self, index: int, pixels: np.ndarray) -> None:
+        writer = self.writers[index]
+        columns = np.flatnonzero(self.masks[index][writer.written_rows])
+        writer.write_row(self.executor.map(
+            lambda column: self.__encode(pixels[:, column * TILE_SIZE:(column + 1) * TILE_SIZE]), columns), columns)
+        self.tiles += len(columns)
+        self.__report_progress()
+
+    def __report_progress(self) -> None:
+        progress = self.__get_progress()
+        if self.progress is not None:
+            self.progress(progress)
+        now = time.perf_counter()
+        if now - self.last_log_time >= PROGRESS_LOG_INTERVAL:
+            self.last_log_time = now
+            logger.info('Wrote %d/%d tiles (%.1f tiles/s)', progress.tiles, progress.total,
+                        progress.tiles_per_second)
+
+    def __get_progress(self) -> PyramidProgress:
+        return PyramidProgress(self.tiles, self.total, time.perf_counter() - self.start_time)
+
+    def __create_dataset(self, level: PyramidLevel) -> Dataset:
+        dataset = copy.deepcopy(self.dataset)
+        file_meta = FileMetaDataset()
+        file_meta.MediaStorageSOPClassUID = VL_WHOLE_SLIDE_MICROSCOPY_IMAGE_STORAGE
+        file_meta.MediaStorageSOPInstanceUID = generate_uid()
+        file_meta.TransferSyntaxUID = self.encoding_settings.transfer_syntax
+        file_meta.ImplementationClassUID = PYDICOM_IMPLEMENTATION_UID
+        dataset.file_meta = file_meta
+        dataset.SOPClassUID = file_meta.MediaStorageSOPClassUID
+        dataset.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+        dataset.Modality = 'SM'
+        dataset.ImageType = ['ORIGINAL', 'PRIMARY', 'VOLUME', 'NONE'] if level.index == 0 \
+            else ['DERIVED', 'PRIMARY', 'VOLUME', 'RESAMPLED']
+        dataset.InstanceNumber = level.index + 1
+        dataset.FrameOfReferenceUID = self.frame_of_reference_uid
+        dataset.PositionReferenceIndicator = 'SLIDE_CORNER'
+        dataset.AcquisitionDateTime = self.acquisition_datetime.strftime('%Y%m%d%H%M%S')
+        dataset.ContentDate = self.acquisition_datetime.strftime('%Y%m%d')
+        dataset.ContentTime = self.acquisition_datetime.strftime('%H%M%S')
+        dataset.VolumetricProperties = 'VOLUME'
+        dataset.BurnedInAnnotation = 'NO'
+        dataset.SpecimenLabelInImage = 'NO'
+        dataset.DimensionOrganizationType = 'TILED_FULL'
+        dataset.TotalPixelMatrixColumns = level.width
+        dataset.TotalPixelMatrixRows = level.height
+        dataset.TotalPixelMatrixFocalPlanes = 1
+        dataset.NumberOfOpticalPaths = 1
+        dataset.Rows = TILE_SIZE
+        dataset.Columns = TILE_SIZE
+        dataset.SamplesPerPixel = 3
+        dataset.PhotometricInterpretation = self.encoding_settings.photometric_interpretation
+        dataset.PlanarConfiguration = 0
+        dataset.BitsAllocated = 8
+        dataset.BitsStored = 8
+        dataset.HighBit = 7
+        dataset.PixelRepresentation = 0
+        dataset.LossyImageCompression = '01'
+        dataset.LossyImageCompressionMethod = 'ISO_10918_1'
+
+        origin = Dataset()
+        origin.XOffsetInSlideCoordinateSystem = 0
+        origin.YOffsetInSlideCoordinateSystem = 0
+        dataset.TotalPixelMatrixOriginSequence = Sequence([origin])
+        optical_path = Dataset()
+        optical_path.OpticalPathIdentifier = '0'
+        optical_path.IlluminationTypeCodeSequence = Sequence([
+            self.__create_code('111744', 'DCM', 'Brightfield illumination')])
+        optical_path.IlluminationColorCodeSequence = Sequence([
+            self.__create_code('414298005', 'SCT', 'Full Spectrum')])
+        dataset.OpticalPathSequence = Sequence([optical_path])
+
+        if self.mpp is not None:
+            # pixel spacing in mm, row spacing first
+            downsample = 2 ** level.index
+            spacing = [self.mpp[1] * downsample / 1000, self.mpp[0] * downsample / 1000]
+            pixel_measures = Dataset()
+            pixel_measures.PixelSpacing = [round(value, 10) for value in spacing]
+            pixel_measures.SliceThickness = 0
+            shared_groups = Dataset()
+            shared_groups.PixelMeasuresSequence = Sequence([pixel_measures])
+            dataset.SharedFunctionalGroupsSequence = Sequence([shared_groups])
+            dataset.ImagedVolumeWidth = round(level.width * spacing[1], 10)
+            dataset.ImagedVolumeHeight = round(level.height * spacing[0], 10)
+            dataset.ImagedVolumeDepth = 0
+        return dataset
+
+    @staticmethod
+    def __create_code(value: str, scheme: str, meaning: str) -> Dataset:
+        code = Dataset()
+        code.CodeValue = value
+        code.CodingSchemeDesignator = scheme
+        code.CodeMeaning = meaning
+        return code
+
+
+class MissingLevelsWriter:
+    """
+    Writes the levels missing from the pyramid of a slide whose present levels are already written, in the
+    series of the present levels. The missing levels below a present level are built from it by a
+    LevelSynthesizer, in one pass over its tiles (instead of decoding the level above each missing level).
+    """
+
+    def __init__(self, wsi: WsiDicom, encoder: Encoder, workers: int):
+        """
+        Args:
+            wsi (WsiDicom): slide whose present levels are read
+            encoder (Encoder): encoder of the tiles of the missing levels
+            workers (int): threads reading, downsampling and encoding the tiles
+        """
+        self.wsi = wsi
+        self.encoder = encoder
+        self.workers = workers
+
+    def write(self, output_path: str, highest_level: int) -> None:
+        """
+        Writes the levels missing up to the pyramid level highest_level in output_path, next to the instances
+        of the present levels, whose attributes are used for the instances of the levels built from them
+        """
+        present_levels = self.wsi.levels.pyramid_indices
+        templates = {}
+        for file in os.listdir(output_path):
+            dataset = dcmread(os.path.join(output_path, file), stop_before_pixels=True)
+            templates[(dataset.TotalPixelMatrixColumns, dataset.TotalPixelMatrixRows)] = dataset
+        self.instance_number = max(int(dataset.get('InstanceNumber', 0)) for dataset in templates.values())
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='levels') as executor:
+            self.executor = executor
+            for source_index in present_levels:
+                missing = 0
+                while source_index + missing + 1 <= highest_level and \
+                        source_index + missing + 1 not in present_levels:
+                    missing += 1
+                if missing > 0:
+                    source = self.wsi.levels.get(source_index)
+                    template = templates[(source.size.width, source.size.height)]
+                    self.__write_levels(source_index, missing, template, output_path)
+
+    def __write_levels(self, source_index: int, levels: int, template: Dataset, output_path: str) -> None:
+        source = self.wsi.levels.get(source_index)
+        tile_size = source.tile_size.width
+        pyramid = create_levels(source.size.width, source.size.height, levels + 1, tile_size, source_index)
+        writers = [LevelWriter(level, lambda level: self.__create_dataset(template, level, source_index),
+                               output_path) for level in pyramid[1:]]
+
+        def write_row(index: int, pixels: np.ndarray) -> None:
+            writers[index - 1].write_row(self.executor.map(
+                lambda column: self.encoder.encode(
+                    np.ascontiguousarray(pixels[:, column * tile_size:(column + 1) * tile_size])),
+                range(pyramid[index].columns)))
+
+        synthesizer = LevelSynthesizer(source.size.width, source.size.height, levels, write_row, tile_size,
+                                       self.executor)
+        pixels = np.empty((tile_size, pyramid[0].columns * tile_size, 3), np.uint8)
+        for row in range(pyramid[0].rows):
+            list(self.executor.map(lambda column, row=row: self.__read_tile(pixels, source_index, column, row),
+                                   range(pyramid[0].columns)))
+            synthesizer.add_row(pixels)
+
+    def __read_tile(self, pixels: np.ndarray, level: int, column: int, row: int) -> None:
+        """Reads a tile of the source level in its place in the pixels of its row, the edge tiles are cropped"""
+        tile = np.asarray(self.wsi.read_tile(level, (column, row)).convert('RGB'))
+        tile_size = pixels.shape[0]
+        pixels[:, column * tile_size:(column + 1) * tile_size] = BACKGROUND
+        pixels[:tile.shape[0], column * tile_size:column * tile_size + tile.shape[1]] = tile
+
+    def __create_dataset(self, template: Dataset, level: PyramidLevel, source_index: int) -> Dataset:
+        dataset = copy.deepcopy(template)
+        dataset.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+        dataset.file_meta.TransferSyntaxUID = self.encoder.transfer_syntax
+        dataset.SOPInstanceUID = dataset.file_meta.MediaStorageSOPInstanceUID
+        self.instance_number += 1
+        dataset.InstanceNumber = self.instance_number
+        dataset.ImageType = ['DERIVED', 'PRIMARY', 'VOLUME', 'RESAMPLED']
+        dataset.TotalPixelMatrixColumns = level.width
+        dataset.TotalPixelMatrixRows = level.height
+        dataset.PhotometricInterpretation = self.encoder.photometric_interpretation
+        for keyword in ('PerFrameFunctionalGroupsSequence', 'ConcatenationUID', 'SOPInstanceUIDOfConcatenationSource',
+                        'InConcatenationNumber', 'ConcatenationFrameOffsetNumber'):
+            if keyword in dataset:
+                delattr(dataset, keyword)
+        if 'SharedFunctionalGroupsSequence' in dataset:
+            pixel_measures = dataset.SharedFunctionalGroupsSequence[0].PixelMeasuresSequence[0]
+            downsample = 2 ** (level.index - source_index)
+            pixel_measures.PixelSpacing = [round(float(value) * downsample, 10)
+                                           for value in pixel_measures.PixelSpacing]
+        return dataset
@@ -0,0 +1,68 @@
+import logging
+import math
+
+import numpy as np
+from openslide import OpenSlide
+
+logger = logging.getLogger(__name__)
+
+# pixels of the thumbnail per tile side, the mask is computed on a slide downsampled to it
+THUMBNAIL_PIXELS_PER_TILE = 8
+# pixels darker than this (mean of the channels) or more saturated (max - min of the channels) are tissue,
+# the glass is bright and grey
+TISSUE_MAX_LUMINANCE = 220
+TISSUE_MIN_SATURATION = 25
+# tiles around the tissue tiles kept, the thumbnail misses the faint borders of the tissue
+MARGIN_TILES = 1
+
+
+def compute_tissue_mask(slide: OpenSlide, tile_size: int) -> np.ndarray:
+    """
+    Tiles of the level 0 of a slide holding tissue, detected on a thumbnail by thresholding the luminance and
+    saturation of its pixels, the isolated pixels (dust, noise) are removed by an opening and the tissue
+    tiles are dilated by MARGIN_TILES.
+
+    Args:
+        slide (OpenSlide): slide, its thumbnail is read from its lowest fitting level
+        tile_size (int): size of the tiles of the level 0
+
+    Returns:
+        np.ndarray: rows x columns booleans, True for the tiles to write (all of them if no tissue is found)
+    """
+    width, height = slide.dimensions
+    columns, rows = math.ceil(width / tile_size), math.ceil(height / tile_size)
+    scale = THUMBNAIL_PIXELS_PER_TILE / tile_size
+    thumbnail = np.asarray(slide.get_thumbnail((max(1, round(width * scale)), max(1, round(height * scale))))
+                           .convert('RGB')).astype(np.int16)
+    tissue = (thumbnail.mean(axis=2) < TISSUE_MAX_LUMINANCE) | \
+        (thumbnail.max(axis=2) - thumbnail.min(axis=2) > TISSUE_MIN_SATURATION)
+    tissue = __dilate(__erode(tissue))
+
+    # tiles overlapped by each pixel of the thumbnail
+    thumbnail_rows, thumbnail_columns = tissue.shape
+    pixel_rows = np.arange(thumbnail_rows) * height // thumbnail_rows // tile_size
+    pixel_columns = np.arange(thumbnail_columns) * width // thumbnail_columns // tile_size
+    mask = np.zeros((rows, columns), bool)
+    np.logical_or.at(mask, (pixel_rows[:, None], pixel_columns[None, :]), tissue)
+    for _ in range(MARGIN_TILES):
+        mask = __dilate(mask)
+
+    if not mask.any():
+        logger.info('No tissue detected, all the tiles are written')
+        return np.ones((rows, columns), bool)
+    logger.info('Tissue detected in %d/%d tiles', mask.sum(), mask.size)
+    return mask
+
+
+def __erode(mask: np.ndarray) -> np.ndarray:
+    """3x3 erosion, the pixels outside of the mask are tissue"""
+    padded = np.pad(mask, 1, constant_values=True)
+    return np.logical_and.reduce([padded[row:row + mask.shape[0], column:column + mask.shape[1]]
+                                  for row in range(3) for column in range(3)])
+
+
+def __dilate(mask: np.ndarray) -> np.ndarray:
+    """3x3 dilation"""
+    padded = np.pad(mask, 1, constant_values=False)
+    return np.logical_or.reduce([padded[row:row + mask.shape[0], column:column + mask.shape[1]]
+                                 for row in range(3) for column in range(3)])
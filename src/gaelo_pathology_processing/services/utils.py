@@ -1,10 +1,11 @@
-import json, zipfile
-from pathlib import Path
+import os, json, zipfile, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable
+import django
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
 from openslide import (OpenSlide)
-from isyntax import ISyntax
-from pydicom import dcmread
-from pydicom.filewriter import dcmwrite
-from pydicom.uid import JPEGLSLossless
+from gaelo_pathology_processing.services.metrics import STAGE_EXTRACTION, measure_stage
 
 
 def body_to_dict(body: str) -> dict:
@@ -12,40 +13,43 @@ def body_to_dict(body: str) -> dict:
     dict = json.loads(body_unicode)
     return dict
 
-def transcode_dicom_to_jpeg_lossless(input_path :str, output_path :str):
-    # Read and return a dataset stored in accordance with the DICOM File Format
-    dataset = dcmread(input_path)
-    # compress in JpegLossless
-    dataset.decompress()
-    dataset.compress(JPEGLSLossless)
-    # write the compressed Dicom File
-    dcmwrite(output_path, dataset, enforce_file_format=False)
-    return output_path
-
-def get_wsi_format(path : Path) ->str|None : 
-    try:
-        format = OpenSlide.detect_format(path)
-        if format is None:
-            #If zip check if it contains a mrxs file
-            if zipfile.is_zipfile(path):
-                with zipfile.ZipFile(path, 'r') as zip_ref:
-                    files = zip_ref.namelist()
-                    for file in files:
-                        if(file.lower().endswith('.mrxs')):
-                            return 'mirax'
-            #else check if is a philips file
-            elif is_isyntax(Path(path)):
-                format = 'isyntax'
-        return format
-    except Exception:
-        return None
-
-def is_isyntax(path: Path) -> bool:
-    try:
-        ISyntax.open(path)
-        return True
-    except Exception:
-        return False
-
-
-
+def create_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Process pool whose processes are spawned (no fork of the web worker threads) with Django set up
+    """
+    return ProcessPoolExecutor(max_workers=max_workers,
+                               mp_context=multiprocessing.get_context('spawn'),
+                               initializer=django.setup)
+
+def run_in_thread(func: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    """
+    Awaitable calling func in a thread of the executor, for the file, storage and CPU work of the async views.
+    sync_to_async would call it in the thread of the request (thread_sensitive) which also runs its database
+    queries and its sync middlewares. The database connections func opens in the executor thread are closed
+    after the call.
+    """
+    def call(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(call, thread_sensitive=False)
+
+def extract_zipped_slide(zip_path: str, folder: str, entry: str | None = None) -> str:
+    """
+    Extracts a zipped WSI (some formats are split in several files) in folder and returns the path of the
+    file to open with OpenSlide : entry (found by the probe) or the first one OpenSlide detects, raises
+    ValueError if there is none
+    """
+    with measure_stage(STAGE_EXTRACTION) as measure, zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        zip_ref.extractall(folder)
+        measure.bytes = sum(info.file_size for info in zip_ref.infolist())
+    if entry is not None:
+        return os.path.join(folder, entry)
+    for f in os.listdir(folder):
+        file_path = os.path.join(folder, f)
+        if os.path.isfile(file_path) and OpenSlide.detect_format(file_path) is not None:
+            return file_path
+    raise ValueError(
+        "No file compatible with OpenSlide found in the zip archive.")
@@ -0,0 +1,153 @@
+import os
+from dataclasses import asdict
+
+from asgiref.sync import sync_to_async
+from openslide import OpenSlide, PROPERTY_NAME_MPP_X, PROPERTY_NAME_MPP_Y, PROPERTY_NAME_VENDOR
+
+from gaelo_pathology_processing.exceptions import GaelONotFoundException
+from gaelo_pathology_processing.models import Wsi
+from gaelo_pathology_processing.services.file_helper import is_file_exists, materialize
+from gaelo_pathology_processing.services.probe import CONTAINER_ZIP, WsiProbe, probe_wsi
+from gaelo_pathology_processing.services.slide_pool import ISyntaxSlide, open_slide, open_slide_handle
+from gaelo_pathology_processing.services.utils import run_in_thread
+
+
+def read_slide_metadata(slide: OpenSlide | ISyntaxSlide) -> dict:
+    """Reads the fields of the WSI index from an opened slide"""
+    if isinstance(slide, ISyntaxSlide):
+        return {
+            'vendor': 'philips',
+            'width': slide.dimensions[0],
+            'height': slide.dimensions[1],
+            'level_count': slide.level_count,
+            'level_downsamples': list(slide.level_downsamples),
+            'mpp_x': slide.mpp_x,
+            'mpp_y': slide.mpp_y,
+            'properties': {},
+        }
+
+    properties = dict(slide.properties)
+    return {
+        'vendor': properties.get(PROPERTY_NAME_VENDOR),
+        'width': slide.dimensions[0],
+        'height': slide.dimensions[1],
+        'level_count': slide.level_count,
+        'level_downsamples': list(slide.level_downsamples),
+        'mpp_x': float(properties[PROPERTY_NAME_MPP_X]) if PROPERTY_NAME_MPP_X in properties else None,
+        'mpp_y': float(properties[PROPERTY_NAME_MPP_Y]) if PROPERTY_NAME_MPP_Y in properties else None,
+        'properties': properties,
+    }
+
+
+def read_wsi_metadata(path: str, probe: WsiProbe) -> dict:
+    """Opens the slide (a single file, extracted from its container) and reads the fields of the WSI index"""
+    with open_slide(path, probe) as slide:
+        return read_slide_metadata(slide)
+
+
+def read_wsi_index(path: str, probe: WsiProbe) -> dict:
+    """
+    Reads the fields of the WSI index of a local WSI file, saved by save_wsi_index
+
+    The metadata of zipped WSI are read on the first get_wsi_metadata, from the extraction cache, so that
+    the upload does not wait for the extraction.
+    """
+    metadata = read_wsi_metadata(path, probe) if probe.container != CONTAINER_ZIP else {}
+    return {**asdict(probe), 'file_size': os.path.getsize(path), **metadata}
+
+
+def save_wsi_index(wsi_id: str, fields: dict) -> Wsi:
+    """Stores the fields read by read_wsi_index in the index"""
+    wsi, created = Wsi.objects.update_or_create(id=wsi_id, defaults=fields)
+    return wsi
+
+
+def index_wsi(wsi_id: str, path: str, probe: WsiProbe | None = None) -> Wsi:
+    """
+    Reads the metadata of a WSI file and stores them in the index with its probe result
+
+    Args:
+        wsi_id (str): id of the WSI in the wsi storage
+        path (str): local path of the WSI file
+        probe (WsiProbe, optional): probe result of the file, probed if None
+    """
+    if probe is None:
+        probe = probe_wsi(path)
+        if probe is None:
+            raise ValueError('Invalid file or unsupported format')
+    return save_wsi_index(wsi_id, read_wsi_index(path, probe))
+
+
+def get_wsi_probe(wsi: Wsi) -> WsiProbe:
+    """Probe result stored in the index at upload"""
+    return WsiProbe(wsi.format, wsi.container, wsi.entry, wsi.backend)
+
+
+def __read_stored_wsi_index(wsi_id: str) -> dict:
+    """Reads the index fields of a WSI stored before the index, raises GaelONotFoundException if it doesn't exist"""
+    if not is_file_exists('wsi', wsi_id):
+        raise GaelONotFoundException(f"WSI file with ID '{wsi_id}' does not exist.")
+    with materialize('wsi', wsi_id) as wsi_path:
+        probe = probe_wsi(wsi_path)
+        if probe is None:
+            raise ValueError('Invalid file or unsupported format')
+        return read_wsi_index(wsi_path, probe)
+
+
+def get_wsi_index(wsi_id: str) -> Wsi:
+    """
+    Returns the indexed metadata of a stored WSI, a WSI stored before the index is indexed on its first
+    lookup. Raises GaelONotFoundException if the WSI does not exist
+    """
+    try:
+        return Wsi.objects.get(id=wsi_id)
+    except Wsi.DoesNotExist:
+        return save_wsi_index(wsi_id, __read_stored_wsi_index(wsi_id))
+
+
+async def aget_wsi_index(wsi_id: str) -> Wsi:
+    """get_wsi_index for the async views, the WSI stored before the index is read in a thread of the executor"""
+    try:
+        return await Wsi.objects.aget(id=wsi_id)
+    except Wsi.DoesNotExist:
+        index_fields = await run_in_thread(__read_stored_wsi_index)(wsi_id)
+    return await sync_to_async(save_wsi_index)(wsi_id, index_fields)
+
+
+def __read_opened_slide_metadata(wsi: Wsi) -> dict:
+    # opened in the slide pool, kept open for the preview requests which usually follow
+    with open_slide_handle(wsi.id, lambda: get_wsi_probe(wsi)) as handle:
+        return read_slide_metadata(handle.slide)
+
+
+async def get_wsi_metadata(wsi_id: str) -> Wsi:
+    """
+    Returns the indexed metadata of a stored WSI, reading the ones deferred at upload (zipped WSI) in a thread
+    of the executor
+    """
+    wsi = await aget_wsi_index(wsi_id)
+    if wsi.container == CONTAINER_ZIP and wsi.width is None:
+        metadata = await run_in_thread(__read_opened_slide_metadata)(wsi)
+        for field, value in metadata.items():
+            setattr(wsi, field, value)
+        await wsi.asave()
+    return wsi
+
+
+def delete_wsi_index(wsi_id: str) -> None:
+    Wsi.objects.filter(id=wsi_id).delete()
+
+
+def serialize_wsi_metadata(wsi: Wsi) -> dict:
+    """Raw properties of the slide (as returned by OpenSlide) with the indexed fields as gaelo.* keys"""
+    return wsi.properties | {
+        'gaelo.format': wsi.format,
+        'gaelo.vendor': wsi.vendor,
+        'gaelo.width': wsi.width,
+        'gaelo.height': wsi.height,
+        'gaelo.level_count': wsi.level_count,
+        'gaelo.level_downsamples': wsi.level_downsamples,
+        'gaelo.mpp_x': wsi.mpp_x,
+        'gaelo.mpp_y': wsi.mpp_y,
+        'gaelo.file_size': wsi.file_size,
+    }
@@ -0,0 +1,236 @@
+import base64
+import binascii
+import hashlib
+import os
+import re
+from datetime import timedelta
+from typing import BinaryIO
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from gaelo_pathology_processing.exceptions import (
+    GaelOBadRequestException, GaelOConflictException, GaelONotFoundException)
+from gaelo_pathology_processing.models import UploadChunk, UploadSession
+from gaelo_pathology_processing.services.deepzoom import close_opened_slide
+from gaelo_pathology_processing.services.extraction_cache import delete_extracted_slide, warm_extraction_cache
+from gaelo_pathology_processing.services.file_helper import (
+    delete_file, get_hash, get_path, is_file_exists, move_to_storage)
+from gaelo_pathology_processing.services.metrics import STAGE_STORE, STAGE_UPLOAD, measure_stage
+from gaelo_pathology_processing.services.probe import WsiProbe, probe_wsi
+from gaelo_pathology_processing.services.utils import run_in_thread
+from gaelo_pathology_processing.services.wsi_index import delete_wsi_index, read_wsi_index, save_wsi_index
+
+CONTENT_RANGE_PATTERN = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+MD5_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def __store_wsi(path: str, file_hash: str) -> tuple[WsiProbe, dict] | None:
+    """Probe result and index fields of an uploaded WSI once moved in the wsi storage, None if it is not a WSI"""
+    # format detected once, the probe result is stored with the WSI index
+    probe = probe_wsi(path)
+    if probe is None:
+        return None
+    # metadata read once while the file is local, the metadata endpoint and conversions use the index
+    index_fields = read_wsi_index(path, probe)
+    with measure_stage(STAGE_STORE) as measure:
+        move_to_storage('wsi', path, file_hash)
+        measure.bytes = os.path.getsize(path)
+    return probe, index_fields
+
+
+async def register_wsi(path: str, file_hash: str) -> WsiProbe | None:
+    """
+    Detects the format of an uploaded WSI, moves it in the wsi storage as file_hash and indexes its metadata,
+    returns None without storing it if it is not a supported WSI. The file is read and moved in a thread of
+    the executor.
+    """
+    stored = await run_in_thread(__store_wsi)(path, file_hash)
+    if stored is None:
+        return None
+    probe, index_fields = stored
+    # indexed once stored, a failed move leaves no index of a missing file
+    await sync_to_async(save_wsi_index)(file_hash, index_fields)
+    # zipped WSI are extracted for the next conversions and metadata requests
+    warm_extraction_cache(file_hash, probe)
+    return probe
+
+
+def __delete_stored_wsi(wsi_id: str) -> None:
+    if not is_file_exists('wsi', wsi_id):
+        raise GaelONotFoundException("File doesn't exist")
+    delete_file('wsi', wsi_id)
+    close_opened_slide(wsi_id)
+    delete_extracted_slide(wsi_id)
+
+
+async def delete_wsi(wsi_id: str) -> None:
+    """Deletes a stored WSI with its index, its open slide handle and its extraction"""
+    await run_in_thread(__delete_stored_wsi)(wsi_id)
+    await sync_to_async(delete_wsi_index)(wsi_id)
+
+
+def __get_upload_path(session: UploadSession) -> str:
+    return get_path('uploads', str(session.id))
+
+
+def __allocate_upload_file(path: str, size: int) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        try:
+            # reserves the blocks so the upload does not fail on a full disk once half done
+            if size:
+                os.posix_fallocate(file.fileno(), 0, size)
+        except OSError:
+            pass
+        file.truncate(size)
+
+
+async def create_upload_session(size: int, md5: str | None = None) -> UploadSession:
+    """
+    Creates a chunked upload of a file of size bytes, preallocated in the uploads storage so chunks can be
+    written at their offset in any order. Sessions older than UPLOAD_SESSION_MAX_AGE are deleted.
+
+    Args:
+        size (int): size in bytes of the whole file
+        md5 (str, optional): MD5 of the whole file, the finalization fails if the assembled file differs
+    """
+    if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        raise GaelOBadRequestException("size must be a positive integer.")
+    if md5 is not None and (not isinstance(md5, str) or not MD5_PATTERN.match(md5.lower())):
+        raise GaelOBadRequestException("md5 must be an hexadecimal MD5.")
+
+    expired = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_MAX_AGE)
+    async for expired_session in UploadSession.objects.filter(created_at__lt=expired,
+                                                              status=UploadSession.UPLOADING):
+        await delete_upload_session(expired_session)
+
+    session = await UploadSession.objects.acreate(size=size, md5=md5.lower() if md5 else None)
+    await run_in_thread(__allocate_upload_file)(__get_upload_path(session), size)
+    return session
+
+
+def parse_content_range(content_range: str | None, size: int) -> tuple[int, int]:
+    """Parses the 'bytes start-end/size' Content-Range of a chunk into its range [start, end)"""
+    match = CONTENT_RANGE_PATTERN.match((content_range or '').strip())
+    if match is None:
+        raise GaelOBadRequestException("A Content-Range header 'bytes start-end/size' is required.")
+    start, end, total_size = int(match[1]), int(match[2]) + 1, int(match[3])
+    if total_size != size or start >= end or end > size:
+        raise GaelOBadRequestException(f"Invalid chunk range for a file of {size} bytes.")
+    return start, end
+
+
+def __write_chunk(path: str, stream: BinaryIO | None, start: int, end: int, content_md5: str | None) -> str:
+    """Writes the chunk read from stream in the file at path, returns its MD5"""
+    hash = hashlib.md5()
+    position = start
+    with measure_stage(STAGE_UPLOAD) as measure, open(path, 'r+b') as file:
+        if stream is not None:
+            while position < end:
+                chunk = stream.read(min(settings.UPLOAD_CHUNK_SIZE, end - position))
+                if not chunk:
+                    break
+                hash.update(chunk)
+                # positional writes, parallel chunks don't share a file offset
+                os.pwrite(file.fileno(), chunk, position)
+                position += len(chunk)
+        measure.bytes = position - start
+    if position != end or (stream is not None and stream.read(1)):
+        raise GaelOBadRequestException("The body size does not match the Content-Range.")
+    if content_md5 is not None:
+        try:
+            expected_md5 = base64.b64decode(content_md5, validate=True)
+        except binascii.Error:
+            raise GaelOBadRequestException("Invalid Content-MD5 header.")
+        if expected_md5 != hash.digest():
+            raise GaelOBadRequestException("The chunk doesn't match its Content-MD5.")
+    return hash.hexdigest()
+
+
+async def write_upload_chunk(session: UploadSession, stream: BinaryIO | None, content_range: str | None,
+                             content_md5: str | None = None) -> UploadChunk:
+    """
+    Writes a chunk of the file at its offset, chunks can be sent in any order, in parallel and sent again
+    after a failure. The chunk is hashed as it is written, in a thread of the executor.
+
+    Args:
+        session (UploadSession): the upload session
+        stream (BinaryIO | None): body of the request, the chunk content
+        content_range (str | None): Content-Range header of the chunk
+        content_md5 (str, optional): Content-MD5 header (base64 MD5 of the chunk), checked if present
+    """
+    if session.status != UploadSession.UPLOADING:
+        raise GaelOConflictException("The upload is being finalized.")
+    start, end = parse_content_range(content_range, session.size)
+    md5 = await run_in_thread(__write_chunk)(__get_upload_path(session), stream, start, end, content_md5)
+    return await UploadChunk.objects.acreate(session=session, start=start, end=end, md5=md5)
+
+
+def get_missing_ranges(session: UploadSession) -> list[list[int]]:
+    """Ranges [start, end) of the file not received yet"""
+    missing = []
+    position = 0
+    for start, end in session.chunks.order_by('start').values_list('start', 'end'):
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < session.size:
+        missing.append([position, session.size])
+    return missing
+
+
+def serialize_upload_session(session: UploadSession) -> dict:
+    missing = get_missing_ranges(session)
+    return {
+        'id': str(session.id),
+        'status': session.status,
+        'size': session.size,
+        'received': session.size - sum(end - start for start, end in missing),
+        'missing': missing,
+    }
+
+
+async def finalize_upload_session(session: UploadSession) -> str:
+    """
+    Checks the file is complete and matches the announced MD5, then registers it as a WSI (format
+    detection, index, move to the wsi storage) and deletes the session. The file is hashed in a thread of
+    the executor.
+
+    Returns:
+        str: id of the WSI, the MD5 of the file
+    """
+    if not await UploadSession.objects.filter(id=session.id, status=UploadSession.UPLOADING).aupdate(
+            status=UploadSession.FINALIZING):
+        raise GaelOConflictException("The upload is already being finalized.")
+    try:
+        missing = await sync_to_async(get_missing_ranges)(session)
+        if missing:
+            raise GaelOConflictException(f"The upload is incomplete, missing ranges : {missing}")
+        path = __get_upload_path(session)
+        file_hash = await run_in_thread(get_hash)(path)
+        if session.md5 is not None and session.md5 != file_hash:
+            raise GaelOBadRequestException(
+                f"The uploaded file MD5 {file_hash} doesn't match the expected {session.md5}.")
+    except BaseException:
+        # chunks can be sent again
+        await UploadSession.objects.filter(id=session.id).aupdate(status=UploadSession.UPLOADING)
+        raise
+
+    try:
+        if await register_wsi(path, file_hash) is None:
+            raise GaelOBadRequestException('Invalid file or unsupported format')
+    finally:
+        await delete_upload_session(session)
+    return file_hash
+
+
+def __delete_upload_file(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+
+async def delete_upload_session(session: UploadSession) -> None:
+    await run_in_thread(__delete_upload_file)(__get_upload_path(session))
+    await session.adelete()
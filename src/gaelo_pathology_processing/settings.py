@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 from environ import Env
 from pydicom.config import Settings, IGNORE
@@ -69,6 +71,10 @@ LOGGING = {
             "level": "INFO",
             "propagate": False,
         },
+        "gaelo_pathology_processing": {
+            "handlers": ["console"],
+            "level": "INFO",
+        },
     },
 }
 
@@ -80,6 +86,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'gaelo_pathology_processing',
 ]
 
 MIDDLEWARE = [
@@ -112,8 +119,10 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'gaelo_pathology_processing.wsgi.application'
+ASGI_APPLICATION = 'gaelo_pathology_processing.asgi.application'
 DATA_UPLOAD_MAX_MEMORY_SIZE = None
-FILE_UPLOAD_MAX_MEMORY_SIZE = float('inf')
+# Request bodies larger than this are spooled to disk, the ASGI handler reads the whole body before the view
+FILE_UPLOAD_MAX_MEMORY_SIZE = env('FILE_UPLOAD_MAX_MEMORY_SIZE', int, 2621440)
 
 
 # Database
@@ -123,6 +132,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # the conversion worker processes write in the database concurrently
+            'timeout': 20,
+        },
     }
 }
 
@@ -168,6 +181,22 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Storage of the wsi and dicoms : 'filesystem' (./storage/) or 's3' to share them between the nodes, in S3_BUCKET
+# of an S3 compatible object storage under the wsi/ and dicoms/ prefixes
+STORAGE_BACKEND = env('STORAGE_BACKEND', str, 'filesystem')
+S3_BUCKET = env('S3_BUCKET', str, '')
+# Empty for AWS S3, ex : http://minio:9000 for MinIO
+S3_ENDPOINT_URL = env('S3_ENDPOINT_URL', str, '')
+S3_REGION = env('S3_REGION', str, '')
+S3_ACCESS_KEY_ID = env('S3_ACCESS_KEY_ID', str, '')
+S3_SECRET_ACCESS_KEY = env('S3_SECRET_ACCESS_KEY', str, '')
+# Size of the parts of the multipart uploads and ranged downloads (5 MiB minimum), and parts transferred in parallel
+S3_MULTIPART_CHUNK_SIZE = env('S3_MULTIPART_CHUNK_SIZE', int, 64 * 1024 * 1024)
+S3_MAX_CONCURRENCY = env('S3_MAX_CONCURRENCY', int, 8)
+# Maximum size in bytes of the local copies of the object storage files opened by path (slides)
+# (0 downloads them in a temporary folder for each use), the least recently used ones are evicted above it
+MATERIALIZATION_CACHE_MAX_SIZE = env('MATERIALIZATION_CACHE_MAX_SIZE', int, 50 * 1024 * 1024 * 1024)
+
 STORAGES = {
     "dicoms": {
         "BACKEND": "django.core.files.storage.FileSystemStorage",
@@ -181,10 +210,42 @@ STORAGES = {
             "location": "./storage/wsi/",
         },
     },
+    "conversion_cache": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {
+            "location": "./storage/conversion_cache/",
+        },
+    },
+    "extraction_cache": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {
+            "location": "./storage/extraction_cache/",
+        },
+    },
+    "uploads": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {
+            "location": "./storage/uploads/",
+        },
+    },
+    "materialization_cache": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {
+            "location": "./storage/materialization_cache/",
+        },
+    },
     "staticfiles": {
         "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
     },
 }
+if STORAGE_BACKEND == 's3':
+    for storage_name in ('dicoms', 'wsi'):
+        STORAGES[storage_name] = {
+            "BACKEND": "gaelo_pathology_processing.services.s3_storage.S3Storage",
+            "OPTIONS": {
+                "location": storage_name,
+            },
+        }
 
 REGISTERED_USERS = env('REGISTERED_USERS', str, '{"GaelO": "GaelO"}')
 
@@ -193,6 +254,71 @@ NOSE_ARGS = ['--nocapture',
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = None
 
+# Size of the chunks read from the request stream when uploading a WSI
+UPLOAD_CHUNK_SIZE = env('UPLOAD_CHUNK_SIZE', int, 8 * 1024 * 1024)
+
+# Delay in seconds after which an unfinished chunked upload is deleted
+UPLOAD_SESSION_MAX_AGE = env('UPLOAD_SESSION_MAX_AGE', int, 24 * 60 * 60)
+
+# Output profile of the conversions not specifying one (see services/output_profile.py)
+DEFAULT_OUTPUT_PROFILE = env('DEFAULT_OUTPUT_PROFILE', str, 'jpegls-transcode')
+# Dicomizer of the slides OpenSlide reads : 'native' (in-process) or 'orthanc' (OrthancWSIDicomizer binary)
+DICOMIZER_BACKEND = env('DICOMIZER_BACKEND', str, 'native')
+# Number of threads reading and encoding the tiles of a slide (all dicomizers), the conversion requests can
+# ask for less or more up to the number of CPUs with dicomizer_workers
+DICOMIZER_WORKERS = env('DICOMIZER_WORKERS', int, os.cpu_count())
+# Number of tiles read and encoded at a time by each wsidicomizer thread (dicomizer_chunk_size of the requests)
+DICOMIZER_CHUNK_SIZE = env('DICOMIZER_CHUNK_SIZE', int, 16)
+# Write only the tiles of the tissue detected on a thumbnail of the slides, in TILED_SPARSE instances (native
+# dicomizer), the conversion requests can change it with sparse_tiling
+SPARSE_TILING = env('SPARSE_TILING', bool, False)
+# Minimum delay in seconds between two updates of the tiles written for a converting slide of a job
+CONVERSION_PROGRESS_INTERVAL = env('CONVERSION_PROGRESS_INTERVAL', float, 2)
+# Number of processes converting the slides of a study in parallel (1 to convert them one after another)
+CONVERSION_SLIDE_WORKERS = env('CONVERSION_SLIDE_WORKERS', int, 1)
+# Number of processes transcoding the DICOM instances in JPEG-LS (1 to transcode them in the request process)
+TRANSCODE_WORKERS = env('TRANSCODE_WORKERS', int, os.cpu_count())
+# Maximum number of instances being transcoded or waiting to be zipped, bounds the memory used
+TRANSCODE_QUEUE_DEPTH = env('TRANSCODE_QUEUE_DEPTH', int, 2 * TRANSCODE_WORKERS)
+# Size up to which the frames of a transcoded instance are kept in memory instead of a temporary file
+TRANSCODE_SPOOL_MAX_SIZE = env('TRANSCODE_SPOOL_MAX_SIZE', int, 64 * 1024 * 1024)
+# Maximum size in bytes of the converted slides kept in the conversion_cache storage (0 disables the cache),
+# the least recently used slides are evicted above it
+CONVERSION_CACHE_MAX_SIZE = env('CONVERSION_CACHE_MAX_SIZE', int, 20 * 1024 * 1024 * 1024)
+# Maximum size in bytes of the zipped WSI (ex: mirax) kept extracted in the extraction_cache storage
+# (0 extracts them in a temporary folder for each use), the least recently used ones are evicted above it
+EXTRACTION_CACHE_MAX_SIZE = env('EXTRACTION_CACHE_MAX_SIZE', int, 50 * 1024 * 1024 * 1024)
+# Number of conversion jobs run in parallel by the conversion worker
+CONVERSION_JOBS_CONCURRENCY = env('CONVERSION_JOBS_CONCURRENCY', int, 2)
+# Delay in seconds between two checks for pending conversion jobs
+CONVERSION_JOBS_POLL_INTERVAL = env('CONVERSION_JOBS_POLL_INTERVAL', float, 2)
+# DeepZoom tiles of the WSI preview : size in pixels, overlap with the neighbour tiles and JPEG quality
+DEEPZOOM_TILE_SIZE = env('DEEPZOOM_TILE_SIZE', int, 254)
+DEEPZOOM_OVERLAP = env('DEEPZOOM_OVERLAP', int, 1)
+DEEPZOOM_JPEG_QUALITY = env('DEEPZOOM_JPEG_QUALITY', int, 75)
+# Maximum size in bytes of the encoded tiles and thumbnails kept in memory by each worker process
+TILE_CACHE_MAX_SIZE = env('TILE_CACHE_MAX_SIZE', int, 256 * 1024 * 1024)
+# Number of unused slide handles kept open by each worker process, for the preview and the metadata
+SLIDE_POOL_SIZE = env('SLIDE_POOL_SIZE', int, 16)
+# Seconds an unused slide handle stays open, its file descriptors and index structures are released after
+SLIDE_POOL_IDLE_TIMEOUT = env('SLIDE_POOL_IDLE_TIMEOUT', int, 300)
+THUMBNAIL_MAX_SIZE = env('THUMBNAIL_MAX_SIZE', int, 2048)
+# DICOMweb root (ex: http://orthanc:8042/dicom-web) or Orthanc URL (ex: http://orthanc:8042) the conversions
+# requested with send_to_sink push their instances to instead of writing a zip, empty to disable
+DICOM_SINK_URL = env('DICOM_SINK_URL', str, '')
+# 'stow-rs' to store with DICOMweb STOW-RS, 'orthanc' with the Orthanc REST API (POST /instances)
+DICOM_SINK_TYPE = env('DICOM_SINK_TYPE', str, 'stow-rs')
+DICOM_SINK_USERNAME = env('DICOM_SINK_USERNAME', str, '')
+DICOM_SINK_PASSWORD = env('DICOM_SINK_PASSWORD', str, '')
+# Number of instances sent in parallel, over as many keep-alive connections
+DICOM_SINK_CONCURRENCY = env('DICOM_SINK_CONCURRENCY', int, 4)
+# Timeout in seconds of the request storing an instance
+DICOM_SINK_TIMEOUT = env('DICOM_SINK_TIMEOUT', float, 60)
+# Number of retries of an instance after a connection error or a 5xx response
+DICOM_SINK_RETRIES = env('DICOM_SINK_RETRIES', int, 2)
+# Folder where each process writes its stage metrics, summed by the /metrics endpoint (emptied at startup)
+METRICS_DIR = env('METRICS_DIR', str, os.path.join(tempfile.gettempdir(), 'gaelo_pathology_metrics'))
+
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
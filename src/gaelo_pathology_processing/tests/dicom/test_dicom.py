@@ -1,11 +1,14 @@
 from django.test import TestCase
 import os, base64
-from gaelo_pathology_processing.services.file_helper import move_to_storage
+from unittest.mock import patch
+from gaelo_pathology_processing.services.download import AsyncFileResponse
+from gaelo_pathology_processing.services.file_helper import move_to_storage, store, delete_file
 class TestDicom(TestCase):
 
     def setUp(self):
         credentials = base64.b64encode(b'GaelO:GaelO')
         self.client.defaults['HTTP_AUTHORIZATION'] = 'Basic ' + credentials.decode('utf-8')
+        self.headers = {'Authorization': 'Basic ' + credentials.decode('utf-8')}
 
     def test_get_zip_dicom(self):
         """Testing the GET request to retrieve a DICOM image as a zip"""
@@ -26,3 +29,68 @@ class TestDicom(TestCase):
         response = self.client.delete('/dicom/'+ 'test_dicom_delete.zip')
         self.assertEqual(response.status_code, 200)
 
+    def test_get_zip_dicom_range(self):
+        content = bytes(range(256)) * 4
+        store('dicoms', 'range_test.zip', content)
+        try:
+            response = self.client.get('/dicom/range_test')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['ETag'], '"range_test"')
+            self.assertEqual(response['Accept-Ranges'], 'bytes')
+            self.assertEqual(b''.join(response.streaming_content), content)
+
+            response = self.client.get('/dicom/range_test', HTTP_RANGE='bytes=10-19')
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+            self.assertEqual(response['Content-Length'], '10')
+            self.assertEqual(b''.join(response.streaming_content), content[10:20])
+
+            # resume from an offset, and suffix range
+            response = self.client.get('/dicom/range_test', HTTP_RANGE='bytes=1000-', HTTP_IF_RANGE='"range_test"')
+            self.assertEqual(b''.join(response.streaming_content), content[1000:])
+            response = self.client.get('/dicom/range_test', HTTP_RANGE='bytes=-4')
+            self.assertEqual(b''.join(response.streaming_content), content[-4:])
+
+            # range of another version of the file
+            response = self.client.get('/dicom/range_test', HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"other"')
+            self.assertEqual(response.status_code, 200)
+
+            response = self.client.get('/dicom/range_test', HTTP_RANGE='bytes=2000-')
+            self.assertEqual(response.status_code, 416)
+            self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+            response = self.client.get('/dicom/range_test', HTTP_IF_NONE_MATCH='"range_test"')
+            self.assertEqual(response.status_code, 304)
+        finally:
+            delete_file('dicoms', 'range_test.zip')
+
+    @patch('gaelo_pathology_processing.services.download.STREAM_BLOCK_SIZE', 100)
+    async def test_get_zip_dicom_asgi(self):
+        content = bytes(range(256)) * 4
+        store('dicoms', 'asgi_test.zip', content)
+        try:
+            # streamed by blocks read in a thread, not read at once by the ASGI handler
+            response = await self.async_client.get('/dicom/asgi_test', headers=self.headers)
+            self.assertIsInstance(response, AsyncFileResponse)
+            self.assertEqual(response['Content-Length'], '1024')
+            self.assertIn('attachment; filename="asgi_test.zip"', response['Content-Disposition'])
+            chunks = [chunk async for chunk in response.streaming_content]
+            response.close()
+            self.assertEqual(len(chunks), 11)
+            self.assertEqual(b''.join(chunks), content)
+
+            response = await self.async_client.get('/dicom/asgi_test',
+                                                   headers=self.headers | {'Range': 'bytes=10-209'})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Length'], '200')
+            self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), content[10:210])
+            response.close()
+
+            response = await self.async_client.get('/dicom/unknown', headers=self.headers)
+            self.assertEqual(response.status_code, 404)
+        finally:
+            delete_file('dicoms', 'asgi_test.zip')
+
+    def test_get_zip_dicom_not_found(self):
+        response = self.client.get('/dicom/unknown')
+        self.assertEqual(response.status_code, 404)
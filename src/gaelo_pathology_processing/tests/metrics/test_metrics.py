@@ -0,0 +1,72 @@
+from django.test import TestCase, override_settings
+import base64, json, os, subprocess, sys, tempfile
+from gaelo_pathology_processing.models import ConversionJob
+from gaelo_pathology_processing.services.metrics import (
+    RETIRED_METRICS_FILE, add_timings, collect_timings, measure_stage, render_metrics, run_with_timings,
+    summarize_timings)
+
+
+def measured_function(size: int, stage: str = 'test') -> int:
+    with measure_stage(stage) as measure:
+        measure.bytes = size
+    return size
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        credentials = base64.b64encode(b'GaelO:GaelO')
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Basic ' + \
+            credentials.decode('utf-8')
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(METRICS_DIR=self.temp_dir.name)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.temp_dir.cleanup()
+
+    def test_collect_timings(self):
+        with collect_timings() as timings:
+            measured_function(10)
+            # timings of a pool process are sent back with the result
+            result, function_timings = run_with_timings(measured_function, 5)
+        self.assertEqual(result, 5)
+        self.assertEqual([timing['bytes'] for timing in function_timings], [5])
+        # run_with_timings collects its own timings only
+        self.assertEqual([timing['bytes'] for timing in timings], [10])
+        summary = summarize_timings(timings + function_timings)
+        self.assertEqual(summary['test']['count'], 2)
+        self.assertEqual(summary['test']['bytes'], 15)
+        self.assertGreater(summary['test']['process_peak_rss'], 0)
+
+    def test_sent_back_timings(self):
+        result, timings = run_with_timings(measured_function, 5, 'sent_back')
+        # recorded by the process receiving them only
+        self.assertEqual(os.listdir(self.temp_dir.name), [])
+        add_timings(timings)
+        self.assertIn('gaelo_stage_bytes_total{stage="sent_back"} 5', render_metrics())
+
+    def test_retire_stopped_processes(self):
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        stages = {'test': {'count': 2, 'seconds': 1.0, 'bytes': 10, 'tiles': 0, 'deduplicated': 0,
+                           'process_peak_rss': 100}}
+        with open(os.path.join(self.temp_dir.name, f'{process.pid}-stopped.json'), 'w') as file:
+            json.dump(stages, file)
+        for scrape in range(2):
+            # counted once in the retired totals
+            self.assertIn('gaelo_stage_duration_seconds_count{stage="test"} 2', render_metrics())
+            self.assertEqual([name for name in os.listdir(self.temp_dir.name) if not name.startswith('.')],
+                             [RETIRED_METRICS_FILE])
+
+    def test_get_metrics(self):
+        measured_function(10)
+        ConversionJob.objects.create(request={})
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        metrics = response.content.decode()
+        self.assertIn('gaelo_stage_duration_seconds_count{stage="test"}', metrics)
+        self.assertIn('gaelo_stage_bytes_total{stage="test"}', metrics)
+        self.assertIn('gaelo_conversion_jobs{status="pending"} 1', metrics)
@@ -0,0 +1,130 @@
+"""
+Synthetic data generators for the tests and the benchmarks, so they need no sample slide.
+"""
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.encaps import encapsulate
+from pydicom.uid import JPEGBaseline8Bit, generate_uid
+
+VL_WHOLE_SLIDE_MICROSCOPY_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.77.1.6'
+
+
+def generate_tile(rng: np.random.Generator, tile_size: int) -> np.ndarray:
+    """RGB tile looking like stained tissue : smooth color blobs with some noise"""
+    y, x = np.mgrid[0:tile_size, 0:tile_size] / tile_size
+    phase = rng.uniform(0, 2 * np.pi, 3)
+    frequency = rng.uniform(2, 8, 3)
+    channels = [np.sin(frequency[i] * (x + y * (i + 1)) * np.pi + phase[i])
+                for i in range(3)]
+    tile = (np.stack(channels, axis=-1) + 1) * 60 + 120
+    tile += rng.normal(0, 6, tile.shape)
+    return np.clip(tile, 0, 255).astype(np.uint8)
+
+
+def add_glass(image: np.ndarray, tissue: float, rng: np.random.Generator) -> None:
+    """Replaces the pixels outside of a centered disc of diameter tissue * width by blank glass"""
+    height, width = image.shape[:2]
+    y, x = np.ogrid[0:height, 0:width]
+    glass = (x - width / 2) ** 2 + (y - height / 2) ** 2 > (tissue * width / 2) ** 2
+    image[glass] = np.clip(rng.normal(236, 2, (int(glass.sum()), 3)), 0, 255).astype(np.uint8)
+
+
+def encode_jpeg(tile: np.ndarray, quality: int = 95) -> bytes:
+    buffer = BytesIO()
+    Image.fromarray(tile).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def write_wsi_instance(path: str, tile_size: int = 256, frames: int = 64, seed: int = 0) -> None:
+    """Writes a tiled VL Whole Slide Microscopy instance of frames JPEG baseline tiles"""
+    rng = np.random.default_rng(seed)
+    tiles_per_row = int(np.ceil(np.sqrt(frames)))
+
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = VL_WHOLE_SLIDE_MICROSCOPY_IMAGE_STORAGE
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    file_meta.TransferSyntaxUID = JPEGBaseline8Bit
+    dataset = Dataset()
+    dataset.file_meta = file_meta
+    dataset.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    dataset.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    dataset.StudyInstanceUID = generate_uid()
+    dataset.SeriesInstanceUID = generate_uid()
+    dataset.Modality = 'SM'
+    dataset.PatientName = 'Synthetic'
+    dataset.PatientID = 'Synthetic'
+    dataset.ImageType = ['DERIVED', 'PRIMARY', 'VOLUME', 'NONE']
+    dataset.DimensionOrganizationType = 'TILED_FULL'
+    dataset.TotalPixelMatrixColumns = tiles_per_row * tile_size
+    dataset.TotalPixelMatrixRows = int(np.ceil(frames / tiles_per_row)) * tile_size
+    dataset.Rows = tile_size
+    dataset.Columns = tile_size
+    dataset.NumberOfFrames = frames
+    dataset.SamplesPerPixel = 3
+    dataset.PhotometricInterpretation = 'YBR_FULL_422'
+    dataset.PlanarConfiguration = 0
+    dataset.BitsAllocated = 8
+    dataset.BitsStored = 8
+    dataset.HighBit = 7
+    dataset.PixelRepresentation = 0
+    dataset.LossyImageCompression = '01'
+    dataset.PixelData = encapsulate(
+        [encode_jpeg(generate_tile(rng, tile_size)) for _ in range(frames)])
+    dataset['PixelData'].VR = 'OB'
+    dataset.save_as(path, enforce_file_format=True)
+
+
+def write_tiff_slide(path: str, size: int = 1024, tile_size: int = 256, levels: int = 2, seed: int = 0,
+                     tissue: float = 1) -> None:
+    """
+    Writes a tiled pyramidal TIFF (generic-tiff for OpenSlide) of size x size pixels at 0.25 mpp, with tissue
+    in a centered disc of diameter tissue * size when tissue < 1
+    """
+    import tifffile
+
+    rng = np.random.default_rng(seed)
+    tiles_per_row = int(np.ceil(size / tile_size))
+    rows = [np.concatenate([generate_tile(rng, tile_size) for _ in range(tiles_per_row)], axis=1)
+            for _ in range(tiles_per_row)]
+    image = np.concatenate(rows, axis=0)[:size, :size]
+    if tissue < 1:
+        add_glass(image, tissue, rng)
+    with tifffile.TiffWriter(path) as tiff:
+        for level in range(levels):
+            downsample = 2 ** level
+            options = {'resolution': (40000, 40000), 'resolutionunit': 'CENTIMETER'} if level == 0 \
+                else {'subfiletype': 1}
+            tiff.write(image[::downsample, ::downsample], tile=(tile_size, tile_size), photometric='rgb',
+                       compression='jpeg', **options)
+
+
+def write_svs_slide(path: str, size: int = 4096, tile_size: int = 256, levels: int = 3, seed: int = 0,
+                    tissue: float = 1) -> None:
+    """
+    Writes an Aperio SVS (JPEG tiles, 4x downsampled levels) of size x size pixels at 0.25 mpp, with tissue
+    in a centered disc of diameter tissue * size when tissue < 1
+    """
+    import tifffile
+
+    rng = np.random.default_rng(seed)
+    tiles_per_row = int(np.ceil(size / tile_size))
+    image = np.empty((size, size, 3), np.uint8)
+    for row in range(tiles_per_row):
+        strip = np.concatenate([generate_tile(rng, tile_size) for _ in range(tiles_per_row)], axis=1)
+        image[row * tile_size:(row + 1) * tile_size] = strip[:size - row * tile_size, :size]
+    if tissue < 1:
+        add_glass(image, tissue, rng)
+    with tifffile.TiffWriter(path, bigtiff=size * size * 3 >= 2 ** 32) as tiff:
+        for level in range(levels):
+            level_image = image[::4 ** level, ::4 ** level]
+            height, width = level_image.shape[:2]
+            # OpenSlide detects the aperio format and reads the mpp from the ImageDescription
+            description = f'Aperio Image Library v12.0.0 \r\n{size}x{size} [0,0 {size}x{size}] ' \
+                f'({tile_size}x{tile_size}) JPEG/RGB Q=95|AppMag = 40|MPP = 0.25' if level == 0 else \
+                f'Aperio Image Library v12.0.0 \r\n{size}x{size} -> {width}x{height} - ' \
+                f'({tile_size}x{tile_size}) JPEG/RGB Q=95'
+            tiff.write(level_image, tile=(tile_size, tile_size), photometric='rgb', compression='jpeg',
+                       description=description, metadata=None)
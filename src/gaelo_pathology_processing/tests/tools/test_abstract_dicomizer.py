@@ -1,9 +1,10 @@
 from django.test import TestCase
-from gaelo_pathology_processing.services.abstractDicomizer import AbstractDicomizer, OrthancDicomizer, BigPictureDicomizer
+from gaelo_pathology_processing.services.abstractDicomizer import AbstractDicomizer, OrthancDicomizer, BigPictureDicomizer, NativeDicomizer
 from wsidicomizer.metadata import WsiDicomizerMetadata
 from pathlib import Path
 import os
 from gaelo_pathology_processing.services.file_helper import move_to_storage, get_file
+from gaelo_pathology_processing.services.output_profile import get_output_profile
 import tempfile
 from wsidicom.metadata import (
     Equipment,
@@ -26,7 +27,15 @@ class TestAbstractDicomizer(TestCase):
         # self.assertIsInstance(dicomizer, BigPictureDicomizer)
 
         dicomizer = AbstractDicomizer.get_dicomizer(self.wsi_path_aperio.name)
-        self.assertIsInstance(dicomizer, OrthancDicomizer)
+        self.assertIsInstance(dicomizer, NativeDicomizer)
+
+    def test_get_dicomizer_output_profile(self):
+        dicomizer = AbstractDicomizer.get_dicomizer(self.wsi_path_aperio.name, get_output_profile('jpeg'))
+        self.assertIsInstance(dicomizer, NativeDicomizer)
+        # OrthancWSIDicomizer can't encode in JPEG-LS
+        dicomizer = AbstractDicomizer.get_dicomizer(self.wsi_path_aperio.name, get_output_profile('jpegls-direct'))
+        self.assertIsInstance(dicomizer, BigPictureDicomizer)
+        self.assertEqual(dicomizer.output_profile.name, 'jpegls-direct')
 
     
     def test_orthanc_convert_to_dicom(self):
@@ -0,0 +1,50 @@
+from django.test import TestCase
+import os, tempfile, zipfile
+from pydicom import dcmread
+from gaelo_pathology_processing.tests.synthetic import write_wsi_instance
+from gaelo_pathology_processing.services.archive_writer import DicomArchiveWriter
+from gaelo_pathology_processing.services.file_helper import open_storage_writer, is_file_exists, get_path, delete_file
+
+
+class TestArchiveWriter(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.instance_path = os.path.join(self.temp_dir.name, 'instance.dcm')
+        write_wsi_instance(self.instance_path, tile_size=64, frames=3)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        if is_file_exists('dicoms', 'test_archive.zip'):
+            delete_file('dicoms', 'test_archive.zip')
+
+    def test_write_archive_in_storage(self):
+        with open_storage_writer('dicoms', 'test_archive.zip') as zip_storage_file:
+            with DicomArchiveWriter(zip_storage_file) as archive:
+                archive.add_instance_file(self.instance_path)
+                with open(self.instance_path, 'rb') as instance:
+                    archive.add_instance(instance.read())
+            # not visible in the storage before the end of the block
+            self.assertFalse(is_file_exists('dicoms', 'test_archive.zip'))
+        self.assertEqual(archive.number_of_instances, 2)
+
+        with zipfile.ZipFile(get_path('dicoms', 'test_archive.zip')) as zip_file:
+            infos = zip_file.infolist()
+            self.assertEqual(len(infos), 2)
+            # JPEG baseline instances are stored without deflate
+            self.assertTrue(all(info.compress_type == zipfile.ZIP_STORED for info in infos))
+            with zip_file.open(infos[0]) as instance:
+                self.assertEqual(dcmread(instance).SOPInstanceUID,
+                                 dcmread(self.instance_path).SOPInstanceUID)
+
+    def test_write_archive_failure(self):
+        with self.assertRaises(RuntimeError):
+            with open_storage_writer('dicoms', 'test_archive.zip') as zip_storage_file:
+                with DicomArchiveWriter(zip_storage_file) as archive:
+                    archive.add_instance_file(self.instance_path)
+                    raise RuntimeError('conversion failed')
+        self.assertFalse(is_file_exists('dicoms', 'test_archive.zip'))
+        # the partial file is removed
+        self.assertEqual(
+            [name for name in os.listdir(os.path.dirname(get_path('dicoms', 'test_archive.zip')))
+             if name.endswith('.part')], [])
@@ -0,0 +1,93 @@
+from django.test import TestCase
+import os, shutil, tempfile, unittest
+from unittest.mock import patch
+from opentile import OpenTile
+from pydicom import dcmread
+from pydicom.encaps import generate_frames
+from pydicom.uid import generate_uid
+from turbojpeg import TurboJPEG
+from wsidicom import WsiDicom
+from wsidicom.codec import Encoder
+from gaelo_pathology_processing.tests.synthetic import write_svs_slide, write_tiff_slide
+from gaelo_pathology_processing.services.tiled_pyramid import WrittenFramesCounter
+from gaelo_pathology_processing.services.abstractDicomizer import BigPictureDicomizer
+from gaelo_pathology_processing.services.output_profile import get_output_profile
+
+
+def has_turbojpeg() -> bool:
+    """opentile, reading the encoded tiles of the svs slides, needs the libturbojpeg library"""
+    try:
+        TurboJPEG()
+        return True
+    except RuntimeError:
+        return False
+
+
+class TestBigPictureDicomizer(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.slide_path = os.path.join(self.temp_dir.name, 'slide.tiff')
+        write_tiff_slide(self.slide_path, size=1300, levels=2)
+        self.output_path = os.path.join(self.temp_dir.name, 'dicoms')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def convert(self, output_profile: str, progress=None):
+        dicomizer = BigPictureDicomizer(get_output_profile(output_profile), progress=progress)
+        dicomizer.convert(generate_uid(), {'PatientID': '123', 'PatientName': 'John Doe'},
+                          self.slide_path, self.output_path)
+
+    def count_frames(self) -> int:
+        return sum(dcmread(os.path.join(self.output_path, file), stop_before_pixels=True).NumberOfFrames
+                   for file in os.listdir(self.output_path))
+
+    def test_progress(self):
+        for output_profile in ['jpeg', 'passthrough']:
+            shutil.rmtree(self.output_path, ignore_errors=True)
+            progresses = []
+            self.convert(output_profile, progresses.append)
+            # levels 0 to 2 written by wsidicomizer, 9 + 4 + 1 tiles
+            self.assertEqual(progresses[-1].tiles, self.count_frames())
+            self.assertEqual(progresses[-1].tiles, 14)
+
+    def test_written_frames_counter(self):
+        self.convert('jpeg')
+        self.assertEqual(WrittenFramesCounter(self.output_path).count(), 14)
+
+        # a level 0 being written, cut in the middle of its frames
+        path = max((os.path.join(self.output_path, file) for file in os.listdir(self.output_path)),
+                   key=os.path.getsize)
+        with open(path, 'rb') as file:
+            data = file.read()
+        counter = WrittenFramesCounter(self.output_path)
+        with open(path, 'wb') as file:
+            file.write(data[:len(data) // 2])
+        partial = counter.count()
+        self.assertGreater(partial, 5)
+        self.assertLess(partial, 14)
+        with open(path, 'wb') as file:
+            file.write(data)
+        self.assertEqual(counter.count(), 14)
+
+    def test_passthrough_transcoding(self):
+        for output_profile, reencoded in [('jpeg', True), ('passthrough', False)]:
+            shutil.rmtree(self.output_path, ignore_errors=True)
+            with patch.object(WsiDicom, 'save', autospec=True, side_effect=WsiDicom.save) as save:
+                self.convert(output_profile)
+            self.assertEqual(isinstance(save.call_args.kwargs['transcoding'], Encoder), reencoded)
+
+    @unittest.skipUnless(has_turbojpeg(), 'libturbojpeg is not installed')
+    def test_passthrough_copies_source_tiles(self):
+        write_svs_slide(self.slide_path, size=1024, tile_size=256, levels=2)
+        self.convert('passthrough')
+        with OpenTile.open(self.slide_path) as tiler:
+            level = tiler.get_level(0)
+            columns, rows = level.tiled_size.width, level.tiled_size.height
+            source_tiles = [level.get_tile((column, row)) for row in range(rows) for column in range(columns)]
+        level_0 = [dcmread(os.path.join(self.output_path, file)) for file in os.listdir(self.output_path)]
+        level_0 = next(instance for instance in level_0 if instance.TotalPixelMatrixColumns == 1024)
+        frames = list(generate_frames(level_0.PixelData, number_of_frames=level_0.NumberOfFrames))
+        self.assertEqual(len(frames), 16)
+        self.assertEqual(frames, source_tiles)
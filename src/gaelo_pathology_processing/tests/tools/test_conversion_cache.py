@@ -0,0 +1,192 @@
+from django.conf import settings
+from django.test import TestCase, override_settings
+import os, shutil, tempfile, zipfile
+from pydicom import dcmread
+from pydicom.pixels import pixel_array
+from pydicom.uid import generate_uid
+from gaelo_pathology_processing.tests.synthetic import write_tiff_slide, write_wsi_instance
+from gaelo_pathology_processing.services.abstractDicomizer import DICOMIZERS
+from gaelo_pathology_processing.services.archive_writer import DicomArchiveWriter
+from gaelo_pathology_processing.services.conversion_cache import (
+    evict_conversion_cache, get_conversion_cache_key, open_cached_slide, store_cached_slide)
+from gaelo_pathology_processing.services.output_profile import get_output_profile
+
+GENERATED_VRS = ('UI', 'DA', 'TM', 'DT')
+
+
+def read_header(dataset) -> list:
+    """
+    Elements of an instance without the UIDs and the dates of its conversion (with the ICC profile created
+    by wsidicomizer at each conversion), sequences by their items
+    """
+    return [element for element in dataset.iterall()
+            if element.VR not in GENERATED_VRS + ('SQ',) and element.keyword != 'ICCProfile']
+
+
+class TestConversionCache(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        cache_storage = {'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                         'OPTIONS': {'location': os.path.join(self.temp_dir.name, 'cache')}}
+        self.settings_override = override_settings(
+            STORAGES=settings.STORAGES | {'conversion_cache': cache_storage})
+        self.settings_override.enable()
+        self.profile = get_output_profile('jpeg')
+        self.key = get_conversion_cache_key('wsi', self.profile)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.temp_dir.cleanup()
+
+    def store(self, key: str, dicomizer: str = 'native', concatenation: bool = False) -> None:
+        with store_cached_slide(key, dicomizer) as folder:
+            for index in range(2):
+                path = os.path.join(folder, f'{index}.dcm')
+                write_wsi_instance(path, tile_size=64, frames=2, seed=index)
+                # levels of the same slide, or instances of a concatenated level
+                dataset = dcmread(path)
+                dataset.SeriesInstanceUID = '1.2.3.4'
+                if concatenation:
+                    dataset.ConcatenationUID = '1.2.3.5'
+                    dataset.SOPInstanceUIDOfConcatenationSource = '1.2.3.6'
+                    dataset.InConcatenationNumber = index + 1
+                dataset.save_as(path)
+
+    def dicomize(self, dicomizer: str, dicom_tags: dict) -> str:
+        """Folder of the instances of a synthetic slide converted by the dicomizer"""
+        slide_path = os.path.join(self.temp_dir.name, 'slide.tiff')
+        if not os.path.exists(slide_path):
+            write_tiff_slide(slide_path, size=600, levels=1)
+        folder = tempfile.mkdtemp(dir=self.temp_dir.name)
+        DICOMIZERS[dicomizer](self.profile).convert(generate_uid(), dicom_tags, slide_path, folder)
+        return folder
+
+    def convert(self, dicom_tags: dict) -> list:
+        """Datasets of the archive of a conversion from the cached slide"""
+        zip_path = os.path.join(tempfile.mkdtemp(dir=self.temp_dir.name), 'study.zip')
+        with open_cached_slide(self.key) as cached_slide, open(zip_path, 'wb') as zip_storage_file:
+            with DicomArchiveWriter(zip_storage_file) as archive:
+                cached_slide.add_to_archive(archive, '1.2.3', dicom_tags)
+        with zipfile.ZipFile(zip_path) as zip_file:
+            return [dcmread(zip_file.open(info)) for info in zip_file.infolist()]
+
+    def test_cache_key(self):
+        self.assertEqual(self.key, get_conversion_cache_key('wsi', get_output_profile('jpeg')))
+        self.assertNotEqual(self.key, get_conversion_cache_key('wsi', get_output_profile('jpegls-direct')))
+        self.assertNotEqual(self.key, get_conversion_cache_key('other', self.profile))
+        self.assertNotEqual(self.key, get_conversion_cache_key('wsi', self.profile, sparse_tiling=True))
+        with override_settings(DICOMIZER_BACKEND='orthanc'):
+            self.assertNotEqual(self.key, get_conversion_cache_key('wsi', self.profile))
+
+    def test_reuse_cached_slide(self):
+        self.store(self.key)
+        datasets = self.convert({'PatientID': '123', 'PatientName': 'New^Name'})
+        self.assertEqual(len(datasets), 2)
+        for dataset in datasets:
+            self.assertEqual(dataset.StudyInstanceUID, '1.2.3')
+            self.assertEqual(dataset.PatientID, '123')
+            self.assertEqual(dataset.PatientName, 'New^Name')
+            self.assertEqual(dataset.file_meta.MediaStorageSOPInstanceUID, dataset.SOPInstanceUID)
+            self.assertEqual(len(pixel_array(dataset)), 2)
+        # one new series for the slide, new instances
+        self.assertEqual(datasets[0].SeriesInstanceUID, datasets[1].SeriesInstanceUID)
+        self.assertNotEqual(datasets[0].SeriesInstanceUID, '1.2.3.4')
+        self.assertNotEqual(datasets[0].SOPInstanceUID, datasets[1].SOPInstanceUID)
+
+    def test_request_tags(self):
+        self.store(self.key)
+        datasets = self.convert({'PatientID': '123', 'AccessionNumber': 'ACC1', 'StudyDescription': 'Added',
+                                 'ImageType': '', 'NotADicomKeyword': 'ignored'})
+        for dataset in datasets:
+            self.assertEqual(dataset.PatientID, '123')
+            # tags of the request missing from the cached instances
+            self.assertEqual(dataset.AccessionNumber, 'ACC1')
+            self.assertEqual(dataset['AccessionNumber'].VR, 'SH')
+            self.assertEqual(dataset.StudyDescription, 'Added')
+            # set by the dicomizer for each level
+            self.assertEqual(dataset.ImageType, ['DERIVED', 'PRIMARY', 'VOLUME', 'NONE'])
+            self.assertNotIn('NotADicomKeyword', dataset)
+        # defaults of the dicomizer for the tags the request omits
+        for dataset in self.convert({'PatientID': '123'}):
+            self.assertEqual(dataset.AccessionNumber, 'GaelO')
+            self.assertNotIn('StudyDescription', dataset)
+            self.assertNotIn('PatientName', dataset)
+
+    def test_big_picture_request_tags(self):
+        self.store(self.key, 'bigpicture')
+        for dataset in self.convert({'PatientID': '123', 'PatientName': 'New^Name', 'ImageType': '',
+                                     'FocusMethod': 'MANUAL'}):
+            # not written by wsidicomizer
+            self.assertEqual(dataset.PatientID, 'Synthetic')
+            self.assertEqual(dataset.ImageType, ['DERIVED', 'PRIMARY', 'VOLUME', 'NONE'])
+            self.assertNotIn('FocusMethod', dataset)
+            self.assertEqual(dataset.PatientName, 'New^Name')
+            self.assertEqual(dataset.AccessionNumber, '')
+            self.assertEqual(dataset.Manufacturer, 'Unknown')
+
+    def test_cached_headers_match_conversion(self):
+        cached_tags = {'PatientID': 'Cached', 'PatientName': 'Cached', 'StudyID': 'S1', 'AccessionNumber': 'ACC1',
+                       'StudyDescription': 'Cached', 'SeriesDescription': 'Cached', 'SeriesNumber': '2',
+                       'Manufacturer': 'Cached', 'ImageType': '', 'FocusMethod': 'MANUAL'}
+        dicom_tags = {'PatientID': '123', 'PatientName': 'John^Doe'}
+        for dicomizer in ['native', 'bigpicture']:
+            with self.subTest(dicomizer=dicomizer):
+                key = get_conversion_cache_key(dicomizer, self.profile)
+                folder = self.dicomize(dicomizer, cached_tags)
+                with store_cached_slide(key, dicomizer) as cache_folder:
+                    for file in os.listdir(folder):
+                        shutil.move(os.path.join(folder, file), cache_folder)
+                folder = self.dicomize(dicomizer, dicom_tags)
+                converted = sorted((dcmread(os.path.join(folder, file)) for file in os.listdir(folder)),
+                                   key=lambda dataset: dataset.TotalPixelMatrixColumns)
+                with open_cached_slide(key) as cached_slide:
+                    zip_path = os.path.join(tempfile.mkdtemp(dir=self.temp_dir.name), 'study.zip')
+                    with open(zip_path, 'wb') as zip_storage_file, DicomArchiveWriter(zip_storage_file) as archive:
+                        cached_slide.add_to_archive(archive, converted[0].StudyInstanceUID, dicom_tags)
+                with zipfile.ZipFile(zip_path) as zip_file:
+                    cached = sorted((dcmread(zip_file.open(info)) for info in zip_file.infolist()),
+                                    key=lambda dataset: dataset.TotalPixelMatrixColumns)
+                self.assertEqual(len(cached), len(converted))
+                for cached_dataset, converted_dataset in zip(cached, converted):
+                    self.assertEqual(read_header(cached_dataset), read_header(converted_dataset))
+
+    def test_concatenation_uids(self):
+        self.store(self.key, concatenation=True)
+        conversions = [self.convert({}), self.convert({})]
+        for datasets in conversions:
+            # the instances of a conversion stay in one concatenation
+            self.assertEqual(len({dataset.ConcatenationUID for dataset in datasets}), 1)
+            self.assertEqual(len({dataset.SOPInstanceUIDOfConcatenationSource for dataset in datasets}), 1)
+            self.assertNotEqual(datasets[0].ConcatenationUID, '1.2.3.5')
+        self.assertNotEqual(conversions[0][0].ConcatenationUID, conversions[1][0].ConcatenationUID)
+        self.assertNotEqual(conversions[0][0].SOPInstanceUIDOfConcatenationSource,
+                            conversions[1][0].SOPInstanceUIDOfConcatenationSource)
+
+    def test_store_failure(self):
+        with self.assertRaises(ValueError):
+            with store_cached_slide(self.key, 'native') as folder:
+                write_wsi_instance(os.path.join(folder, '000000.dcm'), tile_size=64, frames=2)
+                raise ValueError('conversion failed')
+        with open_cached_slide(self.key) as cached_slide:
+            self.assertIsNone(cached_slide)
+        self.assertEqual(os.listdir(os.path.join(self.temp_dir.name, 'cache')), [])
+
+    def test_evict_least_recently_used(self):
+        other_key = get_conversion_cache_key('other', self.profile)
+        self.store(self.key)
+        self.store(other_key)
+        with open_cached_slide(self.key) as cached_slide:
+            entry_size = cached_slide.manifest['size']
+        os.utime(os.path.join(self.temp_dir.name, 'cache', other_key, 'manifest.json'), (0, 0))
+
+        evict_conversion_cache(entry_size)
+        with open_cached_slide(other_key) as cached_slide:
+            self.assertIsNone(cached_slide)
+        # an entry in use is not evicted
+        with open_cached_slide(self.key) as cached_slide:
+            evict_conversion_cache(0)
+            self.assertTrue(os.path.exists(cached_slide.path))
+        evict_conversion_cache(0)
+        with open_cached_slide(self.key) as cached_slide:
+            self.assertIsNone(cached_slide)
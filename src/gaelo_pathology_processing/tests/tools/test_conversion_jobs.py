@@ -0,0 +1,158 @@
+from django.conf import settings
+from django.test import TestCase, override_settings
+import base64, os, tempfile, uuid
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import patch
+from gaelo_pathology_processing.tests.synthetic import write_tiff_slide
+from gaelo_pathology_processing.models import ConversionJob
+from gaelo_pathology_processing.services.conversion_jobs import claim_pending_jobs, run_job, run_worker
+from gaelo_pathology_processing.services.file_helper import get_hash, move_to_storage
+
+
+class FakePool:
+    """Pool of the worker ending each submitted job with the next outcome : None, an exception to raise in it, or
+    BrokenProcessPool raised by submit itself"""
+
+    def __init__(self, outcomes: list):
+        self.outcomes = outcomes
+        self.submitted = []
+
+    def submit(self, function, job_id) -> Future:
+        outcome = self.outcomes.pop(0)
+        if outcome is BrokenProcessPool:
+            raise BrokenProcessPool()
+        self.submitted.append(job_id)
+        future = Future()
+        if outcome is None:
+            future.set_result(None)
+        else:
+            future.set_exception(outcome)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+class TestConversionJobs(TestCase):
+
+    def setUp(self):
+        credentials = base64.b64encode(b'GaelO:GaelO')
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Basic ' + \
+            credentials.decode('utf-8')
+        self.valid_payload = {
+            "dicom_tags_study": {
+                "PatientID": "123456",
+                "PatientName": "patientName",
+                "StudyID": "4569852",
+            },
+            "slides": [
+                {"dicom_tags_series": {"SeriesDescription": "Serie description 1", "SeriesNumber": '1'},
+                 "wsi_id": "a38c8a8f747e3858c615614e4e0f6d30"},
+                {"dicom_tags_series": {"SeriesDescription": "Serie description 2", "SeriesNumber": '2'},
+                 "wsi_id": "b3a10b48bd26c96df930e7b2ecf0a9a4"},
+            ]
+        }
+
+    def create_job(self) -> dict:
+        response = self.client.post(
+            "/tools/conversion/jobs", self.valid_payload, content_type="application/json")
+        self.assertEqual(response.status_code, 202)
+        return response.json()
+
+    def test_create_job(self):
+        job = self.create_job()
+        self.assertEqual(job['status'], 'pending')
+        self.assertEqual([slide['wsi_id'] for slide in job['slides']], [
+                         "a38c8a8f747e3858c615614e4e0f6d30", "b3a10b48bd26c96df930e7b2ecf0a9a4"])
+
+        response = self.client.get('/tools/conversion/jobs/' + job['id'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], job['id'])
+
+    def test_create_invalid_job(self):
+        del self.valid_payload['dicom_tags_study']['PatientID']
+        response = self.client.post(
+            "/tools/conversion/jobs", self.valid_payload, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_unknown_job(self):
+        response = self.client.get('/tools/conversion/jobs/' + str(uuid.uuid4()))
+        self.assertEqual(response.status_code, 404)
+
+    def test_cancel_job(self):
+        job = self.create_job()
+        response = self.client.post('/tools/conversion/jobs/' + job['id'] + '/cancel')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'cancelled')
+        # a cancelled job is never claimed by the worker
+        self.assertEqual(claim_pending_jobs(10), [])
+
+        response = self.client.post('/tools/conversion/jobs/' + job['id'] + '/cancel')
+        self.assertEqual(response.status_code, 409)
+
+    def test_claim_pending_jobs(self):
+        first_job = self.create_job()
+        self.create_job()
+        claimed = claim_pending_jobs(1)
+        self.assertEqual([str(job_id) for job_id in claimed], [first_job['id']])
+        self.assertEqual(ConversionJob.objects.get(id=claimed[0]).status, ConversionJob.RUNNING)
+
+    def test_create_job_with_dicomizer_options(self):
+        self.valid_payload |= {'dicomizer_workers': 1, 'dicomizer_chunk_size': 4, 'sparse_tiling': True}
+        self.create_job()
+        for option, value in [('dicomizer_workers', 0), ('dicomizer_workers', os.cpu_count() + 1),
+                              ('dicomizer_workers', '1'), ('dicomizer_chunk_size', 0),
+                              ('dicomizer_chunk_size', True), ('sparse_tiling', 'true')]:
+            response = self.client.post(
+                "/tools/conversion/jobs", self.valid_payload | {option: value}, content_type="application/json")
+            self.assertEqual(response.status_code, 400, (option, value))
+
+    def test_run_job_progress(self):
+        with tempfile.TemporaryDirectory() as temp_dir, override_settings(
+                STORAGES=settings.STORAGES | {
+                    name: {'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                           'OPTIONS': {'location': os.path.join(temp_dir, name)}}
+                    for name in ('dicoms', 'wsi', 'conversion_cache', 'extraction_cache')},
+                CONVERSION_PROGRESS_INTERVAL=0):
+            slide_path = os.path.join(temp_dir, 'slide.tiff')
+            write_tiff_slide(slide_path, size=1300, levels=2)
+            wsi_id = get_hash(slide_path)
+            move_to_storage('wsi', slide_path, wsi_id)
+            self.valid_payload['slides'] = [{'dicom_tags_series': {'SeriesDescription': 'Serie description'},
+                                             'wsi_id': wsi_id}]
+            self.valid_payload |= {'dicomizer_workers': 1, 'include_timings': True}
+            job = self.create_job()
+            claim_pending_jobs(1)
+            run_job(job['id'])
+
+            job = ConversionJob.objects.get(id=job['id'])
+            self.assertEqual(job.status, ConversionJob.COMPLETED, job.error)
+            self.assertEqual(job.slides[0]['status'], 'converted')
+            self.assertEqual((job.slides[0]['progress']['tiles'], job.slides[0]['progress']['total_tiles']),
+                             (17, 17))
+            self.assertEqual(job.result['timings']['dicomization']['tiles'], 17)
+            # transcoded in JPEG-LS by the default profile
+            self.assertEqual(job.result['deduplication']['frames'], 17)
+
+    def test_run_worker_failed_job(self):
+        job = self.create_job()
+        with patch('gaelo_pathology_processing.services.conversion_jobs.create_process_pool',
+                   return_value=FakePool([RuntimeError('database is gone')])):
+            run_worker(1, 0, max_iterations=2)
+        job = ConversionJob.objects.get(id=job['id'])
+        self.assertEqual((job.status, job.error), (ConversionJob.FAILED, 'database is gone'))
+
+    def test_run_worker_broken_pool(self):
+        jobs = [self.create_job() for index in range(3)]
+        # the process of the first job dies, the pool is broken when the second one is submitted
+        pools = [FakePool([BrokenProcessPool(), BrokenProcessPool]), FakePool([None, None])]
+        with patch('gaelo_pathology_processing.services.conversion_jobs.create_process_pool',
+                   side_effect=pools) as create_process_pool:
+            run_worker(2, 0, max_iterations=2)
+        self.assertEqual(create_process_pool.call_count, 2)
+        job = ConversionJob.objects.get(id=jobs[0]['id'])
+        self.assertEqual((job.status, job.error),
+                         (ConversionJob.FAILED, 'The conversion process stopped unexpectedly'))
+        # the jobs not started in the broken pool run in the new one
+        self.assertEqual([str(job_id) for job_id in pools[1].submitted], [jobs[1]['id'], jobs[2]['id']])
@@ -1,10 +1,20 @@
-from django.test import TestCase
-import os, base64
+from django.conf import settings
+from django.test import TransactionTestCase, override_settings
+import os, base64, tempfile, zipfile
 from pathlib import Path
-from gaelo_pathology_processing.services.file_helper import move_to_storage
+from unittest.mock import patch
+from pydicom import dcmread
+from gaelo_pathology_processing.tests.synthetic import write_tiff_slide
+from gaelo_pathology_processing.services.conversion import add_files_to_zip, convert_study
+from gaelo_pathology_processing.services.file_helper import delete_file, get_file, get_hash, move_to_storage, store
 
+# UIDs and dates generated for each conversion
+GENERATED_VRS = ('UI', 'DA', 'TM', 'DT')
+
+
+class TestConvertToDicom(TransactionTestCase):
+    """The conversions run in a thread of the executor, its database queries need the committed test data"""
 
-class TestConvertToDicom(TestCase):
 
     def setUp(self):
         credentials = base64.b64encode(b'GaelO:GaelO')
@@ -82,4 +92,120 @@ class TestConvertToDicom(TestCase):
 
         self.assertEqual(response.status_code, 200)
 
+    @override_settings(CONVERSION_SLIDE_WORKERS=2)
+    def test_convert_to_dicom_slide_errors(self):
+        store('wsi', 'invalid_slide_1', b'not a slide')
+        store('wsi', 'invalid_slide_2', b'not a slide either')
+        self.valid_payload['slides'] = [
+            {"dicom_tags_series": {"SeriesNumber": '1'}, "wsi_id": "invalid_slide_1"},
+            {"dicom_tags_series": {"SeriesNumber": '2'}, "wsi_id": "invalid_slide_2"},
+        ]
+
+        response = self.client.post(
+            "/tools/conversion", self.valid_payload, content_type="application/json")
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()['slides'], {'invalid_slide_1': 'Invalid file or unsupported format',
+                                                     'invalid_slide_2': 'Invalid file or unsupported format'})
+        delete_file('wsi', 'invalid_slide_1')
+        delete_file('wsi', 'invalid_slide_2')
+
+    def read_study(self, study_instance_uid: str) -> list:
+        """Instances of the zip of a converted study, in the order of their series and levels"""
+        with get_file('dicoms', study_instance_uid + '.zip') as zip_storage_file, \
+                zipfile.ZipFile(zip_storage_file) as zip_file:
+            datasets = [dcmread(zip_file.open(info)) for info in zip_file.infolist()]
+        delete_file('dicoms', study_instance_uid + '.zip')
+        return sorted(datasets, key=lambda dataset: (int(dataset.SeriesNumber), -dataset.TotalPixelMatrixColumns,
+                                                     dataset.get('InConcatenationNumber', 0)))
+
+    @override_settings(CONVERSION_CACHE_MAX_SIZE=0)
+    def test_convert_to_dicom_serial_and_parallel(self):
+        wsi_ids = []
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for seed in range(2):
+                slide_path = os.path.join(temp_dir, f'slide-{seed}.tiff')
+                write_tiff_slide(slide_path, size=1300, levels=2, seed=seed)
+                wsi_ids.append(get_hash(slide_path))
+                move_to_storage('wsi', slide_path, wsi_ids[-1])
+        self.valid_payload['slides'] = [
+            {"dicom_tags_series": {"SeriesNumber": str(index + 1)}, "wsi_id": wsi_id}
+            for index, wsi_id in enumerate(wsi_ids)]
+        self.valid_payload['output_profile'] = 'jpeg'
+        studies = []
+        try:
+            for workers in (1, 2):
+                with self.settings(CONVERSION_SLIDE_WORKERS=workers):
+                    result = convert_study(self.valid_payload)
+                studies.append(self.read_study(result['study_instance_uid']))
+        finally:
+            for wsi_id in wsi_ids:
+                delete_file('wsi', wsi_id)
+
+        serial, parallel = studies
+        self.assertEqual(len(serial), 12)
+        self.assertEqual(len(parallel), len(serial))
+        for serial_instance, parallel_instance in zip(serial, parallel):
+            self.assertEqual(serial_instance.PixelData, parallel_instance.PixelData)
+            # the same headers apart from the UIDs and dates generated for each conversion
+            self.assertEqual(
+                [element for element in serial_instance.iterall() if element.VR not in GENERATED_VRS],
+                [element for element in parallel_instance.iterall() if element.VR not in GENERATED_VRS])
+
+    def test_convert_to_dicom_cache(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            slide_path = os.path.join(temp_dir, 'slide.tiff')
+            write_tiff_slide(slide_path, size=1300, levels=2)
+            wsi_id = get_hash(slide_path)
+            move_to_storage('wsi', slide_path, wsi_id)
+            cache_storage = {'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                             'OPTIONS': {'location': os.path.join(temp_dir, 'cache')}}
+            self.valid_payload['slides'] = [{"dicom_tags_series": {"SeriesNumber": '1'}, "wsi_id": wsi_id}]
+            self.valid_payload['output_profile'] = 'jpegls-transcode'
+            studies = []
+            try:
+                with self.settings(STORAGES=settings.STORAGES | {'conversion_cache': cache_storage},
+                                   TRANSCODE_WORKERS=1), \
+                        patch('gaelo_pathology_processing.services.conversion.add_files_to_zip',
+                              wraps=add_files_to_zip) as add_files:
+                    for cache_hits in ([], [wsi_id]):
+                        result = convert_study(self.valid_payload)
+                        self.assertEqual(result['cache_hits'], cache_hits)
+                        studies.append(self.read_study(result['study_instance_uid']))
+            finally:
+                delete_file('wsi', wsi_id)
+        # the transcoded instances of the first conversion are added to the zip and kept in the cache at once
+        add_files.assert_called_once()
+        converted, cached = studies
+        self.assertEqual(len(converted), 6)
+        self.assertEqual(len(cached), len(converted))
+        for converted_instance, cached_instance in zip(converted, cached):
+            self.assertEqual(converted_instance.PixelData, cached_instance.PixelData)
+            self.assertEqual(
+                [element for element in converted_instance.iterall() if element.VR not in GENERATED_VRS],
+                [element for element in cached_instance.iterall() if element.VR not in GENERATED_VRS])
+
+    def test_convert_to_dicom_missing_wsi(self):
+        self.valid_payload['slides'][0]['wsi_id'] = 'unknown_wsi'
+        response = self.client.post(
+            "/tools/conversion", self.valid_payload, content_type="application/json")
+        self.assertEqual(response.status_code, 404)
+
+    def test_convert_to_dicom_unknown_output_profile(self):
+        self.valid_payload['output_profile'] = 'unknown'
+        response = self.client.post(
+            "/tools/conversion", self.valid_payload, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_convert_to_dicom_invalid_include_timings(self):
+        self.valid_payload['include_timings'] = 'yes'
+        response = self.client.post(
+            "/tools/conversion", self.valid_payload, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
 
+    @override_settings(DICOM_SINK_URL='')
+    def test_convert_to_dicom_sink_not_configured(self):
+        self.valid_payload['send_to_sink'] = True
+        response = self.client.post(
+            "/tools/conversion", self.valid_payload, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,135 @@
+from django.test import TestCase
+import json, os, tempfile, threading, time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pydicom import dcmread
+from gaelo_pathology_processing.tests.synthetic import write_wsi_instance
+from gaelo_pathology_processing.exceptions import GaelODicomSinkException
+from gaelo_pathology_processing.services.dicom_sink import DicomSink
+
+
+class SinkRequestHandler(BaseHTTPRequestHandler):
+    """Stand-in DICOMweb / Orthanc server recording the stored instances"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        server = self.server
+        with server.lock:
+            server.connections.add(self.client_address)
+            server.requests.append((self.path, self.headers['Content-Type'], body))
+            failures = server.failures
+            server.failures = max(failures - 1, 0)
+            delays = server.delays
+            server.delays = max(delays - 1, 0)
+        if delays:
+            time.sleep(server.delay)
+        content = b'{}'
+        status = 500 if failures else 200
+        if server.failed_sop and not failures:
+            # STOW-RS partial failure : accepted, with the instance in the Failed SOP Sequence
+            status = 202
+            content = json.dumps({'00081198': {'vr': 'SQ', 'Value': [
+                {'00081197': {'vr': 'US', 'Value': [272]}}]}}).encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDicomSink(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), SinkRequestHandler)
+        self.server.lock = threading.Lock()
+        self.server.connections = set()
+        self.server.requests = []
+        self.server.failures = 0
+        self.server.delays = 0
+        self.server.delay = 0
+        self.server.failed_sop = False
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for index in range(6):
+            path = os.path.join(self.temp_dir.name, f'{index}.dcm')
+            write_wsi_instance(path, tile_size=64, frames=2, seed=index)
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+
+    def test_stow_rs(self):
+        with DicomSink(self.url + '/dicom-web', 'stow-rs', concurrency=2) as sink:
+            for path in self.paths:
+                sink.add_instance_file(path)
+        self.assertEqual(sink.stored_instances, 6)
+        self.assertEqual(len(self.server.requests), 6)
+        # keep-alive connections of the pool
+        self.assertLessEqual(len(self.server.connections), 2)
+        sop_instance_uids = set()
+        for path, content_type, body in self.server.requests:
+            self.assertEqual(path, '/dicom-web/studies')
+            message = BytesParser(policy=HTTP).parsebytes(
+                b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+            parts = list(message.iter_parts())
+            self.assertEqual(len(parts), 1)
+            self.assertEqual(parts[0].get_content_type(), 'application/dicom')
+            sop_instance_uids.add(dcmread(BytesIO(parts[0].get_payload(decode=True))).SOPInstanceUID)
+        self.assertEqual(sop_instance_uids, {dcmread(path).SOPInstanceUID for path in self.paths})
+
+    def test_orthanc(self):
+        with DicomSink(self.url, 'orthanc') as sink:
+            with open(self.paths[0], 'rb') as file:
+                sink.add_instance(file.read())
+            with open(self.paths[1], 'rb') as file, sink.open_instance(True, 0) as destination:
+                destination.write(file.read())
+        self.assertEqual(sink.stored_instances, 2)
+        for path, content_type, body in self.server.requests:
+            self.assertEqual(path, '/instances')
+            self.assertEqual(content_type, 'application/dicom')
+        # sent concurrently, in any order
+        bodies = set()
+        for instance_path in self.paths[:2]:
+            with open(instance_path, 'rb') as file:
+                bodies.add(file.read())
+        self.assertEqual({body for path, content_type, body in self.server.requests}, bodies)
+
+    def test_retry_and_failure(self):
+        self.server.failures = 1
+        with DicomSink(self.url, 'orthanc', retries=1) as sink:
+            sink.add_instance_file(self.paths[0])
+        self.assertEqual(sink.stored_instances, 1)
+        self.assertEqual(len(self.server.requests), 2)
+
+        self.server.failures = 2
+        with self.assertRaises(GaelODicomSinkException):
+            with DicomSink(self.url, 'orthanc', retries=1) as sink:
+                sink.add_instance_file(self.paths[0])
+        self.assertEqual(sink.stored_instances, 0)
+
+    def test_retry_timeout(self):
+        self.server.delays = 1
+        self.server.delay = 1
+        with DicomSink(self.url, 'orthanc', timeout=0.2, retries=1) as sink:
+            sink.add_instance_file(self.paths[0])
+        self.assertEqual(sink.stored_instances, 1)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_stow_rs_failed_sop(self):
+        self.server.failed_sop = True
+        with self.assertRaisesRegex(GaelODicomSinkException, 'failure reason 272'):
+            with DicomSink(self.url + '/dicom-web', 'stow-rs', retries=1) as sink:
+                sink.add_instance_file(self.paths[0])
+        self.assertEqual(sink.stored_instances, 0)
+        # a definitive failure, not retried
+        self.assertEqual(len(self.server.requests), 1)
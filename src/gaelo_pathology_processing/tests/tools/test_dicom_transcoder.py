@@ -0,0 +1,90 @@
+from django.test import TestCase, override_settings
+import os, tempfile, zipfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pydicom import dcmread
+from pydicom.encaps import encapsulate, generate_frames, parse_basic_offsets
+from pydicom.pixels import pixel_array
+from pydicom.uid import JPEGLSLossless
+from gaelo_pathology_processing.tests.synthetic import write_wsi_instance
+from gaelo_pathology_processing.services.archive_writer import DicomArchiveWriter
+from gaelo_pathology_processing.services.conversion import add_files_to_zip
+from gaelo_pathology_processing.services.dicom_transcoder import transcode_dicom_frames_to_jpeg_lossless
+from gaelo_pathology_processing.services.metrics import STAGE_TRANSCODE, collect_timings
+
+
+class TestDicomTranscoder(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.temp_dir.name, 'input.dcm')
+        write_wsi_instance(self.input_path, tile_size=64, frames=5)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_transcode_frames_to_jpeg_lossless(self):
+        frames_output = os.path.join(self.temp_dir.name, 'frames.dcm')
+        transcode_dicom_frames_to_jpeg_lossless(self.input_path, frames_output)
+
+        transcoded = dcmread(frames_output)
+        self.assertEqual(transcoded.file_meta.TransferSyntaxUID, JPEGLSLossless)
+        self.assertEqual(transcoded.PhotometricInterpretation, 'RGB')
+        self.assertEqual(transcoded.SOPInstanceUID,
+                         dcmread(self.input_path).SOPInstanceUID)
+        # one Basic Offset Table entry per frame
+        self.assertEqual(len(parse_basic_offsets(transcoded.PixelData)), 5)
+        # lossless : the decoded pixels of the input
+        np.testing.assert_array_equal(
+            pixel_array(frames_output), pixel_array(self.input_path))
+
+    def test_deduplicate_frames(self):
+        dataset = dcmread(self.input_path)
+        frames = list(generate_frames(dataset.PixelData, number_of_frames=5))
+        # the same pixels with other encoded bytes (a JPEG comment after the start of image marker)
+        commented = frames[0][:2] + b'\xFF\xFE\x00\x06test' + frames[0][2:]
+        dataset.PixelData = encapsulate([frames[0], frames[1], frames[0], commented, frames[2]])
+        dataset.save_as(self.input_path)
+
+        output = os.path.join(self.temp_dir.name, 'output.dcm')
+        with collect_timings() as timings:
+            transcode_dicom_frames_to_jpeg_lossless(self.input_path, output)
+        self.assertEqual((timings[0]['tiles'], timings[0]['deduplicated']), (3, 2))
+        transcoded = dcmread(output)
+        self.assertEqual(len(parse_basic_offsets(transcoded.PixelData)), 5)
+        np.testing.assert_array_equal(pixel_array(output), pixel_array(self.input_path))
+
+    @override_settings(TRANSCODE_QUEUE_DEPTH=2)
+    def test_add_transcoded_files_to_zip(self):
+        folder = os.path.join(self.temp_dir.name, 'instances')
+        os.makedirs(folder)
+        for index in range(4):
+            write_wsi_instance(os.path.join(folder, f'{index}.dcm'), tile_size=64, frames=2)
+        zip_path = os.path.join(self.temp_dir.name, 'study.zip')
+        with ThreadPoolExecutor(2) as pool, collect_timings() as timings:
+            with open(zip_path, 'wb') as zip_file, DicomArchiveWriter(zip_file) as archive:
+                self.assertEqual(add_files_to_zip(folder, archive, True, pool), 4)
+        # one transcode stage per instance, sent back by the pool with the path of the transcoded file
+        self.assertEqual(len([timing for timing in timings if timing['stage'] == STAGE_TRANSCODE]), 4)
+        with zipfile.ZipFile(zip_path) as zip_file:
+            for name in zip_file.namelist():
+                with zip_file.open(name) as instance:
+                    self.assertEqual(dcmread(instance).file_meta.TransferSyntaxUID, JPEGLSLossless)
+
+    @override_settings(TRANSCODE_QUEUE_DEPTH=2)
+    def test_add_files_to_cache_folder(self):
+        for compress_jpeg_ls in (False, True):
+            folder = tempfile.mkdtemp(dir=self.temp_dir.name)
+            for index in range(4):
+                write_wsi_instance(os.path.join(folder, f'{index}.dcm'), tile_size=64, frames=2, seed=index)
+            cache_folder = tempfile.mkdtemp(dir=self.temp_dir.name)
+            zip_path = os.path.join(self.temp_dir.name, 'study.zip')
+            with ThreadPoolExecutor(2) as pool:
+                with open(zip_path, 'wb') as zip_file, DicomArchiveWriter(zip_file) as archive:
+                    add_files_to_zip(folder, archive, compress_jpeg_ls, pool, cache_folder)
+            # the added instances are kept in the cache folder, in their order
+            self.assertEqual(sorted(os.listdir(cache_folder)), [f'{index:06d}.dcm' for index in range(4)])
+            with zipfile.ZipFile(zip_path) as zip_file:
+                for info, name in zip(zip_file.infolist(), sorted(os.listdir(cache_folder))):
+                    with open(os.path.join(cache_folder, name), 'rb') as cached:
+                        self.assertEqual(zip_file.read(info), cached.read())
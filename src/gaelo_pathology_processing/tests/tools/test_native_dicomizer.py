@@ -0,0 +1,154 @@
+from django.test import TestCase, override_settings
+import numpy as np
+import os, tempfile
+from unittest.mock import patch
+from openslide import OpenSlide
+from pydicom import dcmread
+from pydicom.uid import generate_uid
+from wsidicom import WsiDicom
+from wsidicom.codec import Encoder
+from gaelo_pathology_processing.tests.synthetic import write_tiff_slide
+from gaelo_pathology_processing.services import tiled_pyramid
+from gaelo_pathology_processing.services.tiled_pyramid import LevelSynthesizer, MissingLevelsWriter
+from gaelo_pathology_processing.services.abstractDicomizer import AbstractDicomizer, NativeDicomizer, OrthancDicomizer
+from gaelo_pathology_processing.services.output_profile import get_output_profile
+
+
+class TestNativeDicomizer(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.slide_path = os.path.join(self.temp_dir.name, 'slide.tiff')
+        write_tiff_slide(self.slide_path, size=1300, levels=2)
+        self.output_path = os.path.join(self.temp_dir.name, 'dicoms')
+        self.study_instance_uid = generate_uid()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def convert(self, progress=None, sparse_tiling=False):
+        dicomizer = NativeDicomizer(get_output_profile('jpeg'), progress=progress, sparse_tiling=sparse_tiling)
+        dicomizer.convert(self.study_instance_uid, {'PatientID': '123', 'PatientName': 'John Doe'},
+                          self.slide_path, self.output_path)
+
+    def read_instances(self) -> list:
+        return [dcmread(os.path.join(self.output_path, file), stop_before_pixels=True)
+                for file in sorted(os.listdir(self.output_path))]
+
+    def test_get_dicomizer(self):
+        dicomizer = AbstractDicomizer.get_dicomizer(self.slide_path, get_output_profile('jpegls-transcode'))
+        self.assertIsInstance(dicomizer, NativeDicomizer)
+        with override_settings(DICOMIZER_BACKEND='orthanc'):
+            dicomizer = AbstractDicomizer.get_dicomizer(self.slide_path, get_output_profile('jpeg'))
+            self.assertIsInstance(dicomizer, OrthancDicomizer)
+
+    def test_convert(self):
+        self.convert()
+        instances = self.read_instances()
+        self.assertEqual(len(instances), 6)
+        self.assertEqual([(instance.TotalPixelMatrixColumns, instance.NumberOfFrames) for instance in instances],
+                         [(1300, 9), (650, 4), (325, 1), (163, 1), (82, 1), (41, 1)])
+        for instance in instances:
+            self.assertEqual(instance.StudyInstanceUID, self.study_instance_uid)
+            self.assertEqual(instance.PatientID, '123')
+            self.assertEqual(instance.SeriesInstanceUID, instances[0].SeriesInstanceUID)
+        self.assertEqual(list(instances[1].ImageType), ['DERIVED', 'PRIMARY', 'VOLUME', 'RESAMPLED'])
+        # 0.25 mpp
+        self.assertEqual(instances[1].SharedFunctionalGroupsSequence[0].PixelMeasuresSequence[0].PixelSpacing,
+                         [0.0005, 0.0005])
+
+        with OpenSlide(self.slide_path) as slide:
+            expected = np.asarray(slide.read_region((200, 200), 0, (800, 800)).convert('RGB'), dtype=float)
+        with WsiDicom.open(self.output_path) as wsi:
+            level_0 = np.asarray(wsi.read_region((200, 200), 0, (800, 800)).convert('RGB'), dtype=float)
+            level_1 = np.asarray(wsi.read_region((100, 100), 1, (400, 400)).convert('RGB'), dtype=float)
+        self.assertLess(np.abs(level_0 - expected).mean(), 2)
+        self.assertLess(np.abs(level_1 - expected.reshape(400, 2, 400, 2, 3).mean(axis=(1, 3))).mean(), 4)
+
+    @patch.object(tiled_pyramid, 'MAX_INSTANCE_SIZE', 512 * 1024)
+    def test_concatenation(self):
+        self.convert()
+        level_0 = [instance for instance in self.read_instances() if instance.TotalPixelMatrixColumns == 1300]
+        self.assertGreater(len(level_0), 1)
+        self.assertEqual(len({instance.ConcatenationUID for instance in level_0}), 1)
+        self.assertEqual([instance.InConcatenationNumber for instance in level_0], list(range(1, len(level_0) + 1)))
+        offsets = np.cumsum([0] + [instance.NumberOfFrames for instance in level_0])
+        self.assertEqual([instance.ConcatenationFrameOffsetNumber for instance in level_0], list(offsets[:-1]))
+        self.assertEqual(offsets[-1], 9)
+        with WsiDicom.open(self.output_path) as wsi:
+            self.assertEqual(wsi.levels[0].size.width, 1300)
+            wsi.read_region((1000, 1000), 0, (300, 300))
+
+    def test_progress(self):
+        progresses = []
+        self.convert(progresses.append)
+        self.assertEqual((progresses[-1].tiles, progresses[-1].total), (17, 17))
+        self.assertEqual([progress.tiles for progress in progresses], sorted(progress.tiles for progress in progresses))
+
+        def cancel(progress):
+            raise InterruptedError('Cancelled')
+
+        with self.assertRaisesRegex(Exception, 'Cancelled'):
+            self.convert(cancel)
+
+    def test_level_synthesizer(self):
+        source = np.random.default_rng(0).integers(0, 256, (1024, 1536, 3), np.uint8)
+        rows = []
+        synthesizer = LevelSynthesizer(1300, 1000, 3, lambda index, pixels: rows.append((index, pixels.copy())))
+        for row in range(2):
+            synthesizer.add_row(source[row * 512:(row + 1) * 512])
+        # level 1 in 1 row of 2 tiles, levels 2 and 3 in 1 tile
+        self.assertEqual([(index, pixels.shape) for index, pixels in rows],
+                         [(1, (512, 1024, 3)), (2, (512, 512, 3)), (3, (512, 512, 3))])
+        expected = source.reshape(512, 2, 768, 2, 3).astype(float).mean(axis=(1, 3))
+        self.assertLess(np.abs(rows[0][1][:, :768] - expected).max(), 1)
+        self.assertTrue((rows[0][1][:, 768:] == 255).all())
+
+    def test_missing_levels(self):
+        self.convert()
+        with WsiDicom.open(self.output_path) as wsi:
+            expected = [np.asarray(wsi.read_region((0, 0), index, (160, 160)).convert('RGB'), dtype=float)
+                        for index in range(3)]
+        for file in os.listdir(self.output_path):
+            if not file.startswith('level-0-'):
+                os.remove(os.path.join(self.output_path, file))
+
+        with WsiDicom.open(self.output_path) as wsi:
+            self.assertEqual(wsi.levels.pyramid_indices, [0])
+            encoder = Encoder.create_for_settings(get_output_profile('jpeg').encoding_settings)
+            MissingLevelsWriter(wsi, encoder, workers=2).write(self.output_path, 5)
+        instances = self.read_instances()
+        self.assertEqual([(instance.TotalPixelMatrixColumns, instance.NumberOfFrames) for instance in instances],
+                         [(1300, 9), (650, 4), (325, 1), (163, 1), (82, 1), (41, 1)])
+        self.assertEqual(len({instance.SeriesInstanceUID for instance in instances}), 1)
+        self.assertEqual(instances[2].SharedFunctionalGroupsSequence[0].PixelMeasuresSequence[0].PixelSpacing,
+                         [0.001, 0.001])
+        with WsiDicom.open(self.output_path) as wsi:
+            self.assertEqual(wsi.levels.pyramid_indices, [0, 1, 2, 3, 4, 5])
+            for index in range(1, 3):
+                region = np.asarray(wsi.read_region((0, 0), index, (160, 160)).convert('RGB'), dtype=float)
+                self.assertLess(np.abs(region - expected[index]).mean(), 2)
+
+    def test_sparse_tiling(self):
+        write_tiff_slide(self.slide_path, size=2600, levels=2, tissue=0.4)
+        with OpenSlide(self.slide_path) as slide:
+            expected = np.asarray(slide.read_region((1000, 1000), 0, (600, 600)).convert('RGB'), dtype=float)
+        progresses = []
+        self.convert(progresses.append, sparse_tiling=True)
+        instances = self.read_instances()
+        self.assertEqual([instance.DimensionOrganizationType for instance in instances], ['TILED_SPARSE'] * 6)
+        # the 3 x 3 tiles of the disc and a margin of 1 tile, out of 6 x 6
+        self.assertEqual(instances[0].NumberOfFrames, 25)
+        self.assertEqual(progresses[-1].tiles, sum(instance.NumberOfFrames for instance in instances))
+        plane_position = instances[0].PerFrameFunctionalGroupsSequence[6].PlanePositionSlideSequence[0]
+        self.assertEqual((plane_position.ColumnPositionInTotalImagePixelMatrix,
+                          plane_position.RowPositionInTotalImagePixelMatrix), (513, 513))
+        self.assertEqual(plane_position.XOffsetInSlideCoordinateSystem, 0.128)
+
+        with WsiDicom.open(self.output_path) as wsi:
+            self.assertEqual(wsi.levels.pyramid_indices, [0, 1, 2, 3, 4, 5])
+            tissue = np.asarray(wsi.read_region((1000, 1000), 0, (600, 600)).convert('RGB'), dtype=float)
+            # not written
+            glass = np.asarray(wsi.read_region((2560, 0), 0, (40, 512)).convert('RGB'), dtype=float)
+        self.assertLess(np.abs(tissue - expected).mean(), 2)
+        self.assertGreater(glass.mean(), 230)
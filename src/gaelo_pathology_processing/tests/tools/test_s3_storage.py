@@ -0,0 +1,99 @@
+from django.conf import settings
+from django.test import RequestFactory, TestCase, override_settings
+import boto3, os, tempfile
+from unittest.mock import patch
+from moto import mock_aws
+from gaelo_pathology_processing.tests.synthetic import write_tiff_slide
+from gaelo_pathology_processing.services.download import create_download_response
+from gaelo_pathology_processing.services.file_helper import (
+    delete_file, get_file, get_hash, is_file_exists, materialize, move_to_storage, open_storage_writer)
+from gaelo_pathology_processing.services.probe import probe_wsi
+from gaelo_pathology_processing.services.s3_storage import S3Storage
+from gaelo_pathology_processing.services.wsi_index import get_wsi_index
+
+S3_STORAGE = {'BACKEND': 'gaelo_pathology_processing.services.s3_storage.S3Storage', 'OPTIONS': {'location': 'wsi'}}
+PART_SIZE = 5 * 1024 * 1024
+
+
+@mock_aws
+class TestS3Storage(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.overrides = override_settings(
+            STORAGES=settings.STORAGES | {
+                'wsi': S3_STORAGE,
+                'materialization_cache': {'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                                          'OPTIONS': {'location': os.path.join(self.temp_dir.name, 'cache')}}},
+            S3_BUCKET='gaelo', S3_REGION='us-east-1', S3_ACCESS_KEY_ID='key', S3_SECRET_ACCESS_KEY='secret',
+            S3_MULTIPART_CHUNK_SIZE=PART_SIZE)
+        self.overrides.enable()
+        self.s3 = boto3.client('s3', region_name='us-east-1', aws_access_key_id='key',
+                               aws_secret_access_key='secret')
+        self.s3.create_bucket(Bucket='gaelo')
+
+    def tearDown(self):
+        self.overrides.disable()
+        self.temp_dir.cleanup()
+
+    def test_multipart_upload_and_materialize(self):
+        path = os.path.join(self.temp_dir.name, 'large')
+        content = os.urandom(2 * PART_SIZE + 1024)
+        with open(path, 'wb') as file:
+            file.write(content)
+        move_to_storage('wsi', path, 'large')
+        self.assertTrue(is_file_exists('wsi', 'large'))
+        # uploaded in 3 parts under the prefix of the storage
+        self.assertTrue(self.s3.head_object(Bucket='gaelo', Key='wsi/large')['ETag'].endswith('-3"'))
+
+        with materialize('wsi', 'large') as local_path:
+            with open(local_path, 'rb') as file:
+                self.assertEqual(file.read(), content)
+        # read through cache
+        with materialize('wsi', 'large') as other_path:
+            self.assertEqual(other_path, local_path)
+        with get_file('wsi', 'large') as file:
+            self.assertEqual(file.read(1024), content[:1024])
+
+        delete_file('wsi', 'large')
+        self.assertFalse(is_file_exists('wsi', 'large'))
+        self.assertFalse(os.path.exists(local_path))
+
+    @override_settings(MATERIALIZATION_CACHE_MAX_SIZE=0)
+    def test_materialize_without_cache(self):
+        with open_storage_writer('wsi', 'small') as file:
+            file.write(b'content')
+        with materialize('wsi', 'small') as local_path:
+            with open(local_path, 'rb') as file:
+                self.assertEqual(file.read(), b'content')
+        self.assertFalse(os.path.exists(local_path))
+
+    def test_download_range(self):
+        content = os.urandom(1024 * 1024)
+        with open_storage_writer('wsi', 'slide') as file:
+            file.write(content)
+        # the downloads stream the object, only the range of a range request is fetched
+        with patch.object(S3Storage, '_open', side_effect=AssertionError('whole object downloaded')):
+            request = RequestFactory().get('/wsi/slide', HTTP_RANGE='bytes=1000-1099')
+            response = create_download_response(request, 'wsi', 'slide', 'slide', 'application/octet-stream',
+                                                '"slide"')
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'], f'bytes 1000-1099/{len(content)}')
+            self.assertEqual(b''.join(response.streaming_content), content[1000:1100])
+            response.close()
+
+            response = create_download_response(RequestFactory().get('/wsi/slide'), 'wsi', 'slide', 'slide',
+                                                'application/octet-stream', '"slide"')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), content)
+            response.close()
+
+    def test_index_stored_wsi(self):
+        path = os.path.join(self.temp_dir.name, 'slide.tiff')
+        write_tiff_slide(path, size=512)
+        wsi_id = get_hash(path)
+        self.assertIsNotNone(probe_wsi(path))
+        move_to_storage('wsi', path, wsi_id)
+        # indexed on its first lookup, from the materialized copy
+        wsi = get_wsi_index(wsi_id)
+        self.assertEqual((wsi.width, wsi.height, wsi.format), (512, 512, 'generic-tiff'))
@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.test import TestCase, override_settings
+import os, tempfile, zipfile
+from gaelo_pathology_processing.services.extraction_cache import (
+    open_extracted_slide, delete_extracted_slide, warm_extraction_cache)
+from gaelo_pathology_processing.services.file_helper import move_to_storage, delete_file
+from gaelo_pathology_processing.services.probe import probe_wsi
+
+
+class TestExtractionCache(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.temp_dir.name, 'cache')
+        cache_storage = {'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                         'OPTIONS': {'location': self.cache_path}}
+        self.settings_override = override_settings(
+            STORAGES=settings.STORAGES | {'extraction_cache': cache_storage})
+        self.settings_override.enable()
+        self.zip_path = os.path.join(self.temp_dir.name, 'slide.zip')
+        with zipfile.ZipFile(self.zip_path, 'w') as zip_file:
+            zip_file.writestr('slide/Data0000.dat', b'data')
+            zip_file.writestr('slide.mrxs', b'mrxs')
+        self.probe = probe_wsi(self.zip_path)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.temp_dir.cleanup()
+
+    def test_extract_once(self):
+        with open_extracted_slide('wsi', self.zip_path, self.probe) as slide_path:
+            self.assertEqual(os.path.basename(slide_path), 'slide.mrxs')
+            self.assertTrue(os.path.isfile(os.path.join(os.path.dirname(slide_path), 'slide', 'Data0000.dat')))
+            # shared by the concurrent users
+            with open_extracted_slide('wsi', self.zip_path, self.probe) as other_slide_path:
+                self.assertEqual(other_slide_path, slide_path)
+        os.remove(self.zip_path)
+        with open_extracted_slide('wsi', self.zip_path, self.probe) as cached_slide_path:
+            self.assertEqual(cached_slide_path, slide_path)
+
+    def test_delete_extracted_slide(self):
+        with open_extracted_slide('wsi', self.zip_path, self.probe) as slide_path:
+            # in use
+            delete_extracted_slide('wsi')
+            self.assertTrue(os.path.isfile(slide_path))
+        delete_extracted_slide('wsi')
+        self.assertFalse(os.path.exists(slide_path))
+
+    @override_settings(EXTRACTION_CACHE_MAX_SIZE=1)
+    def test_evict_above_max_size(self):
+        with open_extracted_slide('wsi', self.zip_path, self.probe) as slide_path:
+            pass
+        with open_extracted_slide('other', self.zip_path, self.probe):
+            self.assertFalse(os.path.exists(slide_path))
+
+    def test_warm_extraction_cache(self):
+        move_to_storage('wsi', self.zip_path, 'extraction_cache_test')
+        try:
+            warm_extraction_cache('extraction_cache_test', self.probe).join()
+            self.assertTrue(os.path.isfile(
+                os.path.join(self.cache_path, 'extraction_cache_test', 'slide', 'slide.mrxs')))
+        finally:
+            delete_file('wsi', 'extraction_cache_test')
@@ -0,0 +1,45 @@
+from django.test import TestCase
+import os, tempfile, zipfile
+from gaelo_pathology_processing.tests.synthetic import write_svs_slide, write_tiff_slide
+from gaelo_pathology_processing.services.probe import probe_wsi, WsiProbe
+
+
+class TestProbe(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_probe_tiff(self):
+        path = os.path.join(self.temp_dir.name, 'slide.tiff')
+        write_tiff_slide(path, size=256, levels=1)
+        self.assertEqual(probe_wsi(path), WsiProbe('generic-tiff', 'file', None, 'orthanc'))
+
+    def test_probe_svs(self):
+        path = os.path.join(self.temp_dir.name, 'slide.svs')
+        write_svs_slide(path, size=512, levels=2)
+        self.assertEqual(probe_wsi(path), WsiProbe('aperio', 'file', None, 'orthanc'))
+
+    def test_probe_zipped_mirax(self):
+        path = os.path.join(self.temp_dir.name, 'slide.zip')
+        with zipfile.ZipFile(path, 'w') as zip_file:
+            zip_file.writestr('slide/Data0000.dat', b'data')
+            zip_file.writestr('slide.mrxs', b'mrxs')
+        self.assertEqual(probe_wsi(path), WsiProbe('mirax', 'zip', 'slide.mrxs', 'orthanc'))
+
+    def test_probe_isyntax(self):
+        path = os.path.join(self.temp_dir.name, 'slide.isyntax')
+        with open(path, 'wb') as file:
+            file.write(b'<DataObject ObjectType="DPUfsImport">\r\n')
+        self.assertEqual(probe_wsi(path), WsiProbe('isyntax', 'file', None, 'bigpicture'))
+
+    def test_probe_unsupported(self):
+        path = os.path.join(os.getcwd(), 'gaelo_pathology_processing', 'tests', 'storage', 'wsi',
+                            'b3a10b48bd26c96df930e7b2ecf0a9a4')  # jpeg
+        self.assertIsNone(probe_wsi(path))
+        path = os.path.join(self.temp_dir.name, 'archive.zip')
+        with zipfile.ZipFile(path, 'w') as zip_file:
+            zip_file.writestr('notes.txt', b'text')
+        self.assertIsNone(probe_wsi(path))
@@ -0,0 +1,82 @@
+from django.test import TestCase, override_settings
+import os, tempfile, threading
+from gaelo_pathology_processing.tests.synthetic import write_tiff_slide
+from gaelo_pathology_processing.services.file_helper import delete_file, get_hash, move_to_storage
+from gaelo_pathology_processing.services.probe import probe_wsi
+from gaelo_pathology_processing.services.slide_pool import (
+    close_idle_slide_handles, close_slide_handle, get_open_slide_handles, open_slide_handle)
+
+
+class TestSlidePool(TestCase):
+
+    def setUp(self):
+        self.wsi_ids = []
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for seed in range(3):
+                path = os.path.join(temp_dir, f'{seed}.tiff')
+                write_tiff_slide(path, size=512, levels=2, seed=seed)
+                self.probe = probe_wsi(path)
+                wsi_id = get_hash(path)
+                move_to_storage('wsi', path, wsi_id)
+                self.wsi_ids.append(wsi_id)
+
+    def tearDown(self):
+        for wsi_id in self.wsi_ids:
+            close_slide_handle(wsi_id)
+            delete_file('wsi', wsi_id)
+
+    def open(self, wsi_id: str):
+        return open_slide_handle(wsi_id, lambda: self.probe)
+
+    def test_shared_handle(self):
+        opened = []
+        with self.open(self.wsi_ids[0]) as handle:
+            self.assertEqual(handle.references, 1)
+
+            def open_in_thread():
+                with self.open(self.wsi_ids[0]) as other_handle:
+                    opened.append(other_handle)
+
+            thread = threading.Thread(target=open_in_thread)
+            thread.start()
+            thread.join()
+            self.assertEqual(handle.slide.dimensions, (512, 512))
+        # opened once, kept open once unused
+        self.assertIs(opened[0], handle)
+        self.assertEqual(handle.references, 0)
+        self.assertIn(self.wsi_ids[0], get_open_slide_handles())
+        with self.open(self.wsi_ids[0]) as other_handle:
+            self.assertIs(other_handle, handle)
+
+    @override_settings(SLIDE_POOL_SIZE=1)
+    def test_max_open(self):
+        with self.open(self.wsi_ids[0]):
+            with self.open(self.wsi_ids[1]) as second_handle:
+                # handles in use are not closed
+                self.assertEqual(set(get_open_slide_handles()), set(self.wsi_ids[:2]))
+            self.assertEqual(get_open_slide_handles(), [self.wsi_ids[0]])
+        with self.open(self.wsi_ids[2]):
+            pass
+        self.assertEqual(get_open_slide_handles(), [self.wsi_ids[2]])
+        # closed handles release their file
+        with self.assertRaises(Exception):
+            second_handle.slide.read_region((0, 0), 0, (1, 1))
+
+    @override_settings(SLIDE_POOL_IDLE_TIMEOUT=0)
+    def test_idle_timeout(self):
+        with self.open(self.wsi_ids[0]):
+            close_idle_slide_handles()
+            self.assertIn(self.wsi_ids[0], get_open_slide_handles())
+        close_idle_slide_handles()
+        self.assertNotIn(self.wsi_ids[0], get_open_slide_handles())
+
+    def test_close_in_use(self):
+        with self.open(self.wsi_ids[0]) as handle:
+            close_slide_handle(self.wsi_ids[0])
+            self.assertNotIn(self.wsi_ids[0], get_open_slide_handles())
+            # still readable by the request using it
+            handle.slide.read_region((0, 0), 0, (1, 1))
+        with self.assertRaises(Exception):
+            handle.slide.read_region((0, 0), 0, (1, 1))
+        with self.open(self.wsi_ids[0]) as other_handle:
+            self.assertIsNot(other_handle, handle)
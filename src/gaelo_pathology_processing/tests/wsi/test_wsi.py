@@ -1,6 +1,8 @@
 from django.test import TestCase
-import os, base64, glob
-from gaelo_pathology_processing.services.file_helper import move_to_storage
+import os, base64, glob, tempfile
+from gaelo_pathology_processing.tests.synthetic import write_tiff_slide
+from gaelo_pathology_processing.models import Wsi
+from gaelo_pathology_processing.services.file_helper import move_to_storage, delete_file, get_hash
 class TestWsi(TestCase):
 
     def setUp(self):
@@ -46,4 +48,29 @@ class TestWsi(TestCase):
         test_storage_path = os.getcwd() + '/gaelo_pathology_processing/tests/storage/wsi/b3a10b48bd26c96df930e7b2ecf0a9a4'
         move_to_storage('wsi', test_storage_path, 'b3a10b48bd26c96df930e7b2ecf0a9a4')
         response = self.client.delete('/wsi/b3a10b48bd26c96df930e7b2ecf0a9a4')
-        self.assertEqual(response.status_code, 200)
\ No newline at end of file
+        self.assertEqual(response.status_code, 200)
+
+    def test_wsi_metadata_index(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'slide.tiff')
+            write_tiff_slide(path, size=512, levels=2)
+            wsi_id = get_hash(path)
+            with open(path, 'rb') as image:
+                response = self.client.post('/wsi', image.read(), content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 200)
+        wsi = Wsi.objects.get(id=wsi_id)
+        self.assertEqual((wsi.format, wsi.container, wsi.backend), ('generic-tiff', 'file', 'orthanc'))
+        self.assertEqual((wsi.width, wsi.height, wsi.level_count), (512, 512, 2))
+        self.assertEqual(wsi.level_downsamples, [1.0, 2.0])
+        self.assertEqual(wsi.mpp_x, 0.25)
+
+        # served from the index, the slide is not opened
+        delete_file('wsi', wsi_id)
+        response = self.client.get(f'/wsi/{wsi_id}/metadata')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['gaelo.width'], 512)
+        self.assertEqual(response.json()['openslide.vendor'], 'generic-tiff')
+
+    def test_get_wsi_metadata_not_found(self):
+        response = self.client.get('/wsi/unknown/metadata')
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,58 @@
+from django.test import TestCase
+import base64, os, tempfile
+from io import BytesIO
+from PIL import Image
+from gaelo_pathology_processing.tests.synthetic import write_tiff_slide
+from gaelo_pathology_processing.services.deepzoom import tile_cache
+from gaelo_pathology_processing.services.file_helper import get_hash, move_to_storage
+from gaelo_pathology_processing.services.probe import probe_wsi
+from gaelo_pathology_processing.services.wsi_index import index_wsi
+
+
+class TestWsiDeepZoom(TestCase):
+
+    def setUp(self):
+        credentials = base64.b64encode(b'GaelO:GaelO')
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Basic ' + credentials.decode('utf-8')
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'slide.tiff')
+            write_tiff_slide(path, size=1024, levels=2)
+            self.wsi_id = get_hash(path)
+            index_wsi(self.wsi_id, path, probe_wsi(path))
+            move_to_storage('wsi', path, self.wsi_id)
+
+    def tearDown(self):
+        self.client.delete(f'/wsi/{self.wsi_id}')
+
+    def test_get_dzi(self):
+        response = self.client.get(f'/wsi/{self.wsi_id}/deepzoom.dzi')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Width="1024"', response.content)
+        self.assertIn(b'TileSize="254"', response.content)
+
+    def test_get_tile(self):
+        # level 10 is the 1024 pixels level 0
+        response = self.client.get(f'/wsi/{self.wsi_id}/deepzoom_files/10/1_2.jpeg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        # tiles have an overlap of 1 pixel with their neighbours
+        self.assertEqual(Image.open(BytesIO(response.content)).size, (256, 256))
+        self.assertEqual(tile_cache.get((self.wsi_id, 'tile', 10, 1, 2)), response.content)
+        # served from the cache
+        self.assertEqual(self.client.get(f'/wsi/{self.wsi_id}/deepzoom_files/10/1_2.jpeg').content,
+                         response.content)
+
+        response = self.client.get(f'/wsi/{self.wsi_id}/deepzoom_files/10/9_0.jpeg')
+        self.assertEqual(response.status_code, 404)
+
+    def test_get_thumbnail(self):
+        response = self.client.get(f'/wsi/{self.wsi_id}/thumbnail?size=128')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(BytesIO(response.content)).size, (128, 128))
+        self.assertEqual(self.client.get(f'/wsi/{self.wsi_id}/thumbnail?size=0').status_code, 400)
+
+    def test_deleted_wsi(self):
+        self.client.get(f'/wsi/{self.wsi_id}/deepzoom_files/10/0_0.jpeg')
+        self.client.delete(f'/wsi/{self.wsi_id}')
+        self.assertIsNone(tile_cache.get((self.wsi_id, 'tile', 10, 0, 0)))
+        self.assertEqual(self.client.get(f'/wsi/{self.wsi_id}/deepzoom.dzi').status_code, 404)
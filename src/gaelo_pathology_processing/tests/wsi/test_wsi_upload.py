@@ -0,0 +1,106 @@
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.test import TestCase, override_settings
+import base64, hashlib, os, tempfile
+from unittest.mock import patch
+from gaelo_pathology_processing.tests.synthetic import write_tiff_slide
+from gaelo_pathology_processing.models import UploadSession, Wsi
+from gaelo_pathology_processing.services.file_helper import delete_file, get_hash, is_file_exists
+from gaelo_pathology_processing.services.wsi_upload import register_wsi
+
+
+class TestWsiUpload(TestCase):
+
+    def setUp(self):
+        credentials = base64.b64encode(b'GaelO:GaelO')
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Basic ' + credentials.decode('utf-8')
+        self.temp_dir = tempfile.TemporaryDirectory()
+        uploads_storage = {'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                           'OPTIONS': {'location': os.path.join(self.temp_dir.name, 'uploads')}}
+        self.settings_override = override_settings(STORAGES=settings.STORAGES | {'uploads': uploads_storage})
+        self.settings_override.enable()
+        path = os.path.join(self.temp_dir.name, 'slide.tiff')
+        write_tiff_slide(path, size=512, levels=2)
+        with open(path, 'rb') as file:
+            self.content = file.read()
+        self.md5 = get_hash(path)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.temp_dir.cleanup()
+
+    def create_session(self, md5: str | None = None) -> str:
+        response = self.client.post('/wsi/uploads', {'size': len(self.content), 'md5': md5},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def put_chunk(self, id: str, start: int, end: int, content: bytes | None = None):
+        chunk = self.content[start:end] if content is None else content
+        return self.client.put(f'/wsi/uploads/{id}', chunk, content_type='application/octet-stream',
+                               headers={'Content-Range': f'bytes {start}-{end - 1}/{len(self.content)}',
+                                        'Content-MD5': base64.b64encode(hashlib.md5(chunk).digest()).decode()})
+
+    def test_chunked_upload(self):
+        id = self.create_session(self.md5)
+        size = len(self.content)
+        chunks = [(size // 2, size), (0, size // 3), (size // 3, size // 2)]
+        for start, end in chunks:
+            response = self.put_chunk(id, start, end)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['md5'], hashlib.md5(self.content[start:end]).hexdigest())
+        response = self.client.get(f'/wsi/uploads/{id}')
+        self.assertEqual(response.json()['received'], size)
+        self.assertEqual(response.json()['missing'], [])
+
+        response = self.client.post(f'/wsi/uploads/{id}/finalize')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], self.md5)
+        try:
+            self.assertTrue(is_file_exists('wsi', self.md5))
+            self.assertEqual(Wsi.objects.get(id=self.md5).format, 'generic-tiff')
+            self.assertFalse(UploadSession.objects.filter(id=id).exists())
+            self.assertEqual(os.listdir(os.path.join(self.temp_dir.name, 'uploads')), [])
+        finally:
+            delete_file('wsi', self.md5)
+
+    def test_incomplete_upload(self):
+        id = self.create_session()
+        self.assertEqual(self.put_chunk(id, 0, 100).status_code, 200)
+        self.assertEqual(self.put_chunk(id, 200, 300).status_code, 200)
+        response = self.client.get(f'/wsi/uploads/{id}')
+        self.assertEqual(response.json()['missing'], [[100, 200], [300, len(self.content)]])
+        response = self.client.post(f'/wsi/uploads/{id}/finalize')
+        self.assertEqual(response.status_code, 409)
+        # the upload can be resumed
+        self.assertEqual(self.put_chunk(id, 100, 200).status_code, 200)
+        self.assertEqual(self.client.delete(f'/wsi/uploads/{id}').status_code, 200)
+        self.assertEqual(self.client.get(f'/wsi/uploads/{id}').status_code, 404)
+
+    def test_md5_mismatch(self):
+        id = self.create_session('0' * 32)
+        self.assertEqual(self.put_chunk(id, 0, len(self.content)).status_code, 200)
+        response = self.client.post(f'/wsi/uploads/{id}/finalize')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(UploadSession.objects.get(id=id).status, UploadSession.UPLOADING)
+
+    def test_invalid_chunk(self):
+        id = self.create_session()
+        # body shorter than its range
+        self.assertEqual(self.put_chunk(id, 0, 100, self.content[:50]).status_code, 400)
+        # corrupted chunk
+        response = self.client.put(f'/wsi/uploads/{id}', self.content[:100], content_type='application/octet-stream',
+                                   headers={'Content-Range': f'bytes 0-99/{len(self.content)}',
+                                            'Content-MD5': base64.b64encode(b'0' * 16).decode()})
+        self.assertEqual(response.status_code, 400)
+        # range outside of the file
+        self.assertEqual(self.put_chunk(id, len(self.content), len(self.content) + 10, b'0' * 10).status_code, 400)
+        self.assertEqual(self.client.get(f'/wsi/uploads/{id}').json()['received'], 0)
+
+    def test_failed_move_is_not_indexed(self):
+        path = os.path.join(self.temp_dir.name, 'slide.tiff')
+        with patch('gaelo_pathology_processing.services.wsi_upload.move_to_storage',
+                        side_effect=OSError('storage unavailable')):
+            with self.assertRaises(OSError):
+                async_to_sync(register_wsi)(path, self.md5)
+        self.assertFalse(Wsi.objects.filter(id=self.md5).exists())
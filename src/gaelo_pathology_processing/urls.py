@@ -20,8 +20,18 @@ from .controller import *
 urlpatterns = [
     path("", WelcomeView.as_view()),
     path("wsi", WsiView.as_view()),
+    path('wsi/uploads', WsiUploadsView.as_view()),
+    path('wsi/uploads/<uuid:id>', WsiUploadView.as_view()),
+    path('wsi/uploads/<uuid:id>/finalize', WsiUploadFinalizeView.as_view()),
     path('wsi/<str:id>', WsiView.as_view()),
     path('dicom/<str:id>', DicomView.as_view()),
     path('tools/conversion', ConvertToDicomView.as_view()),
-    path('wsi/<str:id>/metadata', WsiMetadata.as_view() )
+    path('tools/conversion/jobs', ConversionJobsView.as_view()),
+    path('tools/conversion/jobs/<uuid:id>', ConversionJobView.as_view()),
+    path('tools/conversion/jobs/<uuid:id>/cancel', ConversionJobCancelView.as_view()),
+    path('wsi/<str:id>/metadata', WsiMetadata.as_view() ),
+    path('wsi/<str:id>/deepzoom.dzi', WsiDeepZoomView.as_view()),
+    path('wsi/<str:id>/deepzoom_files/<int:level>/<int:column>_<int:row>.jpeg', WsiTileView.as_view()),
+    path('wsi/<str:id>/thumbnail', WsiThumbnailView.as_view()),
+    path('metrics', MetricsView.as_view()),
 ]
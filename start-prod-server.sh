@@ -1,2 +1,2 @@
 #!/bin/sh
-gunicorn /home/gaelo_pathology_processing.wsgi --bind 0.0.0.0:8000 --timeout 60 --access-logfile - --error-logfile -
\ No newline at end of file
+gunicorn gaelo_pathology_processing.asgi:application --worker-class uvicorn_worker.UvicornWorker --bind 0.0.0.0:8000 --timeout 60 --access-logfile - --error-logfile -
\ No newline at end of file